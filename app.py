@@ -1,13 +1,17 @@
-import os, json, time
+import os, json, math, time, queue
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from flask import (
     Flask,
+    Response,
     jsonify,
     request,
     render_template,
     send_from_directory,
+    stream_with_context,
 )
 from dotenv import load_dotenv
 from werkzeug.exceptions import HTTPException
+from werkzeug.utils import secure_filename
 from flask.typing import ResponseReturnValue
 
 # ---- 環境
@@ -24,22 +28,15 @@ try:
 except Exception:
     _HAS_CORS = False
 
-# ---- アートスタイル
-ALLOWED_ART_STYLES = {"realistic", "sculpture"}
-STYLE_FALLBACKS = {
-    "cartoon": "realistic",
-    "lowpoly": "realistic",
-    "anime": "realistic",
-    "toon": "realistic",
-}
-
-
-def normalize_art_style(s: str | None) -> str:
-    if not s:
-        return "realistic"
-    s = s.strip().lower()
-    return s if s in ALLOWED_ART_STYLES else STYLE_FALLBACKS.get(s, "realistic")
-
+# ---- 診断ロジック
+from utils.profile import (
+    TRAITS,
+    FIVE_CHOICES_SCORES,
+    normalize_art_style,
+    scores_to_profile,
+    profile_to_prompt,
+    scores_to_summary_lines,
+)
 
 # ---- 外部クライアント
 from utils.meshy_client import (
@@ -52,11 +49,31 @@ from utils.meshy_client import (
     get_animation_task,
     download_file,
     MeshyError,
+    MeshyRateLimited,
 )
-from utils.gemini_client import generate_questions_v1, summarize_profile_jp
+from utils.gemini_client import fallback_summary_jp
+from utils.summary_cache import get_summary
+from utils.question_pool import get_question_set, start_refill
 
 # 🔥 Firebase
-from utils.firebase_storage import register_model_from_url, list_models
+from utils.firebase_storage import (
+    register_model_from_url,
+    store_model_from_url,
+    list_models_page,
+    encode_cursor,
+)
+
+# ---- バックグラウンドジョブ / タスク状態キャッシュ
+from utils.jobs import submit_job, get_job, fan_out
+from utils.task_cache import get_task_status, is_terminal, wait_for_update
+from utils.task_events import subscribe, unsubscribe
+from utils.webhooks import WEBHOOKS_ENABLED, verify_token, ingest_task_update, init_webhooks
+from utils import model_cache, catalog_cache, download_cache, pipeline
+from utils.response_policy import init_response_policy
+from utils import metrics
+from utils.metrics import init_metrics
+from utils import tracing
+from utils.tracing import init_tracing
 
 # ---- Flask
 app = Flask(__name__, static_folder="static", template_folder="templates")
@@ -66,6 +83,9 @@ if _HAS_CORS:
 DOWNLOAD_DIR = os.path.join(os.path.dirname(__file__), "downloads")
 os.makedirs(DOWNLOAD_DIR, exist_ok=True)
 
+# 質問プールの初回補充（各ワーカーの起動時）
+start_refill()
+
 
 # ---- ログ & キャッシュ
 @app.before_request
@@ -73,10 +93,14 @@ def _log_req():
     print(f">>> {request.method} {request.path}")
 
 
-@app.after_request
-def nocache(resp):
-    resp.headers["Cache-Control"] = "no-store"
-    return resp
+# キャッシュ方針（静的ファイルの fingerprint・圧縮・/api の no-store）
+init_response_policy(app)
+# ルートごとの所要時間・同時実行数と /metrics
+init_metrics(app)
+# span の記録と Server-Timing（TRACE_ENABLED=1 のときだけ）
+init_tracing(app)
+# 他のワーカーが受けた Meshy Webhook の監視（MESHY_WEBHOOK_SECRET があるときだけ）
+init_webhooks(app)
 
 
 @app.errorhandler(Exception)
@@ -113,11 +137,36 @@ def api_ping():
 
 
 # ---- 図鑑 API
+CATALOG_PAGE_SIZE = 24
+CATALOG_MAX_PAGE_SIZE = 50
+
+
 @app.route("/api/catalog", methods=["GET"])
 def api_catalog_list():
     try:
-        models = list_models(limit=50)
-        return jsonify({"ok": True, "models": models})
+        limit = int(request.args.get("limit", CATALOG_PAGE_SIZE))
+    except ValueError:
+        limit = CATALOG_PAGE_SIZE
+    limit = max(1, min(CATALOG_MAX_PAGE_SIZE, limit))
+    cursor = (request.args.get("cursor") or "").strip() or None
+    try:
+        if cursor:
+            models, next_cursor = list_models_page(limit, cursor)
+            resp = jsonify({"ok": True, "models": models, "next_cursor": next_cursor})
+            resp.add_etag()
+        else:
+            # 1ページ目はスナップショットから（次ページの有無が分かるよう上限より1件多く持つ）
+            models, etag = catalog_cache.get_snapshot(
+                lambda n: list_models_page(n)[0], CATALOG_MAX_PAGE_SIZE + 1
+            )
+            page = models[:limit]
+            next_cursor = encode_cursor(page[-1]) if len(models) > limit else None
+            resp = jsonify({"ok": True, "models": page, "next_cursor": next_cursor})
+            resp.set_etag(f"{etag}-{limit}")
+        resp.headers["Cache-Control"] = f"public, max-age={catalog_cache.CATALOG_MAX_AGE_SEC}"
+        return resp.make_conditional(request)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 500
 
@@ -152,105 +201,108 @@ def api_quiz_questions():
     except Exception:
         count = 10
     count = max(1, min(10, count))
-    return jsonify(generate_questions_v1(desired_count=count))
-
-
-# ---- スコア定義
-TRAITS = [
-    {"id": "energy", "left": "内向的", "right": "外交的"},
-    {"id": "imagination", "left": "現実志向", "right": "直感的"},
-    {"id": "decision", "left": "感情重視", "right": "論理重視"},
-    {"id": "order", "left": "柔軟", "right": "計画的"},
-]
-FIVE_CHOICES_SCORES = [-2, -1, 0, 1, 2]
-
-
-def scores_to_profile(scores: dict[str, int]) -> dict:
-    norm = {k: max(-1.0, min(1.0, v / 20.0)) for k, v in scores.items()}
-    vibe = []
-    if norm.get("energy", 0) > 0.2:
-        vibe.append("cheerful")
-    elif norm.get("energy", 0) < -0.2:
-        vibe.append("calm")
-    if norm.get("decision", 0) > 0.2:
-        vibe.append("cool and sharp")
-    elif norm.get("decision", 0) < -0.2:
-        vibe.append("cute and friendly")
-    theme = "fantasy mage" if norm.get("imagination", 0) > 0 else "student uniform"
-    details = (
-        "tidy and organized outfit"
-        if norm.get("order", 0) > 0
-        else "playful accessories"
-    )
-    e = norm.get("energy", 0)
-    d = norm.get("decision", 0)
-    if e >= 0.3 and d <= 0:
-        color = "pastel pink"
-    elif e >= 0.3 and d > 0:
-        color = "mint green"
-    elif e < 0.3 and d > 0:
-        color = "navy blue"
-    else:
-        color = "lavender"
-    return {
-        "vibe": vibe or ["balanced"],
-        "theme": theme,
-        "details": details,
-        "color": color,
-        "norm": norm,
-    }
+    return jsonify(get_question_set(desired_count=count))
 
 
-def profile_to_prompt(profile: dict) -> tuple[str, str]:
-    """リギングしやすい“人型二足歩行”の指示に最適化"""
-    tags = [
-        "humanoid bipedal character, humanlike proportions",
-        "clear limbs and joints, rig-friendly topology",
-        "standing A or T-pose, facing front",
-        ", ".join(profile["vibe"]),
-        f'{profile["color"]} color scheme',
-        profile["theme"],
-        profile["details"],
-        "anime or stylized, cel-shaded, clean topology",
-        "single character, full-body",
-    ]
-    prompt = ", ".join(tags)
-    negative = "super-deformed, chibi, 2.5-heads, big head small body, low quality, low resolution, low poly, deformed hands, extra limbs, photorealistic"
-    return prompt, negative
-
-
-def scores_to_summary_lines(profile: dict) -> list[str]:
-    n = profile["norm"]
-
-    def side(t, l, r):
-        v = n.get(t, 0)
-        if v > 0.3:
-            return f"{r}寄り"
-        if v < -0.3:
-            return f"{l}寄り"
-        return "バランス型"
-
-    return [
-        f"エネルギー: {side('energy','内向','外向')} / 発想: {side('imagination','現実','直感')}",
-        f"判断: {side('decision','感情','論理')} / 進め方: {side('order','柔軟','計画')}",
-        f"雰囲気は {', '.join(profile['vibe'])}、テーマは {profile['theme']}、基調色は {profile['color']}。",
-    ]
+def _meshy_error(e: MeshyError):
+    """Meshy のエラー応答。レート制限は一時的なので 503/429 + Retry-After で返す（それ以外は 400）。"""
+    if isinstance(e, MeshyRateLimited):
+        resp = jsonify({"error": str(e), "retry_after": e.retry_after})
+        resp.headers["Retry-After"] = str(max(1, math.ceil(e.retry_after)))
+        return resp, e.status
+    return jsonify({"error": str(e)}), 400
 
 
 # ---- 内部: Meshy待ち
-def _wait_task_succeeded(task_id: str, max_wait_sec: int = 120, interval_sec: int = 2):
-    waited = 0
+# Webhook が届けば即座に起き、届かなければ間隔を伸ばしながらポーリングする
+# （Webhook の有無でポーリングの上限は変えない。通知が届かないときの保険として同じ間隔で見る）
+WAIT_MAX_INTERVAL_SEC = 8
+
+
+def _wait_task_succeeded(
+    task_id: str, max_wait_sec: int = 120, interval_sec: int = 2, fetch=get_text_to_3d_task, on_update=None
+):
+    deadline = time.monotonic() + max_wait_sec
+    interval = interval_sec
     last = None
-    while waited < max_wait_sec:
-        last = get_text_to_3d_task(task_id)
-        if last.get("status") == "SUCCEEDED":
-            return last
-        time.sleep(interval_sec)
-        waited += interval_sec
-    return last
+    with tracing.span("meshy.wait_task", task_id=task_id):
+        while True:
+            try:
+                last = get_task_status(task_id, fetch)
+            except MeshyRateLimited as e:
+                # 枠が空かなかっただけなので失敗にはせず、目安の秒数だけ待ってから取り直す
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return last
+                wait_for_update(task_id, min(max(interval, e.retry_after), remaining))
+                continue
+            if on_update is not None:
+                on_update(last)
+            if is_terminal(last):
+                return last
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return last
+            if not wait_for_update(task_id, min(interval, remaining)):
+                interval = min(interval * 2, WAIT_MAX_INTERVAL_SEC)
+
+
+def _wait_and_cache_refine(refine_task_id: str, key: str, params: dict) -> dict:
+    """ジョブ本体: Refine の完成を待ち、Storage に保存してモデルキャッシュへ追加する。"""
+    result = _wait_task_succeeded(refine_task_id, max_wait_sec=600, interval_sec=5)
+    status = (result or {}).get("status")
+    mesh_url = ((result or {}).get("model_urls") or {}).get("glb")
+    if status != "SUCCEEDED" or not mesh_url:
+        return {"task_id": refine_task_id, "status": status, "cached": False}
+    _store_refined(refine_task_id, mesh_url, result.get("thumbnail_url"), key, params)
+    return {"task_id": refine_task_id, "status": status, "cached": True}
+
+
+def _store_refined(refine_task_id: str, mesh_url: str, thumbnail_url, key=None, params=None) -> dict:
+    """Refine の GLB を Storage に保存し、key があればモデルキャッシュへ追加する。"""
+    stored = store_model_from_url(mesh_url)
+    if key:
+        model_cache.add_variant(
+            key,
+            params,
+            {
+                "refine_task_id": refine_task_id,
+                "glb": stored["public_url"],
+                "lod_glb": stored["lod_url"],
+                "path": stored["path"],
+                "thumbnail_url": thumbnail_url,
+            },
+        )
+    return stored
 
 
 # ---- 診断送信
+# サマリー（Gemini）を待つ上限。モデル側（キャッシュ参照/Preview 作成）はリクエストスレッドで最後まで実行する
+# （途中で打ち切ると作成済みの Preview が誰にも渡らず、料金だけかかるため予算には含めない）
+SUBMIT_BUDGET_SEC = float(os.getenv("SUBMIT_BUDGET_SEC", "20"))
+
+
+def _cached_or_preview(key: str, params: dict) -> tuple:
+    """モデルキャッシュを引き、無ければ Preview を作成する。(cached, task_id) を返す。"""
+    cached = model_cache.lookup(key)
+    if cached:
+        return cached, None
+    # Text-to-3D Preview (v2)。Meshy 6 Preview は create_text_to_3d_preview 側で既定 ai_model=latest
+    task_id = create_text_to_3d_preview(dict(params))
+    model_cache.note_pending(task_id, key, params)
+    return None, task_id
+
+
+def _summary_by(future, profile: dict, deadline: float) -> str:
+    """締め切りまでにサマリーが揃わなければ定型文を返す（生成は裏で続き、キャッシュに入る）。"""
+    try:
+        with metrics.SUBMIT_PHASE.time(phase="summary_wait"), tracing.span("submit.summary_wait"):
+            return future.result(timeout=max(0.0, deadline - time.monotonic()))
+    except Exception as e:
+        metrics.SUMMARY_FALLBACK.inc(reason="timeout" if isinstance(e, FutureTimeoutError) else "error")
+        return fallback_summary_jp(profile)
+
+
 @app.post("/api/quiz/submit")
 def api_quiz_submit():
     data = request.get_json(force=True) or {}
@@ -267,12 +319,15 @@ def api_quiz_submit():
 
         profile = scores_to_profile(scores)
         prompt, negative = profile_to_prompt(profile)
-        summary_text = summarize_profile_jp(profile)
 
         art_style = normalize_art_style(data.get("art_style"))
         should_remesh = bool(data.get("should_remesh", True))
         is_a_t_pose = bool(data.get("is_a_t_pose", True))
 
+        # Gemini（サマリー）と Meshy/Storage 側は独立なので、サマリーを並列実行プールへ出して同時に走らせる
+        deadline = time.monotonic() + SUBMIT_BUDGET_SEC
+        summary_future = fan_out(get_summary, profile, timeout=SUBMIT_BUDGET_SEC)
+
         if DEMO_MODE:
             saved = register_model_from_url(
                 SAMPLE_GLB,
@@ -290,54 +345,66 @@ def api_quiz_submit():
                     "progress": 100,
                     "derived_prompt": prompt,
                     "summary_lines": scores_to_summary_lines(profile),
-                    "summary_text": summary_text,
+                    "summary_text": _summary_by(summary_future, profile, deadline),
                     "profile": profile,
                     "model_urls": {"glb": SAMPLE_GLB},
                     "saved_model": saved,
                 }
             )
 
+        params = model_cache.cache_params(prompt, negative, art_style, should_remesh, is_a_t_pose)
+        key = model_cache.cache_key(params)
         try:
-            # Text-to-3D Preview (v2)
-            task_id = create_text_to_3d_preview(
+            with metrics.SUBMIT_PHASE.time(phase="model_wait"), tracing.span("submit.model_wait"):
+                cached, task_id = _cached_or_preview(key, params)
+        except MeshyError as e:
+            return _meshy_error(e)
+        summary_text = _summary_by(summary_future, profile, deadline)
+
+        # 同じ生成パラメータの完成モデルがあれば即返す
+        if cached:
+            return jsonify(
                 {
-                    "prompt": prompt,
-                    "negative_prompt": negative,
-                    "art_style": art_style,
-                    "should_remesh": should_remesh,
-                    "is_a_t_pose": is_a_t_pose,
-                    # Meshy 6 Preview は create_text_to_3d_preview 側で既定 ai_model=latest
+                    "mode": "scores",
+                    "status": "SUCCEEDED",
+                    "progress": 100,
+                    "cached": True,
+                    "derived_prompt": prompt,
+                    "summary_lines": scores_to_summary_lines(profile),
+                    "summary_text": summary_text,
+                    "profile": profile,
+                    "model_urls": {"glb": cached["glb"], "lod_glb": cached.get("lod_glb")},
+                    "thumbnail_url": cached.get("thumbnail_url"),
                 }
             )
 
-            # ここで成功待ち → 自動登録（任意）
-            result = _wait_task_succeeded(task_id, max_wait_sec=120, interval_sec=2)
-            if result and result.get("status") == "SUCCEEDED":
-                mesh_url = (result.get("model_urls") or {}).get("glb")
-                thumb_url = result.get("thumbnail_url")
-                if mesh_url:
-                    register_model_from_url(
-                        mesh_url,
-                        title_or_meta=prompt,
-                        extra={
-                            "user": "anonymous",
-                            "profile": profile,
-                            "thumbnail_url": thumb_url,
-                        },
-                    )
+        # Preview 待ち → 図鑑への自動登録 ∥ Refine → 保存 はサーバー側のパイプラインで進める
+        # （Preview の完了を待つのはパイプラインの preview stage だけ。画面はこの pipeline_id を見る）
+        pipeline_id = pipeline.create(
+            "generation",
+            {
+                "preview_task_id": task_id,
+                "texture_prompt": prompt,
+                "art_style": art_style,
+                "enable_pbr": art_style != "sculpture",
+                "register": {"title": prompt, "profile": profile},
+            },
+        )["id"]
 
-            return jsonify(
+        return (
+            jsonify(
                 {
                     "mode": "scores",
                     "task_id": task_id,
+                    "pipeline_id": pipeline_id,
                     "derived_prompt": prompt,
                     "summary_lines": scores_to_summary_lines(profile),
                     "summary_text": summary_text,
                     "profile": profile,
                 }
-            )
-        except MeshyError as e:
-            return jsonify({"error": str(e)}), 400
+            ),
+            202,
+        )
 
     # --- MBTI互換
     mbti = (data.get("mbti") or "ENFP").upper()
@@ -392,45 +459,66 @@ def api_quiz_submit():
             }
         )
     except MeshyError as e:
-        return jsonify({"error": str(e)}), 400
+        return _meshy_error(e)
+
+
+# ---- ジョブ状態
+@app.get("/api/jobs/<job_id>")
+def api_job_get(job_id: str):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({"error": "job not found"}), 404
+    return jsonify(job)
 
 
 # ---- 進捗
+def _demo_task(task_id: str) -> dict:
+    return {
+        "status": "SUCCEEDED",
+        "progress": 100,
+        "model_urls": {"glb": SAMPLE_GLB},
+        "texture_urls": [],
+    }
+
+
 @app.get("/api/text-to-3d/<task_id>")
 def api_get_task(task_id: str):
     if DEMO_MODE and task_id.startswith("demo_"):
-        return jsonify(
-            {
-                "status": "SUCCEEDED",
-                "progress": 100,
-                "model_urls": {"glb": SAMPLE_GLB},
-                "texture_urls": [],
-            }
-        )
+        return jsonify(_demo_task(task_id))
     try:
-        return jsonify(get_text_to_3d_task(task_id))
+        return jsonify(get_task_status(task_id, get_text_to_3d_task))
     except MeshyError as e:
-        return jsonify({"error": str(e)}), 400
+        return _meshy_error(e)
 
 
 # ---- Refine
-@app.post("/api/text-to-3d/<preview_task_id>/refine")
-def api_refine(preview_task_id: str):
-    data = request.get_json(silent=True) or {}
+def _refine_payload(preview_task_id: str, data: dict) -> dict:
     art_style = normalize_art_style(data.get("art_style"))
     enable_pbr = bool(data.get("enable_pbr", art_style != "sculpture"))
     texture_prompt = (data.get("texture_prompt") or "").strip() or None
+    return {
+        "preview_task_id": preview_task_id,
+        "enable_pbr": enable_pbr,
+        **({"texture_prompt": texture_prompt} if texture_prompt else {}),
+    }
+
+
+def _refine_started(preview_task_id: str, refine_id: str):
+    # 対応付けは Firestore にあるので、Preview を受け付けたのと別のワーカーでも引ける
+    pending = model_cache.pop_pending(preview_task_id)
+    if pending:
+        submit_job("cache_refine", _wait_and_cache_refine, refine_id, *pending)
+    return jsonify({"refine_task_id": refine_id})
+
+
+@app.post("/api/text-to-3d/<preview_task_id>/refine")
+def api_refine(preview_task_id: str):
+    data = request.get_json(silent=True) or {}
     try:
-        refine_id = create_text_to_3d_refine(
-            {
-                "preview_task_id": preview_task_id,
-                "enable_pbr": enable_pbr,
-                **({"texture_prompt": texture_prompt} if texture_prompt else {}),
-            }
-        )
-        return jsonify({"refine_task_id": refine_id})
+        refine_id = create_text_to_3d_refine(_refine_payload(preview_task_id, data))
+        return _refine_started(preview_task_id, refine_id)
     except MeshyError as e:
-        return jsonify({"error": str(e)}), 400
+        return _meshy_error(e)
 
 
 # ---- Rigging
@@ -447,15 +535,15 @@ def api_rigging_create():
         )
         return jsonify({"rig_task_id": rig_id})
     except MeshyError as e:
-        return jsonify({"error": str(e)}), 400
+        return _meshy_error(e)
 
 
 @app.get("/api/rigging/<task_id>")
 def api_rigging_get(task_id: str):
     try:
-        return jsonify(get_rigging_task(task_id))
+        return jsonify(get_task_status(task_id, get_rigging_task))
     except MeshyError as e:
-        return jsonify({"error": str(e)}), 400
+        return _meshy_error(e)
 
 
 # ---- Animation
@@ -471,15 +559,298 @@ def api_animations_create():
         )
         return jsonify({"animation_task_id": ani_id})
     except MeshyError as e:
-        return jsonify({"error": str(e)}), 400
+        return _meshy_error(e)
 
 
 @app.get("/api/animations/<task_id>")
 def api_animations_get(task_id: str):
     try:
-        return jsonify(get_animation_task(task_id))
+        return jsonify(get_task_status(task_id, get_animation_task))
     except MeshyError as e:
+        return _meshy_error(e)
+
+
+# ---- 生成パイプライン（Preview 待ち → Refine → 保存 ∥ Rigging → Animation → 保存 をサーバー側で実行）
+# 診断送信（/api/quiz/submit）か POST /api/pipelines で始まり、ブラウザは集約状態だけを見ればよい
+# （GET /api/pipelines/<id> か、変わるたびに届く /api/pipelines/<id>/events）
+PIPELINE_WAIT_SEC = int(os.getenv("PIPELINE_WAIT_SEC", "600"))  # 各 Meshy タスクの完了を待つ上限
+
+
+def _wait_stage(ctx: pipeline.StageContext, task_id: str, fetch) -> dict:
+    result = _wait_task_succeeded(
+        task_id,
+        max_wait_sec=PIPELINE_WAIT_SEC,
+        interval_sec=2,
+        fetch=fetch,
+        on_update=lambda j: ctx.progress((j or {}).get("progress")),
+    )
+    status = (result or {}).get("status")
+    if status != "SUCCEEDED":
+        raise pipeline.PipelineError(f"task {task_id} ended with {status or 'timeout'}")
+    return result
+
+
+def _stage_preview(ctx: pipeline.StageContext) -> dict:
+    task_id = ctx.params["preview_task_id"]
+    result = _wait_stage(ctx, task_id, get_text_to_3d_task)
+    return {
+        "task_id": task_id,
+        "glb": (result.get("model_urls") or {}).get("glb"),
+        "thumbnail_url": result.get("thumbnail_url"),
+    }
+
+
+def _stage_register(ctx: pipeline.StageContext) -> dict:
+    """Preview を図鑑へ自動登録する（Refine と並行。再開時に二重登録しないよう id を残す）。"""
+    if ctx.state.get("saved_model"):
+        return {"saved_model": ctx.state["saved_model"]}
+    preview = ctx.results["preview"]
+    if not preview.get("glb"):
+        return {"saved_model": None}
+    register = ctx.params["register"]
+    saved = register_model_from_url(
+        preview["glb"],
+        title_or_meta=register.get("title"),
+        extra={
+            "user": "anonymous",
+            "profile": register.get("profile") or {},
+            "thumbnail_url": preview.get("thumbnail_url"),
+        },
+    )
+    ctx.save(saved_model=saved)
+    return {"saved_model": saved}
+
+
+def _stage_refine(ctx: pipeline.StageContext) -> dict:
+    preview_task_id = ctx.params["preview_task_id"]
+    refine_id = ctx.state.get("task_id")
+    if not refine_id:
+        refine_id = create_text_to_3d_refine(_refine_payload(preview_task_id, ctx.params))
+        # 完成時にモデルキャッシュへ入れる対応付けも、再開できるよう一緒に残す
+        pending = model_cache.pop_pending(preview_task_id)
+        ctx.save(task_id=refine_id, cache=list(pending) if pending else None)
+    result = _wait_stage(ctx, refine_id, get_text_to_3d_task)
+    return {
+        "task_id": refine_id,
+        "glb": (result.get("model_urls") or {}).get("glb"),
+        "thumbnail_url": result.get("thumbnail_url"),
+        "cache": ctx.state.get("cache"),
+    }
+
+
+def _stage_store_model(ctx: pipeline.StageContext) -> dict:
+    refine = ctx.results["refine"]
+    key, params = refine.get("cache") or (None, None)
+    stored = _store_refined(refine["task_id"], refine["glb"], refine.get("thumbnail_url"), key, params)
+    return {"glb": stored["public_url"], "lod_glb": stored["lod_url"]}
+
+
+def _stage_rig(ctx: pipeline.StageContext) -> dict:
+    rig_id = ctx.state.get("task_id")
+    if not rig_id:
+        input_task_id = (ctx.results.get("refine") or {}).get("task_id") or ctx.params.get("refine_task_id")
+        rig_id = create_rigging_task(
+            input_task_id=input_task_id,
+            model_url=None if input_task_id else ctx.params.get("model_url"),
+            height_meters=float(ctx.params.get("height_meters", 1.7)),
+        )
+        ctx.save(task_id=rig_id)
+    result = _wait_stage(ctx, rig_id, get_rigging_task)
+    return {"task_id": rig_id, "glb": (result.get("result") or {}).get("rigged_character_glb_url")}
+
+
+def _stage_animate(ctx: pipeline.StageContext) -> dict:
+    ani_id = ctx.state.get("task_id")
+    if not ani_id:
+        rig_task_id = (ctx.results.get("rig") or {}).get("task_id") or ctx.params["rig_task_id"]
+        ani_id = create_animation_task(
+            rig_task_id=rig_task_id,
+            action_id=int(ctx.params["action_id"]),
+            post_process=ctx.params.get("post_process") or None,
+        )
+        ctx.save(task_id=ani_id, rig_task_id=rig_task_id)
+    result = _wait_stage(ctx, ani_id, get_animation_task)
+    res = result.get("result") or {}
+    return {
+        "task_id": ani_id,
+        "rig_task_id": ctx.state.get("rig_task_id"),
+        "glb": res.get("animation_glb_url") or res.get("glb_url"),
+    }
+
+
+def _stage_store_animation(ctx: pipeline.StageContext) -> dict:
+    # Meshy の URL は期限付きなので自前の Storage に残す
+    stored = store_model_from_url(ctx.results["animate"]["glb"])
+    return {"glb": stored["public_url"], "lod_glb": stored["lod_url"]}
+
+
+def _generation_stages(params: dict) -> list:
+    """
+    入力に応じて stage を組む。
+      preview_task_id: Preview 待ち → Refine → 保存（モデルキャッシュにも追加）
+      register: 指定があれば Preview を図鑑へ自動登録する（診断送信から始めたとき）
+      refine_task_id / model_url: 完成済みのモデルから始める（Rigging の入力）
+      rig_task_id: リギング済み（Animation だけ作る）
+      action_id: 指定があれば Rigging → Animation → 保存 を続ける（Refine 後の保存と並行）
+    """
+    Stage = pipeline.Stage
+    stages = []
+    source = ()
+    if params.get("preview_task_id"):
+        stages += [
+            Stage("preview", _stage_preview, weight=30),
+            Stage("refine", _stage_refine, deps=("preview",), weight=40),
+            Stage("store_model", _stage_store_model, deps=("refine",), weight=5, optional=True),
+        ]
+        if params.get("register"):
+            stages.append(Stage("register", _stage_register, deps=("preview",), weight=5, optional=True))
+        source = ("refine",)
+    if params.get("action_id") is not None:
+        if params.get("rig_task_id"):
+            animate_deps = source
+        else:
+            if not (source or params.get("refine_task_id") or params.get("model_url")):
+                raise ValueError("preview_task_id, refine_task_id, model_url or rig_task_id is required")
+            stages.append(Stage("rig", _stage_rig, deps=source, weight=15))
+            animate_deps = ("rig",)
+        stages += [
+            Stage("animate", _stage_animate, deps=animate_deps, weight=10),
+            Stage("store_animation", _stage_store_animation, deps=("animate",), weight=2, optional=True),
+        ]
+    return stages
+
+
+pipeline.register("generation", _generation_stages)
+
+
+def _pipeline_summary(view: dict) -> dict:
+    """stage の結果から画面で使う URL などをまとめる（保存済みのものを優先）。"""
+    res = {name: st.get("result") or {} for name, st in view["stages"].items()}
+    return {
+        "preview_task_id": res.get("preview", {}).get("task_id"),
+        "refine_task_id": res.get("refine", {}).get("task_id"),
+        "rig_task_id": res.get("rig", {}).get("task_id") or res.get("animate", {}).get("rig_task_id"),
+        "model_glb": res.get("store_model", {}).get("glb") or res.get("refine", {}).get("glb"),
+        "lod_glb": res.get("store_model", {}).get("lod_glb"),
+        "animation_glb": res.get("store_animation", {}).get("glb") or res.get("animate", {}).get("glb"),
+        "thumbnail_url": res.get("refine", {}).get("thumbnail_url"),
+        "saved_model": res.get("register", {}).get("saved_model"),
+    }
+
+
+def _pipeline_response(view: dict, status: int = 200):
+    return jsonify({**view, "result": _pipeline_summary(view)}), status
+
+
+@app.post("/api/pipelines")
+def api_pipeline_create():
+    data = request.get_json(force=True) or {}
+    params = {
+        k: (str(data[k]).strip() or None)
+        for k in ("preview_task_id", "refine_task_id", "model_url", "rig_task_id", "texture_prompt", "art_style")
+        if data.get(k)
+    }
+    if "enable_pbr" in data:
+        params["enable_pbr"] = bool(data["enable_pbr"])
+    if data.get("action_id") is not None:
+        try:
+            params["action_id"] = int(data["action_id"])
+        except (TypeError, ValueError):
+            return jsonify({"error": "action_id must be an integer"}), 400
+        try:
+            params["height_meters"] = float(data.get("height_meters", 1.7))
+        except (TypeError, ValueError):
+            return jsonify({"error": "height_meters must be a number"}), 400
+    try:
+        view = pipeline.create("generation", params)
+    except ValueError as e:
+        # _generation_stages が組み立てられない入力（必須の id が無いなど）
         return jsonify({"error": str(e)}), 400
+    return _pipeline_response(view, 202)
+
+
+@app.get("/api/pipelines/<pipeline_id>")
+def api_pipeline_get(pipeline_id: str):
+    view = pipeline.get(pipeline_id)
+    if view is None:
+        return jsonify({"error": "pipeline not found"}), 404
+    return _pipeline_response(view)
+
+
+# ---- 進捗ストリーム（SSE）
+TASK_FETCHERS = {
+    "text-to-3d": get_text_to_3d_task,
+    "rigging": get_rigging_task,
+    "animations": get_animation_task,
+}
+SSE_KEEPALIVE_SEC = 15
+
+
+@app.get("/api/tasks/<task_id>/events")
+def api_task_events(task_id: str):
+    kind = request.args.get("kind", "text-to-3d")
+    fetch = TASK_FETCHERS.get(kind)
+    if fetch is None:
+        return jsonify({"error": f"unknown kind: {kind}"}), 400
+    if DEMO_MODE and task_id.startswith("demo_"):
+        fetch = _demo_task
+
+    def gen():
+        q = subscribe(task_id, fetch)
+        try:
+            while True:
+                try:
+                    event, data = q.get(timeout=SSE_KEEPALIVE_SEC)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+                if event == "error" or is_terminal(data):
+                    return
+        finally:
+            unsubscribe(task_id, q)
+
+    return Response(
+        stream_with_context(gen()),
+        mimetype="text/event-stream",
+        headers={"X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/api/pipelines/<pipeline_id>/events")
+def api_pipeline_events(pipeline_id: str):
+    """集約状態を変わるたびに progress イベントで送る（終了状態を送ったら閉じる）。"""
+    if pipeline.get(pipeline_id) is None:
+        return jsonify({"error": "pipeline not found"}), 404
+
+    def gen():
+        for view in pipeline.watch(pipeline_id, keepalive=SSE_KEEPALIVE_SEC):
+            if view is None:
+                yield ": keep-alive\n\n"
+                continue
+            data = {**view, "result": _pipeline_summary(view)}
+            yield f"event: progress\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    return Response(
+        stream_with_context(gen()),
+        mimetype="text/event-stream",
+        headers={"X-Accel-Buffering": "no"},
+    )
+
+
+# ---- Webhook（Meshy → サーバー）
+@app.post("/api/webhooks/meshy")
+def api_meshy_webhook():
+    if not WEBHOOKS_ENABLED:
+        return jsonify({"error": "webhook is disabled"}), 404
+    token = request.args.get("token") or request.headers.get("X-Webhook-Token")
+    if not verify_token(token):
+        return jsonify({"error": "invalid token"}), 403
+    data = request.get_json(silent=True) or {}
+    task_id = ingest_task_update(data)
+    if not task_id:
+        return jsonify({"error": "task id/status not found"}), 400
+    return jsonify({"ok": True, "task_id": task_id})
 
 
 # ---- ダウンロード中継
@@ -487,20 +858,23 @@ def api_animations_get(task_id: str):
 def api_download():
     data = request.get_json(force=True)
     url = (data.get("url") or "").strip()
-    filename = (data.get("filename") or "model.glb").strip() or "model.glb"
-    dest = os.path.join(DOWNLOAD_DIR, os.path.basename(filename))
+    filename = secure_filename((data.get("filename") or "model.glb").strip()) or "model.glb"
     try:
         if not url.startswith(("http://", "https://")):
             return jsonify({"error": "Download failed: invalid url"}), 400
-        path = download_file(url, dest)
-        return jsonify({"saved": f"/downloads/{os.path.basename(path)}"})
+        # 実体は URL のハッシュ名で共有し（同じ URL は取得済みファイルを返す）、
+        # 指定の保存名は URL の末尾に付ける（保存名ごとに URL が変わるので <model-viewer> も読み直す）
+        name = download_cache.fetch(url, DOWNLOAD_DIR, download_file)
+        return jsonify({"saved": f"/downloads/{name}/{filename}"})
     except MeshyError as e:
-        return jsonify({"error": str(e)}), 400
+        return _meshy_error(e)
 
 
 @app.get("/downloads/<path:fname>")
 def serve_download(fname: str):
-    return send_from_directory(DOWNLOAD_DIR, fname, as_attachment=False)
+    # /downloads/<キャッシュ名>/<保存名>: 中身はキャッシュ名のファイル、Content-Disposition は保存名
+    name, _, display = fname.partition("/")
+    return send_from_directory(DOWNLOAD_DIR, name, as_attachment=False, download_name=display or None)
 
 
 # ---- 起動
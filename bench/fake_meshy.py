@@ -0,0 +1,331 @@
+"""
+Meshy API（v2 Text-to-3D / v1 Rigging / v1 Animation）のローカル代替サーバー。
+タスクは作成からの経過時間で PENDING → IN_PROGRESS → SUCCEEDED と進み、
+完成時の model_urls などはこのサーバー自身が配る GLB / PNG を指す。
+応答の遅延・エラー率・429 の割合・進捗の曲線を変えられる。
+
+単体で起動してアプリの MESHY_API_BASE を向けることもできる:
+    python bench/fake_meshy.py --port 8765 --preview-sec 20
+    MESHY_API_BASE=http://127.0.0.1:8765 python app.py
+"""
+import argparse
+import json
+import random
+import re
+import struct
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+class FakeConfig:
+    def __init__(
+        self,
+        latency_ms: float = 80.0,      # 応答までの平均遅延
+        jitter_ms: float = 40.0,       # 遅延のばらつき（一様乱数の幅）
+        error_rate: float = 0.0,       # 500 を返す割合
+        throttle_rate: float = 0.0,    # 429 + Retry-After を返す割合
+        task_fail_rate: float = 0.0,   # タスクが FAILED で終わる割合
+        durations: Optional[Dict[str, float]] = None,  # 種別ごとの完成までの秒数
+        curve: str = "linear",         # 進捗の進み方: linear / ease-out / stall（90% で一度止まる）
+        glb_grid: int = 64,            # 配る GLB の格子の分割数（頂点数 = (n+1)^2）
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.task_fail_rate = task_fail_rate
+        self.durations = {"preview": 20.0, "refine": 40.0, "rigging": 15.0, "animation": 10.0, **(durations or {})}
+        self.curve = curve
+        self.glb_grid = glb_grid
+
+
+def _progress(x: float, curve: str) -> float:
+    x = max(0.0, min(1.0, x))
+    if curve == "ease-out":
+        return 1.0 - (1.0 - x) ** 2
+    if curve == "stall":
+        # 最後の 30% の時間は 90% のまま（Meshy のテクスチャ工程で止まって見える状態）
+        return min(0.9, x / 0.7 * 0.9) if x < 1.0 else 1.0
+    return x
+
+
+# ---- 配布用アセット
+_glb_cache: Dict[int, Tuple[Dict[str, Any], bytes]] = {}
+_glb_lock = threading.Lock()
+
+
+def _grid_mesh(n: int) -> Tuple[Dict[str, Any], bytes]:
+    """n×n の格子（POSITION / NORMAL / TEXCOORD_0 + インデックス）の glTF と BIN。"""
+    with _glb_lock:
+        hit = _glb_cache.get(n)
+        if hit:
+            return hit
+    pos, nrm, uv, idx = bytearray(), bytearray(), bytearray(), bytearray()
+    for j in range(n + 1):
+        for i in range(n + 1):
+            u, v = i / n, j / n
+            pos += struct.pack("<3f", u - 0.5, 0.0, v - 0.5)
+            nrm += struct.pack("<3f", 0.0, 1.0, 0.0)
+            uv += struct.pack("<2f", u, v)
+    for j in range(n):
+        for i in range(n):
+            a = j * (n + 1) + i
+            idx += struct.pack("<6I", a, a + 1, a + n + 1, a + 1, a + n + 2, a + n + 1)
+    count = (n + 1) ** 2
+    views, binary = [], bytearray()
+    for data in (pos, nrm, uv, idx):
+        views.append({"buffer": 0, "byteOffset": len(binary), "byteLength": len(data)})
+        binary += data
+    gltf = {
+        "asset": {"version": "2.0", "generator": "bench/fake_meshy"},
+        "buffers": [{"byteLength": len(binary)}],
+        "bufferViews": views,
+        "accessors": [
+            {"bufferView": 0, "componentType": 5126, "count": count, "type": "VEC3",
+             "min": [-0.5, 0.0, -0.5], "max": [0.5, 0.0, 0.5]},
+            {"bufferView": 1, "componentType": 5126, "count": count, "type": "VEC3"},
+            {"bufferView": 2, "componentType": 5126, "count": count, "type": "VEC2"},
+            {"bufferView": 3, "componentType": 5125, "count": n * n * 6, "type": "SCALAR"},
+        ],
+        "meshes": [{"primitives": [{"attributes": {"POSITION": 0, "NORMAL": 1, "TEXCOORD_0": 2}, "indices": 3}]}],
+        "nodes": [{"mesh": 0}],
+        "scenes": [{"nodes": [0]}],
+        "scene": 0,
+    }
+    with _glb_lock:
+        _glb_cache[n] = (gltf, bytes(binary))
+    return gltf, bytes(binary)
+
+
+def make_glb(task_id: str, n: int) -> bytes:
+    """タスクごとに内容の異なる GLB（asset.extras に task_id）。Storage 側の重複排除を素通りさせるため。"""
+    from utils.glb_optimizer import write_glb
+
+    gltf, binary = _grid_mesh(n)
+    gltf = dict(gltf, asset=dict(gltf["asset"], extras={"task_id": task_id}))
+    return write_glb(gltf, binary)
+
+
+def make_png(size: int = 64) -> bytes:
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    # フィルタ 0 の RGB グラデーション
+    raw = b"".join(b"\x00" + b"".join(bytes((x * 255 // size, y * 255 // size, 160)) for x in range(size)) for y in range(size))
+    ihdr = struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", ihdr) + chunk(b"IDAT", zlib.compress(raw)) + chunk(b"IEND", b"")
+
+
+# ---- タスク
+class FakeMeshy:
+    def __init__(self, config: FakeConfig):
+        self.config = config
+        self.base_url = ""  # serve() で決まる
+        self.tasks: Dict[str, Dict[str, Any]] = {}
+        self.counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.blob_source: Optional[Callable[[str], Optional[Tuple[bytes, str]]]] = None  # /storage/ の配信元
+
+    def count(self, key: str):
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def create(self, kind: str, body: Dict[str, Any]) -> str:
+        task_id = f"fake-{kind}-{uuid.uuid4().hex[:12]}"
+        with self._lock:
+            self.tasks[task_id] = {
+                "kind": kind,
+                "created": time.monotonic(),
+                "duration": self.config.durations[kind] * random.uniform(0.8, 1.2),
+                "fail": random.random() < self.config.task_fail_rate,
+                "body": body,
+            }
+        return task_id
+
+    def status(self, task_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            t = self.tasks.get(task_id)
+        if t is None:
+            return None
+        x = (time.monotonic() - t["created"]) / t["duration"]
+        out: Dict[str, Any] = {"id": task_id, "progress": 0, "created_at": 0}
+        if x < 0.05:
+            out["status"] = "PENDING"
+        elif x < 1.0:
+            out["status"] = "IN_PROGRESS"
+            out["progress"] = int(100 * _progress(x, self.config.curve))
+        elif t["fail"]:
+            out["status"] = "FAILED"
+            out["task_error"] = {"message": "fake failure"}
+        else:
+            out["status"] = "SUCCEEDED"
+            out["progress"] = 100
+            out.update(self._result(task_id, t["kind"]))
+        if t["kind"] in ("preview", "refine"):
+            out["mode"] = t["kind"]
+        return out
+
+    def _result(self, task_id: str, kind: str) -> Dict[str, Any]:
+        glb = f"{self.base_url}/assets/{task_id}.glb"
+        if kind == "rigging":
+            return {"result": {"rigged_character_glb_url": glb, "rigged_character_fbx_url": None}}
+        if kind == "animation":
+            return {"result": {"animation_glb_url": glb, "animation_fbx_url": None}}
+        return {
+            "model_urls": {"glb": glb},
+            "thumbnail_url": f"{self.base_url}/assets/{task_id}.png",
+            "texture_urls": [],
+        }
+
+
+_CREATE_ROUTES = {
+    "/openapi/v1/rigging": "rigging",
+    "/openapi/v1/animations": "animation",
+}
+_STATUS_RE = re.compile(r"^/openapi/(v2/text-to-3d|v1/rigging|v1/animations)/([\w-]+)$")
+_ASSET_RE = re.compile(r"^/assets/([\w-]+)\.(glb|png)$")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # requests.Session の keep-alive を使わせる
+    fake: FakeMeshy = None  # serve() でサブクラスに設定
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str = "application/json", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, status: int, obj: Dict[str, Any], headers=None):
+        self._send(status, json.dumps(obj).encode(), headers=headers)
+
+    def _upstream_fault(self) -> bool:
+        """API 呼び出しに遅延を入れ、設定の割合で 429 / 500 を返す。返したら True。"""
+        cfg = self.fake.config
+        delay = cfg.latency_ms + random.uniform(-cfg.jitter_ms, cfg.jitter_ms) / 2
+        time.sleep(max(0.0, delay) / 1000.0)
+        r = random.random()
+        if r < cfg.throttle_rate:
+            self.fake.count("429")
+            self._json(429, {"message": "Too Many Requests"}, headers={"Retry-After": "1"})
+            return True
+        if r < cfg.throttle_rate + cfg.error_rate:
+            self.fake.count("500")
+            self._json(500, {"message": "fake internal error"})
+            return True
+        return False
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        path = self.path.split("?", 1)[0]
+        if path == "/openapi/v2/text-to-3d":
+            kind = "refine" if body.get("mode") == "refine" else "preview"
+        else:
+            kind = _CREATE_ROUTES.get(path)
+        if kind is None:
+            return self._json(404, {"message": "not found"})
+        self.fake.count(f"create:{kind}")
+        if self._upstream_fault():
+            return
+        self._json(202, {"result": self.fake.create(kind, body)})
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        m = _STATUS_RE.match(path)
+        if m:
+            self.fake.count("status")
+            if self._upstream_fault():
+                return
+            data = self.fake.status(m.group(2))
+            return self._json(200, data) if data else self._json(404, {"message": "task not found"})
+        m = _ASSET_RE.match(path)
+        if m:
+            self.fake.count(f"asset:{m.group(2)}")
+            if m.group(2) == "glb":
+                return self._send(200, make_glb(m.group(1), self.fake.config.glb_grid), "model/gltf-binary")
+            return self._send(200, make_png(), "image/png")
+        if path.startswith("/storage/") and self.fake.blob_source:
+            hit = self.fake.blob_source(path[len("/storage/"):])
+            if hit:
+                return self._send(200, hit[0], hit[1])
+        self._json(404, {"message": "not found"})
+
+
+def serve(config: FakeConfig, host: str = "127.0.0.1", port: int = 0) -> Tuple[FakeMeshy, ThreadingHTTPServer]:
+    """別スレッドでサーバーを起動して (FakeMeshy, server) を返す。止めるときは server.shutdown()。"""
+    fake = FakeMeshy(config)
+    handler = type("Handler", (_Handler,), {"fake": fake})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    fake.base_url = f"http://{host}:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, name="fake-meshy", daemon=True).start()
+    return fake, server
+
+
+def add_arguments(ap: argparse.ArgumentParser):
+    g = ap.add_argument_group("fake Meshy")
+    g.add_argument("--latency-ms", type=float, default=80.0, help="API 応答の平均遅延(ms)")
+    g.add_argument("--jitter-ms", type=float, default=40.0, help="遅延のばらつき(ms)")
+    g.add_argument("--error-rate", type=float, default=0.0, help="500 を返す割合")
+    g.add_argument("--throttle-rate", type=float, default=0.0, help="429 を返す割合")
+    g.add_argument("--task-fail-rate", type=float, default=0.0, help="FAILED で終わるタスクの割合")
+    g.add_argument("--preview-sec", type=float, default=20.0)
+    g.add_argument("--refine-sec", type=float, default=40.0)
+    g.add_argument("--rigging-sec", type=float, default=15.0)
+    g.add_argument("--animation-sec", type=float, default=10.0)
+    g.add_argument("--curve", choices=("linear", "ease-out", "stall"), default="linear", help="進捗の進み方")
+    g.add_argument("--glb-grid", type=int, default=64, help="GLB の格子分割数（大きいほど重い）")
+
+
+def config_from_args(args) -> FakeConfig:
+    return FakeConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        task_fail_rate=args.task_fail_rate,
+        durations={
+            "preview": args.preview_sec,
+            "refine": args.refine_sec,
+            "rigging": args.rigging_sec,
+            "animation": args.animation_sec,
+        },
+        curve=args.curve,
+        glb_grid=args.glb_grid,
+    )
+
+
+def main():
+    import os
+    import sys
+
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    add_arguments(ap)
+    args = ap.parse_args()
+
+    fake, server = serve(config_from_args(args), args.host, args.port)
+    print(f"fake Meshy listening on {fake.base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,372 @@
+"""
+ベンチマーク用のプロセス内フェイク（Gemini / Firestore / Cloud Storage）。
+install_firebase() はアプリ（utils.firebase_storage）の import より前に呼ぶこと。
+"""
+import json
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def _sleep_ms(mean_ms: float):
+    if mean_ms > 0:
+        time.sleep(random.uniform(0.5, 1.5) * mean_ms / 1000.0)
+
+
+# ---- Gemini
+class _FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeGeminiModel:
+    """google.generativeai.GenerativeModel の generate_content だけを真似る。"""
+
+    def __init__(self, name: str, latency_ms: float, error_rate: float):
+        self.name = name
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+
+    def _text(self) -> str:
+        if self.name == "questions":
+            from utils.profile import TRAITS
+
+            qs = [
+                {
+                    "id": f"b{i}",
+                    "title": f"ベンチ用の質問 {i}",
+                    "trait_id": TRAITS[i % len(TRAITS)]["id"],
+                    "options": ["とても当てはまる", "やや当てはまる", "どちらとも言えない", "あまり当てはまらない", "当てはまらない"],
+                }
+                for i in range(1, 13)
+            ]
+            return json.dumps({"questions": qs}, ensure_ascii=False)
+        return "落ち着いた雰囲気の中に好奇心がのぞくタイプです。ベンチマーク用の要約文です。"
+
+    def _maybe_fail(self):
+        if random.random() < self.error_rate:
+            raise RuntimeError("fake Gemini error")
+
+    def generate_content(self, prompt, request_options=None):
+        _sleep_ms(self.latency_ms)
+        self._maybe_fail()
+        return _FakeResponse(self._text())
+
+
+def install_gemini(latency_ms: float = 1500.0, error_rate: float = 0.0):
+    """gemini_client が作るモデルをフェイクに差し替える（API キーも設定済み扱いにする）。"""
+    from utils import gemini_client
+
+    gemini_client.GEMINI_API_KEY = "bench"
+    for name in ("questions", "summary"):
+        gemini_client._models[name] = FakeGeminiModel(name, latency_ms, error_rate)
+
+
+# ---- Firestore
+def _is_server_timestamp(v: Any) -> bool:
+    from firebase_admin import firestore
+
+    return v is firestore.SERVER_TIMESTAMP
+
+
+def _apply(doc: Dict[str, Any], data: Dict[str, Any]) -> Dict[str, Any]:
+    out = dict(doc)
+    for k, v in data.items():
+        if _is_server_timestamp(v):
+            v = datetime.now(timezone.utc)
+        elif type(v).__name__ == "ArrayUnion":
+            cur = list(out.get(k) or [])
+            v = cur + [x for x in v.values if x not in cur]
+        out[k] = v
+    return out
+
+
+class FakeSnapshot:
+    def __init__(self, doc_id: str, data: Optional[Dict[str, Any]], update_time: Optional[float] = None,
+                 reference: Optional["FakeDocument"] = None):
+        self.id = doc_id
+        self.exists = data is not None
+        self._data = data
+        self.update_time = update_time
+        self.reference = reference
+
+    def to_dict(self) -> Optional[Dict[str, Any]]:
+        return dict(self._data) if self._data is not None else None
+
+
+class FakeWriteResult:
+    def __init__(self, update_time: float):
+        self.update_time = update_time
+
+
+class FakeDocument:
+    def __init__(self, store: "FakeFirestore", collection: str, doc_id: str):
+        self._store = store
+        self._collection = collection
+        self.id = doc_id
+
+    def set(self, data: Dict[str, Any], merge: bool = False) -> FakeWriteResult:
+        return self._store.write(self._collection, self.id, data, merge)
+
+    def update(self, data: Dict[str, Any], option: Optional[Dict[str, Any]] = None) -> FakeWriteResult:
+        return self._store.write(self._collection, self.id, data, True, option)
+
+    def delete(self):
+        self._store.delete(self._collection, self.id)
+
+    def get(self) -> FakeSnapshot:
+        data, update_time = self._store.read(self._collection, self.id, with_time=True)
+        return FakeSnapshot(self.id, data, update_time, self)
+
+
+class FakeQuery:
+    def __init__(self, store: "FakeFirestore", collection: str):
+        self._store = store
+        self._collection = collection
+        self._orders: List[Tuple[str, bool]] = []
+        self._fields: Optional[List[str]] = None
+        self._after: Optional[Dict[str, Any]] = None
+        self._limit: Optional[int] = None
+        self._filters: List[Tuple[str, str, Any]] = []
+
+    def _copy(self, **kw) -> "FakeQuery":
+        q = FakeQuery(self._store, self._collection)
+        q._orders, q._fields, q._after, q._limit = list(self._orders), self._fields, self._after, self._limit
+        q._filters = list(self._filters)
+        for k, v in kw.items():
+            setattr(q, k, v)
+        return q
+
+    def order_by(self, field: str, direction: str = "ASCENDING") -> "FakeQuery":
+        return self._copy(_orders=self._orders + [(field, str(direction).upper() == "DESCENDING")])
+
+    def where(self, field_path: Optional[str] = None, op_string: Optional[str] = None, value: Any = None,
+              *, filter=None) -> "FakeQuery":
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(_filters=self._filters + [(field_path, op_string, value)])
+
+    def matches(self, data: Dict[str, Any]) -> bool:
+        for field, op, value in self._filters:
+            v = data.get(field)
+            if v is None or not _OPS[op](v, value):
+                return False
+        return True
+
+    def on_snapshot(self, callback) -> "FakeWatch":
+        """条件に合うドキュメントの追加・変更を callback(docs, changes, read_time) で通知する。"""
+        return self._store.watch(self, callback)
+
+    def select(self, fields) -> "FakeQuery":
+        return self._copy(_fields=list(fields))
+
+    def start_after(self, cursor: Dict[str, Any]) -> "FakeQuery":
+        return self._copy(_after=cursor)
+
+    def limit(self, n: int) -> "FakeQuery":
+        return self._copy(_limit=n)
+
+    def _sort_key(self, doc_id: str, data: Dict[str, Any]) -> tuple:
+        return tuple(doc_id if f == "__name__" else data.get(f) for f, _ in self._orders)
+
+    def stream(self):
+        rows = [r for r in self._store.scan(self._collection) if self.matches(r[1])]
+        # 全フィールド同じ向きの前提（アプリの使い方はそう）
+        desc = bool(self._orders) and self._orders[0][1]
+        key = lambda r: tuple("" if v is None else v for v in self._sort_key(*r))  # noqa: E731
+        rows.sort(key=key, reverse=desc)
+        if self._after is not None:
+            after = tuple(self._after.get(f) for f, _ in self._orders)
+            rows = [r for r in rows if (key(r) < after if desc else key(r) > after)]
+        if self._limit is not None:
+            rows = rows[: self._limit]
+        for doc_id, data in rows:
+            if self._fields is not None:
+                data = {k: v for k, v in data.items() if k in self._fields}
+            yield FakeSnapshot(doc_id, data, reference=FakeDocument(self._store, self._collection, doc_id))
+
+
+_OPS = {
+    "==": lambda a, b: a == b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+}
+
+
+class FakeChange:
+    def __init__(self, kind: str, document: FakeSnapshot):
+        from google.cloud.firestore_v1.watch import ChangeType
+
+        self.type = ChangeType[kind]
+        self.document = document
+
+
+class FakeWatch:
+    def __init__(self, store: "FakeFirestore", query: FakeQuery, callback):
+        self._store = store
+        self.query = query
+        self.callback = callback
+
+    def unsubscribe(self):
+        self._store.unwatch(self)
+
+
+class FakeCollection(FakeQuery):
+    def document(self, doc_id: Optional[str] = None) -> FakeDocument:
+        return FakeDocument(self._store, self._collection, doc_id or uuid.uuid4().hex[:20])
+
+
+class FakeFirestore:
+    def __init__(self, latency_ms: float = 30.0):
+        self.latency_ms = latency_ms
+        self._data: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._times: Dict[Tuple[str, str], float] = {}  # 楽観ロック（write_option）用の更新時刻
+        self._lock = threading.Lock()
+        self._watches: List[FakeWatch] = []
+
+    def collection(self, name: str) -> FakeCollection:
+        return FakeCollection(self, name)
+
+    def write_option(self, last_update_time=None) -> Dict[str, Any]:
+        return {"last_update_time": last_update_time}
+
+    def write(self, collection: str, doc_id: str, data: Dict[str, Any], merge: bool,
+              option: Optional[Dict[str, Any]] = None) -> FakeWriteResult:
+        from google.api_core.exceptions import FailedPrecondition
+
+        _sleep_ms(self.latency_ms)
+        with self._lock:
+            docs = self._data.setdefault(collection, {})
+            if option is not None and self._times.get((collection, doc_id)) != option.get("last_update_time"):
+                raise FailedPrecondition(f"{collection}/{doc_id} was updated")
+            kind = "MODIFIED" if doc_id in docs else "ADDED"
+            docs[doc_id] = _apply(docs.get(doc_id, {}) if merge else {}, data)
+            # 同じ時刻の書き込みを区別できるよう、前回より必ず大きくする
+            now = max(time.time(), self._times.get((collection, doc_id), 0.0) + 1e-6)
+            self._times[(collection, doc_id)] = now
+            written = dict(docs[doc_id])
+            watches = [w for w in self._watches if w.query._collection == collection and w.query.matches(written)]
+        # 本物と同じく別スレッドから通知する
+        for w in watches:
+            change = FakeChange(kind, FakeSnapshot(doc_id, written, now))
+            threading.Thread(target=w.callback, args=([change.document], [change], now), daemon=True).start()
+        return FakeWriteResult(now)
+
+    def watch(self, query: FakeQuery, callback) -> FakeWatch:
+        w = FakeWatch(self, query, callback)
+        with self._lock:
+            self._watches.append(w)
+        initial = [FakeChange("ADDED", snap) for snap in query.stream()]
+        threading.Thread(
+            target=callback, args=([c.document for c in initial], initial, time.time()), daemon=True
+        ).start()
+        return w
+
+    def unwatch(self, w: FakeWatch):
+        with self._lock:
+            if w in self._watches:
+                self._watches.remove(w)
+
+    def delete(self, collection: str, doc_id: str):
+        _sleep_ms(self.latency_ms)
+        with self._lock:
+            self._data.get(collection, {}).pop(doc_id, None)
+            self._times.pop((collection, doc_id), None)
+
+    def read(self, collection: str, doc_id: str, with_time: bool = False):
+        _sleep_ms(self.latency_ms)
+        with self._lock:
+            doc = self._data.get(collection, {}).get(doc_id)
+            doc = dict(doc) if doc is not None else None
+            return (doc, self._times.get((collection, doc_id))) if with_time else doc
+
+    def scan(self, collection: str) -> List[Tuple[str, Dict[str, Any]]]:
+        _sleep_ms(self.latency_ms)
+        with self._lock:
+            return [(k, dict(v)) for k, v in self._data.get(collection, {}).items()]
+
+
+# ---- Cloud Storage
+class FakeBlob:
+    def __init__(self, bucket: "FakeBucket", name: str):
+        self._bucket = bucket
+        self.name = name
+        self.metadata: Optional[Dict[str, str]] = None
+        self.cache_control: Optional[str] = None
+
+    @property
+    def public_url(self) -> str:
+        return f"{self._bucket.base_url}/storage/{self.name}"
+
+    def exists(self) -> bool:
+        _sleep_ms(self._bucket.latency_ms)
+        return self._bucket.get(self.name) is not None
+
+    def upload_from_string(self, data, content_type: str = "application/octet-stream", if_generation_match=None):
+        if isinstance(data, str):
+            data = data.encode()
+        self._bucket.put(self, bytes(data), content_type, if_generation_match)
+
+    def upload_from_file(self, f, size: Optional[int] = None, content_type: str = "application/octet-stream",
+                         if_generation_match=None):
+        f.seek(0)
+        self._bucket.put(self, f.read() if size is None else f.read(size), content_type, if_generation_match)
+
+
+class FakeBucket:
+    """内容はメモリに持つ。upload はサイズに比例した時間（帯域 mbps）だけ待つ。"""
+
+    def __init__(self, latency_ms: float = 50.0, mbps: float = 200.0):
+        self.latency_ms = latency_ms
+        self.mbps = mbps
+        self.base_url = ""  # fake_meshy が /storage/ で配信する場合にその URL
+        self._blobs: Dict[str, Tuple[bytes, str, Optional[Dict[str, str]]]] = {}
+        self._lock = threading.Lock()
+        self.bytes_uploaded = 0
+
+    def blob(self, name: str, chunk_size: Optional[int] = None) -> FakeBlob:
+        return FakeBlob(self, name)
+
+    def get_blob(self, name: str) -> Optional[FakeBlob]:
+        _sleep_ms(self.latency_ms)
+        hit = self.get(name)
+        if hit is None:
+            return None
+        b = FakeBlob(self, name)
+        b.metadata = hit[2]
+        return b
+
+    def get(self, name: str):
+        with self._lock:
+            return self._blobs.get(name)
+
+    def put(self, blob: FakeBlob, data: bytes, content_type: str, if_generation_match):
+        from google.api_core.exceptions import PreconditionFailed
+
+        _sleep_ms(self.latency_ms)
+        if self.mbps > 0:
+            time.sleep(len(data) * 8 / (self.mbps * 1e6))
+        with self._lock:
+            if if_generation_match == 0 and blob.name in self._blobs:
+                raise PreconditionFailed(f"{blob.name} already exists")
+            self._blobs[blob.name] = (data, content_type, blob.metadata)
+            self.bytes_uploaded += len(data)
+
+    def serve(self, name: str) -> Optional[Tuple[bytes, str]]:
+        hit = self.get(name)
+        return (hit[0], hit[1]) if hit else None
+
+
+def install_firebase(db_latency_ms: float = 30.0, storage_latency_ms: float = 50.0, storage_mbps: float = 200.0):
+    """firebase_init.init_firebase をフェイクを返す関数に差し替えて (db, bucket) を返す。"""
+    import firebase_init
+
+    db = FakeFirestore(db_latency_ms)
+    bucket = FakeBucket(storage_latency_ms, storage_mbps)
+    firebase_init.init_firebase = lambda: (db, bucket)
+    return db, bucket
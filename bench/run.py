@@ -0,0 +1,429 @@
+"""
+オフラインの負荷試験。フェイクの Meshy（HTTP サーバー）・Gemini・Firebase を立て、
+app.py を gunicorn gthread 相当の固定スレッド数の WSGI サーバーで動かして、
+仮想ユーザーが 質問取得 → 診断送信 → Preview 待ち → Refine → Rigging → Animation
+の一連の操作を繰り返す（既定は画面と同じくサーバー側パイプライン経由。
+--flow browser では Refine 以降の Rigging・Animation を各 API で順に呼ぶ）。
+
+スループット・ルートごとの p50/p99・スレッド/ジョブプール/パイプラインのプールの利用率を表示し、
+結果を git のリビジョン付きで bench/results.jsonl に追記する（同じ設定の前回値との差も表示）。
+
+例:
+    python bench/run.py --users 20 --sessions 40
+    python bench/run.py --users 50 --duration 120 --preview-sec 5 --refine-sec 10 --throttle-rate 0.05
+    python bench/run.py --label no-model-cache --env MODEL_CACHE_ENABLED=0
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+import requests  # noqa: E402
+
+from bench import fake_meshy, fakes  # noqa: E402
+
+RESULTS_PATH = os.path.join(os.path.dirname(__file__), "results.jsonl")
+TERMINAL = {"SUCCEEDED", "FAILED", "CANCELED", "CANCELLED", "EXPIRED"}
+
+
+# ---- アプリの起動（固定スレッド数）
+def _serve_app(app, threads: int):
+    """gthread と同じく同時処理をスレッド数で頭打ちにする WSGI サーバー。(base_url, busy_fn, shutdown_fn)"""
+    from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="bench-http")
+    busy = [0]
+    lock = threading.Lock()
+
+    class PooledServer(BaseWSGIServer):
+        request_queue_size = 1024
+
+        def _handle(self, request, client_address):
+            with lock:
+                busy[0] += 1
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                with lock:
+                    busy[0] -= 1
+
+        def process_request(self, request, client_address):
+            pool.submit(self._handle, request, client_address)
+
+    server = PooledServer("127.0.0.1", 0, app, handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, name="bench-app", daemon=True).start()
+
+    def shutdown():
+        server.shutdown()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    return f"http://127.0.0.1:{server.server_port}", lambda: busy[0], shutdown
+
+
+# ---- 計測
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.sessions: List[float] = []
+        self.session_outcomes: Dict[str, int] = {}
+
+    def request(self, route: str, sec: float, ok: bool):
+        with self._lock:
+            self.requests.setdefault(route, []).append(sec)
+            if not ok:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+    def session(self, sec: float, outcome: str):
+        with self._lock:
+            self.sessions.append(sec)
+            self.session_outcomes[outcome] = self.session_outcomes.get(outcome, 0) + 1
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    s = sorted(values)
+    return s[min(len(s) - 1, max(0, int(round(p / 100.0 * len(s) + 0.5)) - 1))]
+
+
+class Sampler:
+    """利用率（HTTP スレッド・ジョブプール・パイプラインのプール）を一定間隔で記録する。"""
+
+    def __init__(self, busy_fn, threads: int, interval: float = 0.1):
+        from utils import jobs, pipeline
+
+        self._jobs = jobs
+        self._pipeline = pipeline
+        self._busy_fn = busy_fn
+        self.threads = threads
+        self.interval = interval
+        self.http: List[int] = []
+        self.job_running: List[int] = []
+        self.job_pending: List[int] = []
+        self.stage_running: List[int] = []
+        self.stage_pending: List[int] = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="bench-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.http.append(self._busy_fn())
+            st = self._jobs.pool_stats()
+            self.job_running.append(st["running"])
+            self.job_pending.append(st["pending"])
+            st = self._pipeline.pool_stats()
+            self.stage_running.append(st["running"])
+            self.stage_pending.append(st["pending"])
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def summary(self) -> Dict[str, Any]:
+        workers = self._jobs.JOB_WORKERS
+        stage_workers = self._pipeline.PIPELINE_WORKERS
+
+        def avg(v):
+            return sum(v) / len(v) if v else 0.0
+
+        return {
+            "http_threads": self.threads,
+            "http_util_mean": round(avg(self.http) / self.threads, 3),
+            "http_util_max": round(max(self.http, default=0) / self.threads, 3),
+            "job_workers": workers,
+            "job_util_mean": round(avg(self.job_running) / workers, 3),
+            "job_pending_max": max(self.job_pending, default=0),
+            "pipeline_workers": stage_workers,
+            "pipeline_util_mean": round(avg(self.stage_running) / stage_workers, 3),
+            "pipeline_pending_max": max(self.stage_pending, default=0),
+        }
+
+
+# ---- 仮想ユーザー
+class Session:
+    def __init__(self, base: str, rec: Recorder, poll_interval: float, poll_timeout: float):
+        self.base = base
+        self.rec = rec
+        self.poll_interval = poll_interval
+        self.poll_timeout = poll_timeout
+        self.http = requests.Session()
+
+    def call(self, method: str, route: str, path: str, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            resp = self.http.request(method, self.base + path, timeout=120, **kwargs)
+        except requests.RequestException:
+            self.rec.request(route, time.perf_counter() - t0, False)
+            raise
+        self.rec.request(route, time.perf_counter() - t0, resp.status_code < 400)
+        return resp
+
+    def poll(self, route: str, path: str) -> Dict[str, Any]:
+        deadline = time.monotonic() + self.poll_timeout
+        while True:
+            data = self.call("GET", route, path).json()
+            if data.get("status") in TERMINAL or "error" in data or time.monotonic() > deadline:
+                return data
+            time.sleep(self.poll_interval)
+
+    def run(self, flow: str) -> str:
+        qs = self.call("GET", "GET /api/quiz/questions", "/api/quiz/questions?count=10").json()
+        answers = [{"trait_id": q["trait_id"], "choice_index": random.randrange(5)} for q in qs.get("questions", [])]
+        resp = self.call("POST", "POST /api/quiz/submit", "/api/quiz/submit", json={"answers": answers})
+        sub = resp.json()
+        if resp.status_code >= 400:
+            return "submit_error"
+
+        if flow == "pipeline":
+            return self._run_pipeline(sub)
+
+        rig_body: Dict[str, Any]
+        if sub.get("cached"):
+            rig_body = {"model_url": sub["model_urls"]["glb"]}
+        else:
+            # Preview 待ち〜Refine は診断送信でサーバーが始めている
+            done = self.poll("GET /api/pipelines/<id>", f"/api/pipelines/{sub['pipeline_id']}")
+            if done.get("status") != "SUCCEEDED":
+                return "pipeline_failed"
+            rig_body = {"input_task_id": done["result"]["refine_task_id"]}
+
+        rig = self.call("POST", "POST /api/rigging", "/api/rigging", json=rig_body).json()
+        if "rig_task_id" not in rig:
+            return "rigging_error"
+        rigged = self.poll("GET /api/rigging/<id>", f"/api/rigging/{rig['rig_task_id']}")
+        if rigged.get("status") != "SUCCEEDED":
+            return "rigging_failed"
+        ani = self.call(
+            "POST", "POST /api/animations", "/api/animations", json={"rig_task_id": rig["rig_task_id"], "action_id": 1}
+        ).json()
+        if "animation_task_id" not in ani:
+            return "animation_error"
+        animated = self.poll("GET /api/animations/<id>", f"/api/animations/{ani['animation_task_id']}")
+        if animated.get("status") != "SUCCEEDED":
+            return "animation_failed"
+        self.call("GET", "GET /api/catalog", "/api/catalog")
+        return "ok"
+
+
+    def _run_pipeline(self, sub: Dict[str, Any]) -> str:
+        """サーバー側パイプライン（/api/pipelines）で Refine 〜 Animation まで進める。"""
+        body: Dict[str, Any] = {"action_id": 1}
+        if sub.get("cached"):
+            body["model_url"] = sub["model_urls"]["glb"]
+        else:
+            # 診断送信で始まった Preview 待ち〜Refine のパイプラインを見届けてから、その Refine でリギングする
+            done = self.poll("GET /api/pipelines/<id>", f"/api/pipelines/{sub['pipeline_id']}")
+            if done.get("status") != "SUCCEEDED":
+                return "pipeline_failed"
+            body["refine_task_id"] = done["result"]["refine_task_id"]
+        created = self.call("POST", "POST /api/pipelines", "/api/pipelines", json=body).json()
+        if "id" not in created:
+            return "pipeline_error"
+        done = self.poll("GET /api/pipelines/<id>", f"/api/pipelines/{created['id']}")
+        if done.get("status") != "SUCCEEDED":
+            return "pipeline_failed"
+        self.call("GET", "GET /api/catalog", "/api/catalog")
+        return "ok"
+
+
+def _user_loop(base: str, rec: Recorder, args, stop_at: float, remaining: List[int], lock: threading.Lock):
+    sess = Session(base, rec, args.poll_interval, args.poll_timeout)
+    while time.monotonic() < stop_at:
+        with lock:
+            if args.sessions and remaining[0] <= 0:
+                return
+            remaining[0] -= 1
+        t0 = time.perf_counter()
+        try:
+            outcome = sess.run(args.flow)
+        except Exception as e:
+            outcome = f"exception:{e.__class__.__name__}"
+        rec.session(time.perf_counter() - t0, outcome)
+
+
+# ---- 結果
+def _git_revision() -> str:
+    try:
+        rev = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+        dirty = subprocess.call(["git", "diff", "--quiet", "HEAD", "--", "app.py", "utils"], cwd=ROOT)
+        return rev + ("-dirty" if dirty else "")
+    except Exception:
+        return "unknown"
+
+
+def _ms(v: Optional[float]) -> Optional[float]:
+    return round(v * 1000.0, 1) if v is not None else None
+
+
+def build_result(args, rec: Recorder, sampler: Sampler, wall: float, fake, bucket) -> Dict[str, Any]:
+    all_latencies = [x for v in rec.requests.values() for x in v]
+    routes = {
+        route: {
+            "count": len(v),
+            "errors": rec.errors.get(route, 0),
+            "p50_ms": _ms(percentile(v, 50)),
+            "p99_ms": _ms(percentile(v, 99)),
+        }
+        for route, v in sorted(rec.requests.items())
+    }
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "revision": _git_revision(),
+        "label": args.label,
+        "config": {k: v for k, v in sorted(vars(args).items()) if k not in ("label", "out", "no_record", "verbose")},
+        "wall_sec": round(wall, 2),
+        "sessions": len(rec.sessions),
+        "session_outcomes": rec.session_outcomes,
+        "sessions_per_min": round(len(rec.sessions) / wall * 60.0, 2) if wall else 0.0,
+        "requests": len(all_latencies),
+        "requests_per_sec": round(len(all_latencies) / wall, 2) if wall else 0.0,
+        "request_p50_ms": _ms(percentile(all_latencies, 50)),
+        "request_p99_ms": _ms(percentile(all_latencies, 99)),
+        "session_p50_sec": round(percentile(rec.sessions, 50) or 0.0, 2),
+        "session_p99_sec": round(percentile(rec.sessions, 99) or 0.0, 2),
+        "routes": routes,
+        "utilization": sampler.summary(),
+        "upstream": {"meshy_requests": dict(sorted(fake.counts.items())), "storage_bytes": bucket.bytes_uploaded},
+    }
+
+
+def _previous(path: str, result: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return None
+    prev = None
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                r = json.loads(line)
+            except ValueError:
+                continue
+            if r.get("config") == result["config"] and r.get("label") == result["label"]:
+                prev = r
+    return prev
+
+
+def print_report(result: Dict[str, Any], prev: Optional[Dict[str, Any]]):
+    def delta(key: str, sub: Optional[str] = None) -> str:
+        if prev is None:
+            return ""
+        a = result[key] if sub is None else result[key].get(sub, {})
+        b = prev.get(key) if sub is None else (prev.get(key) or {}).get(sub, {})
+        if not isinstance(a, (int, float)) or not isinstance(b, (int, float)) or not b:
+            return ""
+        return f"  ({(a - b) / b * 100:+.1f}% vs {prev['revision']})"
+
+    u = result["utilization"]
+    print(f"\n== bench {result['label'] or ''} @ {result['revision']}  wall {result['wall_sec']}s")
+    print(f"sessions   {result['sessions']} {result['session_outcomes']}")
+    print(f"throughput {result['sessions_per_min']} sessions/min{delta('sessions_per_min')}")
+    print(f"           {result['requests_per_sec']} req/s{delta('requests_per_sec')}")
+    print(f"latency    p50 {result['request_p50_ms']} ms{delta('request_p50_ms')}")
+    print(f"           p99 {result['request_p99_ms']} ms{delta('request_p99_ms')}")
+    print(f"session    p50 {result['session_p50_sec']} s / p99 {result['session_p99_sec']} s")
+    print(
+        f"util       http {u['http_util_mean']:.0%} (max {u['http_util_max']:.0%} of {u['http_threads']})"
+        f"  jobs {u['job_util_mean']:.0%} of {u['job_workers']} (max pending {u['job_pending_max']})"
+        f"  stages {u['pipeline_util_mean']:.0%} of {u['pipeline_workers']} (max pending {u['pipeline_pending_max']})"
+    )
+    print(f"\n{'route':<36}{'count':>7}{'err':>5}{'p50 ms':>10}{'p99 ms':>10}")
+    for route, r in result["routes"].items():
+        print(f"{route:<36}{r['count']:>7}{r['errors']:>5}{r['p50_ms'] or 0:>10}{r['p99_ms'] or 0:>10}")
+    print(f"\nupstream   {result['upstream']}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--users", type=int, default=10, help="同時に操作する仮想ユーザー数")
+    ap.add_argument("--sessions", type=int, default=20, help="実行するセッション総数（0 なら --duration まで）")
+    ap.add_argument("--duration", type=float, default=600.0, help="最長の実行時間(秒)")
+    ap.add_argument("--threads", type=int, default=16, help="アプリの HTTP スレッド数（gthread の --threads 相当）")
+    ap.add_argument("--flow", choices=("browser", "pipeline"), default="pipeline",
+                    help="pipeline: 画面と同じく /api/pipelines に任せて集約状態だけ見る / browser: Rigging・Animation は各 API を順に呼ぶ（旧画面）")
+    ap.add_argument("--poll-interval", type=float, default=2.0, help="フロントの状態ポーリング間隔(秒)")
+    ap.add_argument("--poll-timeout", type=float, default=300.0)
+    ap.add_argument("--gemini-latency-ms", type=float, default=1500.0)
+    ap.add_argument("--gemini-error-rate", type=float, default=0.0)
+    ap.add_argument("--db-latency-ms", type=float, default=30.0)
+    ap.add_argument("--storage-latency-ms", type=float, default=50.0)
+    ap.add_argument("--storage-mbps", type=float, default=200.0)
+    ap.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                    help="アプリの import 前に設定する環境変数（例: MODEL_CACHE_ENABLED=0, JOB_WORKERS=8）")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--label", default="", help="結果に付ける名前（比較は同じ label・同じ設定の前回値と行う）")
+    ap.add_argument("--out", default=RESULTS_PATH)
+    ap.add_argument("--no-record", action="store_true", help="結果をファイルに追記しない")
+    ap.add_argument("--verbose", action="store_true", help="アプリのログをそのまま表示する")
+    fake_meshy.add_arguments(ap)
+    args = ap.parse_args()
+    random.seed(args.seed)
+
+    # 上流のフェイク（アプリの import より前に差し替える）
+    fake, meshy_server = fake_meshy.serve(fake_meshy.config_from_args(args))
+    os.environ["MESHY_API_BASE"] = fake.base_url
+    os.environ.setdefault("MESHY_API_KEY", "bench")
+    os.environ.setdefault("WEB_THREADS", str(args.threads))  # Meshy の接続プールの大きさも本番と同じ決め方にする
+    # サマリーの永続キャッシュは毎回空から（リポジトリ直下のファイルを汚さない）
+    os.environ.setdefault("SUMMARY_CACHE_PATH", os.path.join(tempfile.mkdtemp(prefix="bench-"), "summary_cache.json"))
+    for kv in args.env:
+        k, _, v = kv.partition("=")
+        os.environ[k] = v
+    _, bucket = fakes.install_firebase(args.db_latency_ms, args.storage_latency_ms, args.storage_mbps)
+    bucket.base_url = fake.base_url
+    fake.blob_source = bucket.serve
+
+    from app import app
+
+    fakes.install_gemini(args.gemini_latency_ms, args.gemini_error_rate)
+
+    base, busy_fn, shutdown = _serve_app(app, args.threads)
+    rec = Recorder()
+    sampler = Sampler(busy_fn, args.threads)
+    remaining, lock = [args.sessions], threading.Lock()
+    print(f"app {base}  fake Meshy {fake.base_url}  users={args.users} sessions={args.sessions or '-'}")
+
+    t0 = time.monotonic()
+    stop_at = t0 + args.duration
+    sampler.start()
+    # アプリのリクエストログ等は --verbose のときだけ出す
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+        with ThreadPoolExecutor(max_workers=args.users, thread_name_prefix="bench-user") as users:
+            for _ in range(args.users):
+                users.submit(_user_loop, base, rec, args, stop_at, remaining, lock)
+    wall = time.monotonic() - t0
+    sampler.stop()
+    shutdown()
+    meshy_server.shutdown()
+
+    result = build_result(args, rec, sampler, wall, fake, bucket)
+    print_report(result, _previous(args.out, result))
+    if not args.no_record:
+        with open(args.out, "a", encoding="utf-8") as f:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+        print(f"\nrecorded to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+# gunicorn は起動ディレクトリの gunicorn.conf.py を自動で読み込む
+# （Dockerfile / Procfile のコマンドライン引数はこちらより優先される）
+import threading
+
+
+def post_worker_init(worker):
+    # Gemini の import とモデル生成を最初のリクエストより前に済ませる
+    from utils.gemini_client import warm_up
+
+    threading.Thread(target=warm_up, name="gemini-warmup", daemon=True).start()
@@ -0,0 +1,62 @@
+"""
+Meshy Webhook のローカル代替。
+指定した task_id について PENDING → IN_PROGRESS → SUCCEEDED(/FAILED) の通知を
+/api/webhooks/meshy に順番に POST する（オフラインで Webhook 経路を確認する用）。
+
+例:
+    MESHY_WEBHOOK_SECRET=dev python scripts/fake_meshy_webhook.py demo_preview_1 --steps 5
+"""
+import argparse
+import os
+import time
+
+import requests
+
+SAMPLE_GLB = "https://modelviewer.dev/shared-assets/models/Astronaut.glb"
+SAMPLE_THUMB = "https://modelviewer.dev/shared-assets/thumbnails/Astronaut.webp"
+
+
+def _task_payload(task_id: str, status: str, progress: int) -> dict:
+    body = {"id": task_id, "status": status, "progress": progress}
+    if status == "SUCCEEDED":
+        body.update(
+            {
+                "model_urls": {"glb": SAMPLE_GLB},
+                "thumbnail_url": SAMPLE_THUMB,
+                "texture_urls": [],
+                "result": {"animation_glb_url": SAMPLE_GLB, "rigged_character_glb_url": SAMPLE_GLB},
+            }
+        )
+    if status == "FAILED":
+        body["task_error"] = {"message": "fake failure"}
+    return body
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("task_ids", nargs="+", help="通知する task_id（複数可）")
+    ap.add_argument("--url", default=os.getenv("WEBHOOK_URL", "http://localhost:5173/api/webhooks/meshy"))
+    ap.add_argument("--secret", default=os.getenv("MESHY_WEBHOOK_SECRET", ""))
+    ap.add_argument("--steps", type=int, default=4, help="IN_PROGRESS の通知回数")
+    ap.add_argument("--interval", type=float, default=1.0, help="通知間隔(秒)")
+    ap.add_argument("--fail", action="store_true", help="最後を FAILED にする")
+    args = ap.parse_args()
+
+    events = [("PENDING", 0)]
+    events += [("IN_PROGRESS", int(100 * i / (args.steps + 1))) for i in range(1, args.steps + 1)]
+    events.append(("FAILED", 0) if args.fail else ("SUCCEEDED", 100))
+
+    for status, progress in events:
+        for task_id in args.task_ids:
+            resp = requests.post(
+                args.url,
+                params={"token": args.secret},
+                json=_task_payload(task_id, status, progress),
+                timeout=10,
+            )
+            print(f"{task_id} {status:<12} {progress:>3}% -> {resp.status_code}")
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
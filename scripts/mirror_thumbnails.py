@@ -0,0 +1,59 @@
+"""
+既存の図鑑エントリのサムネイルを自前の Storage に複製する（登録時の処理の後追い）。
+thumbnails フィールドが空で、thumbnail_url を持つドキュメントが対象。
+保存名は GLB の sha256 から決める。sha256 を持たない古いドキュメントは取得元 URL の sha256 を使う。
+
+例:
+    python scripts/mirror_thumbnails.py --limit 200
+"""
+import argparse
+import hashlib
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from dotenv import load_dotenv
+
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), "..", ".env"))
+
+from utils.firebase_storage import db, mirror_thumbnail, primary_thumbnail  # noqa: E402
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--limit", type=int, default=0, help="処理する最大件数（0 で全件）")
+    ap.add_argument("--dry-run", action="store_true", help="対象を表示するだけ")
+    args = ap.parse_args()
+
+    done = failed = 0
+    for snap in db.collection("models").stream():
+        obj = snap.to_dict() or {}
+        src = obj.get("source_thumbnail_url") or obj.get("thumbnail_url")
+        if obj.get("thumbnails") or not src:
+            continue
+        if args.limit and done + failed >= args.limit:
+            break
+        if args.dry_run:
+            print(f"{snap.id}\t{src}")
+            done += 1
+            continue
+        try:
+            digest = obj.get("sha256") or hashlib.sha256(src.encode("utf-8")).hexdigest()
+            thumbs = mirror_thumbnail(src, digest)
+        except Exception as e:
+            print(f"[NG] {snap.id}: {e}")
+            failed += 1
+            continue
+        snap.reference.update({
+            "thumbnails": thumbs,
+            "thumbnail_url": primary_thumbnail(thumbs, src),
+            "source_thumbnail_url": src,
+        })
+        print(f"[OK] {snap.id}: {', '.join(sorted(thumbs))}")
+        done += 1
+    print(f"done={done} failed={failed}")
+
+
+if __name__ == "__main__":
+    main()
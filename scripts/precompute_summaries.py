@@ -0,0 +1,65 @@
+"""
+診断サマリーの事前生成。
+取り得る全プロファイルを summary_cache のキーに正規化し、各キーについて
+SUMMARY_VARIANTS 件に達するまで Gemini で文章を生成して SUMMARY_CACHE_PATH に保存する。
+途中で止めても、保存済みの分は次回の実行でそのまま使われる。
+サーバーはこのファイルを起動時に読むだけなので、生成後はワーカーを再起動する。
+
+例:
+    python scripts/precompute_summaries.py --variants 3 --concurrency 4
+"""
+import argparse
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from dotenv import load_dotenv
+
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), "..", ".env"))
+
+from utils import summary_cache  # noqa: E402
+from utils.gemini_client import GEMINI_API_KEY  # noqa: E402
+from utils.profile import iter_all_profiles  # noqa: E402
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--variants", type=int, default=summary_cache.SUMMARY_VARIANTS, help="1キーあたりの文章数")
+    ap.add_argument("--concurrency", type=int, default=4, help="同時に投げる Gemini リクエスト数")
+    ap.add_argument("--save-every", type=int, default=50, help="この件数ごとにファイルへ保存")
+    ap.add_argument("--dry-run", action="store_true", help="キー数と不足件数を表示するだけ")
+    args = ap.parse_args()
+
+    profiles = {}
+    for p in iter_all_profiles():
+        profiles.setdefault(summary_cache.summary_key(p), p)
+
+    todo = []
+    for key, p in profiles.items():
+        missing = args.variants - len(summary_cache._variants(key))
+        todo += [p] * max(0, missing)
+    print(f"{len(profiles)} keys, {len(todo)} summaries to generate -> {summary_cache.SUMMARY_CACHE_PATH}")
+    if args.dry_run or not todo:
+        return
+    if not GEMINI_API_KEY:
+        sys.exit("GEMINI_API_KEY is not set")
+
+    failed = 0
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as ex:
+            futures = [ex.submit(summary_cache.generate_variant, p) for p in todo]
+            for i, fut in enumerate(as_completed(futures), 1):
+                if not fut.result():
+                    failed += 1
+                if i % args.save_every == 0:
+                    summary_cache.save()
+                    print(f"[{i}/{len(todo)}] saved ({failed} failed)")
+    finally:
+        summary_cache.save()
+    print(f"done: {len(todo) - failed} generated, {failed} failed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+モデルキャッシュの事前生成。
+scores_to_profile が取り得る全プロファイルのプロンプトについて Meshy Preview
+（--refine 指定時は Refine まで）を生成し、Storage に保存して model_cache に登録する。
+進行状況は --state の JSON に逐次保存し、中断後に同じコマンドで再開できる
+（作成済みタスクは作り直さず、その完了を待つところから続ける。失敗で終わったタスクは作り直す）。
+
+例:
+    python scripts/prewarm_models.py --refine --concurrency 2
+    python scripts/prewarm_models.py --dry-run
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from dotenv import load_dotenv
+
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), "..", ".env"))
+
+from utils.profile import ALLOWED_ART_STYLES, iter_profiles, profile_to_prompt  # noqa: E402
+
+TERMINAL_FAILED = {"FAILED", "CANCELED", "CANCELLED", "EXPIRED"}
+
+
+class TaskFailed(RuntimeError):
+    """タスクが失敗で終わった（再開時は作り直す。タイムアウトはまだ終わるかもしれないので待ち直す）。"""
+
+
+class _State:
+    """key -> 進行状況 を JSON ファイルに保存する（書き込みは一時ファイル経由で置き換え）。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.data = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.data = json.load(f)
+
+    def get(self, key: str) -> dict:
+        with self._lock:
+            return dict(self.data.get(key) or {})
+
+    def update(self, key: str, **fields):
+        with self._lock:
+            self.data.setdefault(key, {}).update(fields)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, self.path)
+
+
+def _wait(task_id: str, timeout_sec: float, interval_sec: float) -> dict:
+    from utils.meshy_client import get_text_to_3d_task
+
+    deadline = time.monotonic() + timeout_sec
+    while True:
+        task = get_text_to_3d_task(task_id)
+        status = task.get("status")
+        if status == "SUCCEEDED":
+            return task
+        if status in TERMINAL_FAILED:
+            raise TaskFailed(f"task {task_id} {status}")
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"task {task_id} did not finish in {timeout_sec}s")
+        time.sleep(interval_sec)
+
+
+def _run_one(key: str, params: dict, args, state: _State) -> str:
+    from utils.meshy_client import create_text_to_3d_preview, create_text_to_3d_refine
+    from utils.firebase_storage import store_model_from_url
+    from utils import model_cache
+
+    st = state.get(key)
+    preview_id = st.get("preview_task_id")
+    if not preview_id:
+        preview_id = create_text_to_3d_preview(dict(params))
+        state.update(key, preview_task_id=preview_id, status="preview")
+    try:
+        task = _wait(preview_id, args.timeout, args.interval)
+    except TaskFailed:
+        state.update(key, preview_task_id=None, refine_task_id=None)
+        raise
+
+    stage, refine_id = "preview", None
+    if args.refine:
+        refine_id = st.get("refine_task_id")
+        if not refine_id:
+            refine_id = create_text_to_3d_refine(
+                {
+                    "preview_task_id": preview_id,
+                    "enable_pbr": params["art_style"] != "sculpture",
+                    "texture_prompt": params["prompt"],
+                }
+            )
+            state.update(key, refine_task_id=refine_id, status="refine")
+        try:
+            task = _wait(refine_id, args.timeout, args.interval)
+        except TaskFailed:
+            state.update(key, refine_task_id=None)
+            raise
+        stage = "refine"
+
+    mesh_url = (task.get("model_urls") or {}).get("glb")
+    if not mesh_url:
+        raise RuntimeError(f"GLB URL not found for {task.get('id')}")
+    stored = store_model_from_url(mesh_url)
+    model_cache.add_variant(
+        key,
+        params,
+        {
+            "stage": stage,
+            "preview_task_id": preview_id,
+            "refine_task_id": refine_id,
+            "glb": stored["public_url"],
+            "lod_glb": stored["lod_url"],
+            "path": stored["path"],
+            "thumbnail_url": task.get("thumbnail_url"),
+        },
+    )
+    state.update(key, status="done", glb=stored["public_url"], error=None)
+    return stored["public_url"]
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--art-style", action="append", choices=sorted(ALLOWED_ART_STYLES),
+                    help="対象のアートスタイル（複数指定可。既定: realistic）")
+    ap.add_argument("--no-remesh", action="store_true", help="should_remesh=False で生成")
+    ap.add_argument("--no-tpose", action="store_true", help="is_a_t_pose=False で生成")
+    ap.add_argument("--refine", action="store_true", help="Refine（テクスチャ）まで生成する")
+    ap.add_argument("--concurrency", type=int, default=2, help="同時に進める生成数")
+    ap.add_argument("--state", default="prewarm_state.json", help="再開用の進行状況ファイル")
+    ap.add_argument("--timeout", type=float, default=900, help="1タスクの待機上限(秒)")
+    ap.add_argument("--interval", type=float, default=5, help="進捗確認の間隔(秒)")
+    ap.add_argument("--limit", type=int, default=0, help="処理する件数の上限（0 は全件）")
+    ap.add_argument("--dry-run", action="store_true", help="対象を一覧表示するだけ")
+    args = ap.parse_args()
+
+    from utils.model_cache import cache_key, cache_params
+
+    jobs = []
+    for art_style in args.art_style or ["realistic"]:
+        for profile in iter_profiles():
+            prompt, negative = profile_to_prompt(profile)
+            params = cache_params(prompt, negative, art_style, not args.no_remesh, not args.no_tpose)
+            jobs.append((cache_key(params), params))
+    if args.limit:
+        jobs = jobs[: args.limit]
+
+    if args.dry_run:
+        for key, params in jobs:
+            print(key[:12], params["art_style"], params["prompt"])
+        print(f"{len(jobs)} prompts")
+        return
+
+    from utils import model_cache
+
+    state = _State(args.state)
+    todo = []
+    for key, params in jobs:
+        if state.get(key).get("status") == "done" or model_cache.count_variants(key) > 0:
+            continue
+        todo.append((key, params))
+    print(f"{len(jobs)} prompts, {len(jobs) - len(todo)} already cached, {len(todo)} to generate")
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as ex:
+        futures = {ex.submit(_run_one, key, params, args, state): key for key, params in todo}
+        for i, fut in enumerate(as_completed(futures), 1):
+            key = futures[fut]
+            try:
+                url = fut.result()
+                print(f"[{i}/{len(todo)}] {key[:12]} ok {url}")
+            except Exception as e:
+                failed += 1
+                state.update(key, status="error", error=f"{e.__class__.__name__}: {e}")
+                print(f"[{i}/{len(todo)}] {key[:12]} error {e}")
+    print(f"done: {len(todo) - failed} generated, {failed} failed")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -123,14 +123,21 @@ async function submitAnswers() {
     sessionStorage.setItem("diag.summary", JSON.stringify(data.summary_lines || []));
     if (data.summary_text) sessionStorage.setItem("diag.summary_text", data.summary_text);
     if (data.derived_prompt) sessionStorage.setItem("diag.derived_prompt", data.derived_prompt);
+    // Preview 待ち〜Refine はサーバーがこのパイプラインで進める（/result はこれを見る）
+    if (data.task_id && data.pipeline_id) sessionStorage.setItem(`pipeline.${data.task_id}`, data.pipeline_id);
     sessionStorage.setItem("diag.art_style", (DEFAULT_ART_STYLE || "realistic"));
 
     // ここから結果ページへ遷移（ローディングのまま移動）
     if (data.model_urls && data.model_urls.glb) {
       sessionStorage.setItem("diag.glb", data.model_urls.glb);
+      if (data.model_urls.lod_glb) sessionStorage.setItem("diag.lod_glb", data.model_urls.lod_glb);
+      else sessionStorage.removeItem("diag.lod_glb");
       location.href = "/result";
       return;
     }
+    // 前回のキャッシュ済みモデルが残っていると /result が ?task= より先にそちらを表示してしまう
+    sessionStorage.removeItem("diag.glb");
+    sessionStorage.removeItem("diag.lod_glb");
     const q = new URLSearchParams();
     if (data.task_id) q.set("task", data.task_id);
     location.href = `/result${q.toString() ? "?" + q.toString() : ""}`;
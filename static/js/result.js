@@ -1,6 +1,5 @@
 // === 設定 ===
 const AUTO_SAVE_LOCAL = true;   // /api/download でローカルに中継保存
-const REFINE_AUTORUN = true;    // プレビュー成功後に自動で Refine 走らせる
 
 // === util ===
 const $ = id => document.getElementById(id);
@@ -85,10 +84,17 @@ async function registerToCatalog() {
 }
 
 // === 3Dモデル表示 ===
-async function showModel(glbUrl) {
+async function showModel(glbUrl, lodUrl) {
     ORIGINAL_GLB_URL = glbUrl; // 登録用に保持
     const viewer = $("viewer");
 
+    // 軽量版（LOD）があれば先に表示し、本体の取得が済んでから差し替える
+    if (lodUrl) {
+        viewer.setAttribute("src", lodUrl);
+        hideOverlay();
+        if ($("miniProgress")) $("miniProgress").style.display = "none";
+    }
+
     // 同じURLだと <model-viewer> がリロードしないことがある → 一意ファイル名で保存
     let src = glbUrl;
     if (AUTO_SAVE_LOCAL) {
@@ -106,6 +112,9 @@ async function showModel(glbUrl) {
             }
         } catch (_) { /* 中継保存に失敗しても継続 */ }
     }
+    if (lodUrl) {
+        try { await fetch(src); } catch (_) { /* 取得できなくても通常どおり読み込む */ }
+    }
 
     // 先に空にしてから再セットすると確実に再読み込みされる
     try { viewer.pause && viewer.pause(); } catch { }
@@ -143,128 +152,140 @@ async function showModel(glbUrl) {
     if (registerBtn) registerBtn.hidden = false;
 }
 
-// === Refine 起動 ===
-async function startRefine(previewTaskId) {
-    const texturePrompt =
-        sessionStorage.getItem("diag.texture_prompt") ||
-        sessionStorage.getItem("diag.derived_prompt") || "";
-    const artStyle = sessionStorage.getItem("diag.art_style") || "realistic";
-
-    const res = await fetch(`/api/text-to-3d/${encodeURIComponent(previewTaskId)}/refine`, {
+// === サーバー側パイプライン ===
+// Preview 待ち → Refine → Rigging → Animation はサーバーが順に進める。ここでは集約状態だけを見る
+// SSE（/api/pipelines/<id>/events）で変わるたびに受け取る。使えない場合は /api/pipelines/<id> をポーリング
+const STAGE_LABELS = {
+    preview: "メッシュ（形状）を生成中…",
+    refine: "テクスチャ（色）を生成中…",
+    store_model: "モデルを保存中…",
+    register: "図鑑に登録中…",
+    rig: "自動リギング中…",
+    animate: "アニメーション適用中…",
+    store_animation: "アニメーションを保存中…",
+};
+
+async function startPipeline(body) {
+    const res = await fetch("/api/pipelines", {
         method: "POST",
         headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({
-            texture_prompt: texturePrompt,
-            art_style: artStyle,
-            enable_pbr: (artStyle !== "sculpture"),
-        }),
+        body: JSON.stringify(body),
     });
     const j = await res.json();
     if (j.error) throw new Error(j.error);
-    return j.refine_task_id;
+    return j.id;
 }
 
-// === ポーリング（Text-to-3D） ===
-async function pollTask(taskId, mode = "preview", previewTaskId = null) {
-    if (mode === "preview") PREVIEW_TASK_ID = taskId;
-    if (!previewTaskId) previewTaskId = PREVIEW_TASK_ID;
-
-    let done = false;
-    while (!done) {
-        const r = await fetch(`/api/text-to-3d/${encodeURIComponent(taskId)}`);
-        const j = await r.json();
-        if (j.error) throw new Error(j.error);
-
-        const pct = Math.max(0, Math.min(100, j.progress || 0));
-        updateOverlay(pct);
-
-        if (j.status === "SUCCEEDED") {
-            if (mode === "preview") {
-                if (REFINE_AUTORUN) {
-                    updateOverlay(pct, "テクスチャ（色）を生成中…");
-                    const refineId = await startRefine(previewTaskId);
-                    REFINE_TASK_ID = refineId;
-                    await pollTask(refineId, "refine", previewTaskId);
-                } else {
-                    const glb = j.model_urls && j.model_urls.glb;
-                    if (!glb) throw new Error("GLB URL not found");
-                    await showModel(glb);
-                }
-            } else {
-                REFINE_TASK_ID = taskId;
-                const glb = j.model_urls && j.model_urls.glb;
-                if (!glb) throw new Error("GLB URL not found");
-                await showModel(glb);
-            }
-            done = true;
-
-        } else if (j.status === "FAILED" || j.status === "CANCELLED") {
-            throw new Error(j.status);
-        } else {
-            await sleep(1200);
-        }
+// 集約状態を画面へ反映し、終わっていれば結果を返す（失敗なら例外）
+function applyPipeline(j) {
+    if (j.error) throw new Error(j.error);
+    updateOverlay(j.progress, STAGE_LABELS[(j.current || [])[0]]);
+    if (j.status === "SUCCEEDED") return j;
+    if (j.status === "FAILED") {
+        const failed = Object.entries(j.stages || {}).find(([, st]) => st.status === "FAILED");
+        throw new Error(failed ? `${failed[0]}: ${failed[1].error}` : "FAILED");
     }
+    return null;
 }
 
-// === Rigging/Animation ===
-async function pollRigging(rigId) {
+async function pollPipeline(pipelineId) {
     while (true) {
-        const j = await fetch(`/api/rigging/${encodeURIComponent(rigId)}`).then(r => r.json());
-        if (j.error) throw new Error(j.error);
-        const pct = Math.max(0, Math.min(100, j.progress || 0));
-        updateOverlay(pct, "自動リギング中…");
-        if (j.status === "SUCCEEDED") return j;
-        if (j.status === "FAILED" || j.status === "CANCELLED") throw new Error(j.status);
+        const res = await fetch(`/api/pipelines/${encodeURIComponent(pipelineId)}`);
+        const done = applyPipeline(await res.json());
+        if (done) return done;
         await sleep(1200);
     }
 }
 
-async function pollAnimation(animId) {
-    while (true) {
-        const j = await fetch(`/api/animations/${encodeURIComponent(animId)}`).then(r => r.json());
-        if (j.error) throw new Error(j.error);
-        const pct = Math.max(0, Math.min(100, j.progress || 0));
-        updateOverlay(pct, "アニメーション適用中…");
-        if (j.status === "SUCCEEDED") return j;
-        if (j.status === "FAILED" || j.status === "CANCELLED") throw new Error(j.status);
-        await sleep(1200);
+function watchPipeline(pipelineId) {
+    if (!window.EventSource) return pollPipeline(pipelineId);
+    return new Promise((resolve, reject) => {
+        const es = new EventSource(`/api/pipelines/${encodeURIComponent(pipelineId)}/events`);
+        let settled = false;
+        const settle = (fn, v) => {
+            if (settled) return;
+            settled = true;
+            es.close();
+            fn(v);
+        };
+        es.addEventListener("progress", ev => {
+            try {
+                const done = applyPipeline(safeParse(ev.data) || {});
+                if (done) settle(resolve, done);
+            } catch (e) {
+                settle(reject, e);
+            }
+        });
+        es.addEventListener("error", () => {
+            // 終了状態を受け取る前に切れたら（404 やプロキシの切断など）ポーリングで続きを見る
+            if (settled) return;
+            settled = true;
+            es.close();
+            pollPipeline(pipelineId).then(resolve, reject);
+        });
+    });
+}
+
+// 同じタブで再読み込みしても、動いているパイプラインを作り直さずに続きから見る
+async function resumeOrStartPipeline(storageKey, body) {
+    let pipelineId = sessionStorage.getItem(storageKey);
+    if (!pipelineId) {
+        pipelineId = await startPipeline(body);
+        sessionStorage.setItem(storageKey, pipelineId);
+    }
+    try {
+        return await watchPipeline(pipelineId);
+    } catch (e) {
+        sessionStorage.removeItem(storageKey);
+        throw e;
     }
 }
 
+// === Text-to-3D ===
+async function pollTask(taskId) {
+    PREVIEW_TASK_ID = taskId;
+    // 診断送信時にサーバーが始めたパイプラインがあればそれを見る（pipeline.<task_id> は quiz.js が保存）
+    const artStyle = sessionStorage.getItem("diag.art_style") || "realistic";
+    const p = await resumeOrStartPipeline(`pipeline.${taskId}`, {
+        preview_task_id: taskId,
+        texture_prompt:
+            sessionStorage.getItem("diag.texture_prompt") ||
+            sessionStorage.getItem("diag.derived_prompt") || "",
+        art_style: artStyle,
+        enable_pbr: (artStyle !== "sculpture"),
+    });
+    REFINE_TASK_ID = p.result.refine_task_id;
+    if (!p.result.model_glb) throw new Error("GLB URL not found");
+    await showModel(p.result.model_glb, p.result.lod_glb);
+}
+
+// === Rigging/Animation ===
 async function runAnimationFlow(actionId) {
-    if (!REFINE_TASK_ID) {
+    // キャッシュ済みモデル（diag.glb）は Refine タスクが無いので model_url でリギングする
+    const cachedGlb = sessionStorage.getItem("diag.glb");
+    if (!REFINE_TASK_ID && !cachedGlb) {
         alert("先にテクスチャ生成（Refine）が必要です。少し待ってからお試しください。");
         return;
     }
     const status = $("animStatus");
     showOverlay("自動リギング中…");
 
-    // 1) Rigging を作成 → 返ってきた result(ID) を RIG_TASK_ID に保存（これを後で必ず渡す）
-    const rigRes = await fetch("/api/rigging", {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ input_task_id: REFINE_TASK_ID, height_meters: 1.7 }),
-    }).then(r => r.json());
-    if (rigRes.error) throw new Error("Rigging create failed: " + rigRes.error);
-
-    RIG_TASK_ID = rigRes.rig_task_id; // ★ 公式の「作成レスのID」を保持
-    sessionStorage.setItem("rig.task_id", RIG_TASK_ID);
-    if (status) status.textContent = `リギング開始… (id: ${RIG_TASK_ID})`;
+    // 同じモデルのリギングが済んでいれば Animation だけ作る
+    const source = REFINE_TASK_ID || cachedGlb;
+    const body = REFINE_TASK_ID ? { refine_task_id: REFINE_TASK_ID } : { model_url: cachedGlb };
+    if (RIG_TASK_ID && sessionStorage.getItem("rig.source") === source) body.rig_task_id = RIG_TASK_ID;
+    body.action_id = Number(actionId);
+    body.height_meters = 1.7;
 
-    const rigDone = await pollRigging(RIG_TASK_ID);
-    if (status) status.textContent = `アニメーションを生成しています… (rig: ${RIG_TASK_ID})`;
+    const pipelineId = await startPipeline(body);
+    if (status) status.textContent = `アニメーションを生成しています… (pipeline: ${pipelineId})`;
+    const p = await watchPipeline(pipelineId);
 
-    // 2) Animation 作成時は RIG_TASK_ID を厳密に使用
-    const aniRes = await fetch("/api/animations", {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ rig_task_id: RIG_TASK_ID, action_id: Number(actionId) }),
-    }).then(r => r.json());
-    if (aniRes.error) throw new Error("Animation create failed: " + aniRes.error);
-
-    const aniDone = await pollAnimation(aniRes.animation_task_id);
+    RIG_TASK_ID = p.result.rig_task_id;
+    sessionStorage.setItem("rig.task_id", RIG_TASK_ID);
+    sessionStorage.setItem("rig.source", source);
 
-    const glb = aniDone.result && (aniDone.result.animation_glb_url || aniDone.result.glb_url);
+    const glb = p.result.animation_glb;
     if (!glb) throw new Error("Animation GLB URL not found");
     if (status) status.textContent = "アニメーションを適用しました（再生を開始します）";
     await showModel(glb);
@@ -300,12 +321,12 @@ async function runAnimationFlow(actionId) {
     const glb = sessionStorage.getItem("diag.glb");
 
     if (glb) {
-        showModel(glb);
+        showModel(glb, sessionStorage.getItem("diag.lod_glb"));
         return;
     }
     if (taskId) {
         showOverlay("メッシュ（形状）を生成中…");
-        pollTask(taskId, "preview").catch(e => {
+        pollTask(taskId).catch(e => {
             hideOverlay();
             if ($("miniProgress")) $("miniProgress").style.display = "none";
             alert("生成エラー: " + e.message);
@@ -9,17 +9,24 @@ document.addEventListener("DOMContentLoaded", async () => {
             (typeof item.title === "object" ? item.title.title : item.title) || "無題モデル";
         const user = item.user || "anonymous";
 
-        if (item.thumbnail_url) {
-            // 静的サムネイル（軽量）
+        const thumbs = item.thumbnails || {};
+        if (thumbs["256"] || item.thumbnail_url) {
+            // 静的サムネイル（自前 Storage の縮小版を優先）
             const img = document.createElement("img");
-            img.src = item.thumbnail_url;
+            img.src = thumbs["256"] || item.thumbnail_url;
+            if (thumbs["256"] && thumbs["768"]) {
+                img.srcset = `${thumbs["256"]} 1x, ${thumbs["768"]} 3x`;
+            }
+            img.width = 240;
+            img.height = 240;
             img.alt = title;
             img.className = "thumb";
+            img.loading = "lazy";
             card.appendChild(img);
         } else {
             // fallback: モデルを直接表示
             const mv = document.createElement("model-viewer");
-            mv.src = item.public_url;
+            mv.src = item.lod_url || item.public_url;
             mv.alt = title;
             mv.cameraControls = true;
             mv.autoRotate = true;
@@ -43,13 +50,28 @@ document.addEventListener("DOMContentLoaded", async () => {
         return card;
     };
 
+    const PAGE_SIZE = 24;
+    const moreBtn = document.getElementById("load-more");
+    let nextCursor = null;
+    let loading = false;
+
+    const fetchPage = async (cursor) => {
+        const params = new URLSearchParams({ limit: String(PAGE_SIZE) });
+        if (cursor) params.set("cursor", cursor);
+        const res = await fetch(`/api/catalog?${params}`);
+        return res.json();
+    };
+
+    const updateMore = () => {
+        moreBtn.style.display = nextCursor ? "" : "none";
+    };
+
     const loadModels = async () => {
         grid.innerHTML =
             `<p style="text-align:center; color:var(--muted); padding:20px;">読み込み中...</p>`;
 
         try {
-            const res = await fetch("/api/catalog");
-            const data = await res.json();
+            const data = await fetchPage(null);
             grid.innerHTML = "";
 
             if (!data.ok) {
@@ -65,11 +87,42 @@ document.addEventListener("DOMContentLoaded", async () => {
             }
 
             models.forEach((item) => grid.appendChild(renderCard(item)));
+            nextCursor = data.next_cursor || null;
+            updateMore();
         } catch (err) {
             console.error(err);
             grid.innerHTML = `<p style="color:red; text-align:center;">エラー: ${err.message}</p>`;
         }
     };
 
+    // 次ページ（ボタン or 画面下端に近づいたら）
+    const loadMore = async () => {
+        if (loading || !nextCursor) return;
+        loading = true;
+        moreBtn.disabled = true;
+        try {
+            const data = await fetchPage(nextCursor);
+            if (!data.ok) throw new Error(data.error || "取得失敗");
+            (data.models || []).forEach((item) => grid.appendChild(renderCard(item)));
+            nextCursor = data.next_cursor || null;
+        } catch (err) {
+            console.error(err);
+        } finally {
+            loading = false;
+            moreBtn.disabled = false;
+            updateMore();
+        }
+    };
+
+    moreBtn.addEventListener("click", loadMore);
+    if ("IntersectionObserver" in window) {
+        new IntersectionObserver(
+            (entries) => {
+                if (entries.some((e) => e.isIntersecting)) loadMore();
+            },
+            { rootMargin: "400px" }
+        ).observe(moreBtn);
+    }
+
     loadModels();
 });
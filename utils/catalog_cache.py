@@ -0,0 +1,81 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from utils import metrics
+
+# 図鑑一覧のプロセス内スナップショット
+# register_model_from_url が書き込むたびに先頭へ追加し、このプロセスで既存のドキュメントを
+# 書き換えたとき（軽量版の lod_url の追記など）は invalidate() で捨てる。それ以外は TTL で取り直す
+# （他ワーカーでの登録、コンソールやスクリプトでの編集・削除は TTL 経過後に反映される）
+CATALOG_TTL_SEC = float(os.getenv("CATALOG_TTL_SEC", "60"))
+CATALOG_MAX_AGE_SEC = int(os.getenv("CATALOG_MAX_AGE_SEC", "10"))  # レスポンスの Cache-Control max-age
+
+_items: Optional[List[Dict[str, Any]]] = None
+_etag: Optional[str] = None
+_loaded_at = 0.0
+_limit = 0
+_lock = threading.Lock()
+_load_lock = threading.Lock()
+
+
+def _compute_etag(items: List[Dict[str, Any]]) -> str:
+    raw = json.dumps(items, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _set_locked(items: List[Dict[str, Any]], limit: int, loaded: bool = True):
+    global _items, _etag, _loaded_at, _limit
+    _items = items
+    _etag = _compute_etag(items)
+    _limit = limit
+    if loaded:
+        _loaded_at = time.monotonic()
+
+
+def _view_locked(limit: int) -> Tuple[List[Dict[str, Any]], str]:
+    if len(_items) <= limit:
+        return _items, _etag
+    items = _items[:limit]
+    return items, _compute_etag(items)
+
+
+def get_snapshot(
+    loader: Callable[[int], List[Dict[str, Any]]], limit: int
+) -> Tuple[List[Dict[str, Any]], str]:
+    """(items, etag) を返す。期限切れ・未取得なら loader(limit) で取り直す。"""
+    with _lock:
+        if _items is not None and _limit >= limit and time.monotonic() - _loaded_at < CATALOG_TTL_SEC:
+            metrics.cache_result("catalog", "hit")
+            return _view_locked(limit)
+    # 同時に期限切れを踏んだリクエストは1本の取得にまとめる
+    with _load_lock:
+        with _lock:
+            if _items is not None and _limit >= limit and time.monotonic() - _loaded_at < CATALOG_TTL_SEC:
+                metrics.cache_result("catalog", "shared")
+                return _view_locked(limit)
+        metrics.cache_result("catalog", "miss")
+        items = loader(limit)
+        with _lock:
+            _set_locked(items, limit)
+            return _view_locked(limit)
+
+
+def add_item(item: Dict[str, Any]):
+    """新規登録分をスナップショットの先頭に差し込む（未取得なら何もしない）。"""
+    with _lock:
+        if _items is None:
+            return
+        items = [item] + [i for i in _items if i.get("id") != item.get("id")]
+        _set_locked(items[: max(_limit, 1)], _limit, loaded=False)
+
+
+def invalidate():
+    """スナップショットを捨て、次の一覧取得で取り直させる。"""
+    global _items, _etag
+    with _lock:
+        _items = None
+        _etag = None
@@ -0,0 +1,123 @@
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from utils import metrics
+
+# /api/download の中継保存キャッシュ
+# ファイル名は URL のハッシュ。同じ URL の同時リクエストは1回の取得にまとめ、
+# 合計サイズが DOWNLOAD_CACHE_MAX_BYTES を超えたら最終利用（mtime）の古い順に消す
+DOWNLOAD_CACHE_MAX_BYTES = int(os.getenv("DOWNLOAD_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+PART_MAX_AGE_SEC = 3600  # 取得途中で落ちたプロセスの一時ファイルを消すまでの秒数
+
+# 署名付き URL の有効期限・署名パラメータ（同じファイルでもリクエストごとに変わる）
+_SIGNING_PARAMS = ("expires", "signature", "key-pair-id", "policy")
+_SIGNING_PREFIXES = ("x-amz-", "x-goog-")
+_ALLOWED_EXTS = (".glb", ".gltf", ".fbx", ".obj", ".usdz", ".png", ".jpg", ".webp")
+
+_inflight: Dict[str, Future] = {}
+_lock = threading.Lock()
+_evict_lock = threading.Lock()
+
+
+def _cache_url(url: str) -> str:
+    parts = urlsplit(url)
+    query = [
+        (k, v)
+        for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if k.lower() not in _SIGNING_PARAMS and not k.lower().startswith(_SIGNING_PREFIXES)
+    ]
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(sorted(query)), ""))
+
+
+def cache_name(url: str) -> str:
+    """URL に対応するキャッシュファイル名（<sha256>.<ext>）。"""
+    ext = os.path.splitext(urlsplit(url).path)[1].lower()
+    if ext not in _ALLOWED_EXTS:
+        ext = ".glb"
+    return hashlib.sha256(_cache_url(url).encode("utf-8")).hexdigest() + ext
+
+
+def _touch(path: str) -> bool:
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def evict(directory: str, keep: str = ""):
+    """合計サイズが上限を超えていれば古い順に削除する（keep は消さない）。"""
+    if DOWNLOAD_CACHE_MAX_BYTES <= 0:
+        return
+    with _evict_lock:
+        files = []
+        total = 0
+        now = time.time()
+        with os.scandir(directory) as it:
+            for e in it:
+                if not e.is_file():
+                    continue
+                st = e.stat()
+                if ".part-" in e.name:
+                    if now - st.st_mtime > PART_MAX_AGE_SEC:
+                        _remove(e.path)
+                    continue
+                files.append((st.st_mtime, st.st_size, e.path))
+                total += st.st_size
+        files.sort()
+        for _, size, path in files:
+            if total <= DOWNLOAD_CACHE_MAX_BYTES:
+                break
+            if os.path.basename(path) == keep:
+                continue
+            _remove(path)
+            total -= size
+
+
+def fetch(url: str, directory: str, download: Callable[[str, str], str]) -> str:
+    """
+    url を directory にキャッシュしてファイル名を返す。
+    download(url, dest) は実際の取得処理（meshy_client.download_file）。
+    """
+    name = cache_name(url)
+    path = os.path.join(directory, name)
+    if _touch(path):
+        metrics.cache_result("download", "hit")
+        return name
+
+    with _lock:
+        fut = _inflight.get(name)
+        leader = fut is None
+        if leader:
+            fut = Future()
+            _inflight[name] = fut
+    metrics.cache_result("download", "miss" if leader else "shared")
+    if not leader:
+        return fut.result()
+
+    tmp = f"{path}.part-{os.getpid()}-{threading.get_ident()}"
+    try:
+        download(url, tmp)
+        os.replace(tmp, path)
+        fut.set_result(name)
+    except BaseException as e:
+        fut.set_exception(e)
+        _remove(tmp)
+        raise
+    finally:
+        with _lock:
+            _inflight.pop(name, None)
+    evict(directory, keep=name)
+    return name
@@ -1,11 +1,55 @@
+import os
+import json
+import base64
+import hashlib
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
 import requests
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timezone
-from typing import Any, Dict, Union
+from typing import Any, Dict, IO, Optional, Tuple, Union
 from firebase_admin import firestore, storage
+from google.api_core.exceptions import PreconditionFailed
 from firebase_init import init_firebase
+from utils import catalog_cache, thumbnails
+from utils.metrics import instrumented
+
+_APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 db, bucket = init_firebase()
 
+# GLB 取得 → Storage への転送設定
+MODEL_FETCH_TIMEOUT = (5, 60)  # (connect, read)
+MODEL_MAX_BYTES = int(os.getenv("MODEL_MAX_BYTES", str(200 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # 256KB の倍数（resumable upload の要件）
+SPOOL_MAX_MEMORY = 8 * 1024 * 1024   # これを超えたら一時ファイルへ退避
+# 軽量版 GLB（models/<sha256>_lod.glb）の生成
+LOD_ENABLED = os.getenv("LOD_ENABLED", "1").lower() in ("1", "true", "on")
+LOD_MAX_INPUT_BYTES = int(os.getenv("LOD_MAX_INPUT_BYTES", str(64 * 1024 * 1024)))  # これより大きい GLB は処理しない
+LOD_WAIT_SEC = float(os.getenv("LOD_WAIT_SEC", "120"))  # store_model_from_url が軽量版を待つ上限
+LOD_TIMEOUT_SEC = float(os.getenv("LOD_TIMEOUT_SEC", "300"))  # 軽量化プロセス1回の上限（超えたら kill して諦める）
+THUMB_FETCH_TIMEOUT = (5, 15)
+THUMB_CACHE_CONTROL = "public, max-age=31536000, immutable"  # 名前が内容（GLB の sha256）に紐づくため
+
+# 取得元 URL → (sha256, blob_path, lod)。同じ URL の再取得・再アップロードを省く（DEMO_MODE の SAMPLE_GLB など）
+_URL_DIGESTS: "OrderedDict[str, tuple]" = OrderedDict()
+_URL_DIGESTS_MAX = 256
+_url_lock = threading.Lock()
+# 軽量版の生成はリクエスト外の専用スレッド1本で順に行う。量子化は純 Python で CPU とメモリを食う
+# （32MB の GLB で 30 秒以上・+130MB ほど）ので、python -m utils.glb_optimizer を別プロセスで実行し、
+# Web ワーカーの GIL とメモリを使わない（終われば OS に返る）
+_lod_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="lod")
+_lod_inflight: Dict[str, Future] = {}  # sha256 -> 生成中の Future
+
+
+class ModelTooLargeError(Exception):
+    pass
+
+
 def _now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
@@ -31,6 +75,238 @@ def _coerce_meta(title_or_meta: Union[str, Dict[str, Any], None], extra: Dict[st
     return meta
 
 
+@instrumented("firebase")
+def _spool_download(url: str) -> Tuple[IO[bytes], str, int]:
+    """URL をストリーミング取得し、sha256 を計算しながら一時ファイルへ書く。"""
+    tmp = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    h = hashlib.sha256()
+    size = 0
+    try:
+        with requests.get(url, stream=True, timeout=MODEL_FETCH_TIMEOUT) as resp:
+            resp.raise_for_status()
+            length = int(resp.headers.get("Content-Length") or 0)
+            if length > MODEL_MAX_BYTES:
+                raise ModelTooLargeError(f"model exceeds {MODEL_MAX_BYTES} bytes ({length})")
+            for chunk in resp.iter_content(chunk_size=256 * 1024):
+                if not chunk:
+                    continue
+                size += len(chunk)
+                if size > MODEL_MAX_BYTES:
+                    raise ModelTooLargeError(f"model exceeds {MODEL_MAX_BYTES} bytes")
+                h.update(chunk)
+                tmp.write(chunk)
+    except BaseException:
+        tmp.close()
+        raise
+    tmp.seek(0)
+    return tmp, h.hexdigest(), size
+
+
+def _remember_url(url: str, digest: str, blob_path: str, lod: Optional[Dict[str, Any]]):
+    with _url_lock:
+        _URL_DIGESTS[url] = (digest, blob_path, lod)
+        _URL_DIGESTS.move_to_end(url)
+        while len(_URL_DIGESTS) > _URL_DIGESTS_MAX:
+            _URL_DIGESTS.popitem(last=False)
+
+
+def _existing_lod(digest: str) -> Optional[Dict[str, Any]]:
+    """保存済みの軽量版があれば {public_url, path, report}（report は blob のメタデータ）を返す。"""
+    lod_path = f"models/{digest}_lod.glb"
+    existing = bucket.get_blob(lod_path)
+    if existing is None:
+        return None
+    report = json.loads((existing.metadata or {}).get("lod_report") or "{}")
+    return {"public_url": existing.public_url, "path": lod_path, "report": report}
+
+
+def _optimize_in_subprocess(src: IO[bytes]) -> Tuple[Optional[bytes], Dict[str, Any]]:
+    """optimize_glb を別プロセスで実行して (lod_bytes, report) を返す。受け渡しは一時ファイル。"""
+    with tempfile.TemporaryDirectory(prefix="lod-") as work:
+        in_path, out_path = os.path.join(work, "in.glb"), os.path.join(work, "out.glb")
+        src.seek(0)
+        with open(in_path, "wb") as f:
+            shutil.copyfileobj(src, f)
+        proc = subprocess.run(
+            [sys.executable, "-m", "utils.glb_optimizer", in_path, out_path],
+            cwd=_APP_ROOT, capture_output=True, timeout=LOD_TIMEOUT_SEC, check=False,
+        )
+        if proc.returncode != 0:
+            raise RuntimeError(f"glb_optimizer exited {proc.returncode}: {proc.stderr.decode(errors='replace')[-500:]}")
+        report = json.loads(proc.stdout.decode().strip().splitlines()[-1])
+        if not os.path.exists(out_path):
+            return None, report
+        with open(out_path, "rb") as f:
+            return f.read(), report
+
+
+@instrumented("firebase")
+def _store_lod(digest: str, tmp: IO[bytes]) -> Optional[Dict[str, Any]]:
+    """
+    軽量版 GLB を作って models/<sha256>_lod.glb に保存し {public_url, path, report} を返す。
+    作れなかった場合は None。tmp はここで閉じる。
+    """
+    lod_path = f"models/{digest}_lod.glb"
+    try:
+        data, report = _optimize_in_subprocess(tmp)
+    except Exception as e:
+        print(f"[lod] optimize failed for {digest}: {e}")
+        return None
+    finally:
+        tmp.close()
+    print(f"[lod] {digest}: {report}")
+    if data is None:
+        return None
+    lod_blob = bucket.blob(lod_path)
+    lod_blob.metadata = {"lod_report": json.dumps(report)}
+    try:
+        lod_blob.upload_from_string(data, content_type="model/gltf-binary", if_generation_match=0)
+    except PreconditionFailed:
+        pass
+    return {"public_url": lod_blob.public_url, "path": lod_path, "report": report}
+
+
+def _lod_task(mesh_url: str, digest: str, tmp: IO[bytes]) -> Optional[Dict[str, Any]]:
+    try:
+        lod = _store_lod(digest, tmp)
+        if lod is not None:
+            _remember_url(mesh_url, digest, f"models/{digest}.glb", lod)
+        return lod
+    finally:
+        with _url_lock:
+            _lod_inflight.pop(digest, None)
+
+
+def _schedule_lod(mesh_url: str, digest: str, tmp: IO[bytes]) -> Future:
+    """LOD の生成を専用スレッドに回す（tmp はこちらで閉じる）。同じ内容を生成中ならその Future を返す。"""
+    with _url_lock:
+        fut = _lod_inflight.get(digest)
+        if fut is None:
+            fut = _lod_executor.submit(_lod_task, mesh_url, digest, tmp)
+            _lod_inflight[digest] = fut
+            tmp = None
+    if tmp is not None:
+        tmp.close()
+    return fut
+
+
+def _store_model_blob(mesh_url: str) -> Tuple[Any, str, Optional[int], Optional[Dict[str, Any]], Optional[Future]]:
+    """
+    GLB を内容ハッシュ名 models/<sha256>.glb で保存し (blob, sha256, size, lod, lod_future) を返す。
+    同じ内容が既にあればアップロードしない。lod は保存済みの軽量版。
+    まだ無ければ保存後にバックグラウンドで作り、lod_future がその結果（lod または None）になる。
+    """
+    with _url_lock:
+        known = _URL_DIGESTS.get(mesh_url)
+        if known is not None:
+            digest, blob_path, lod = known
+            return bucket.blob(blob_path), digest, None, lod, _lod_inflight.get(digest)
+
+    tmp, digest, size = _spool_download(mesh_url)
+    lod = lod_future = None
+    try:
+        blob_path = f"models/{digest}.glb"
+        blob = bucket.blob(blob_path, chunk_size=UPLOAD_CHUNK_SIZE)
+        if not blob.exists():
+            try:
+                # 同時登録で先を越された場合は既存オブジェクトをそのまま使う
+                blob.upload_from_file(
+                    tmp,
+                    size=size,
+                    content_type="model/gltf-binary",
+                    if_generation_match=0,
+                )
+            except PreconditionFailed:
+                pass
+        if LOD_ENABLED:
+            lod = _existing_lod(digest)
+            if lod is None and size <= LOD_MAX_INPUT_BYTES:
+                lod_future, tmp = _schedule_lod(mesh_url, digest, tmp), None
+    finally:
+        if tmp is not None:
+            tmp.close()
+    _remember_url(mesh_url, digest, blob_path, lod)
+    return blob, digest, size, lod, lod_future
+
+
+@instrumented("firebase")
+def store_model_from_url(mesh_url: str) -> Dict[str, Any]:
+    """
+    GLB を Storage にだけ保存する（Firestore の図鑑には載せない）。
+    バックグラウンド（ジョブ・パイプライン・スクリプト）用なので、軽量版ができるまで待つ。
+    """
+    blob, digest, _, lod, lod_future = _store_model_blob(mesh_url)
+    if lod is None and lod_future is not None:
+        try:
+            lod = lod_future.result(timeout=LOD_WAIT_SEC)
+        except Exception as e:
+            print(f"[lod] not ready for {digest}: {e}")
+    return {
+        "public_url": blob.public_url,
+        "path": blob.name,
+        "sha256": digest,
+        "lod_url": lod["public_url"] if lod else None,
+    }
+
+
+def _fetch_bytes(url: str, max_bytes: int) -> Tuple[bytes, Optional[str]]:
+    with requests.get(url, stream=True, timeout=THUMB_FETCH_TIMEOUT) as resp:
+        resp.raise_for_status()
+        buf = bytearray()
+        for chunk in resp.iter_content(chunk_size=64 * 1024):
+            buf.extend(chunk)
+            if len(buf) > max_bytes:
+                raise ModelTooLargeError(f"thumbnail exceeds {max_bytes} bytes")
+        return bytes(buf), resp.headers.get("Content-Type")
+
+
+def _upload_immutable(blob_path: str, data: bytes, content_type: str) -> str:
+    blob = bucket.blob(blob_path)
+    if not blob.exists():
+        blob.cache_control = THUMB_CACHE_CONTROL
+        try:
+            blob.upload_from_string(data, content_type=content_type, if_generation_match=0)
+        except PreconditionFailed:
+            pass
+    return blob.public_url
+
+
+@instrumented("firebase")
+def mirror_thumbnail(thumbnail_url: str, digest: str) -> Dict[str, str]:
+    """
+    Meshy のサムネイルを取得・縮小して models/<digest>_thumb_<size>.webp に保存し、
+    {"256": public_url, "768": public_url} を返す。Pillow が無ければ元画像を1枚だけ複製する。
+    digest は通常 GLB の sha256（sha256 を持たない古いドキュメントでは取得元 URL のハッシュ）。
+    """
+    data, ctype = _fetch_bytes(thumbnail_url, thumbnails.THUMB_MAX_BYTES)
+    if not thumbnails.resize_available():
+        data, ctype, ext = thumbnails.passthrough(data, ctype)
+        return {"orig": _upload_immutable(f"models/{digest}_thumb.{ext}", data, ctype)}
+    return {
+        str(size): _upload_immutable(f"models/{digest}_thumb_{size}.webp", webp, "image/webp")
+        for size, webp in thumbnails.make_thumbnails(data).items()
+    }
+
+
+def _mirror_thumbnail_safe(thumbnail_url: Optional[str], digest: str) -> Dict[str, str]:
+    # サムネイルは無くても登録は続ける（失敗時は元 URL のまま）
+    if not thumbnail_url:
+        return {}
+    try:
+        return mirror_thumbnail(thumbnail_url, digest)
+    except Exception as e:
+        print(f"[thumbnail] mirror failed for {digest}: {e}")
+        return {}
+
+
+def primary_thumbnail(thumbs: Dict[str, str], fallback: Optional[str]) -> Optional[str]:
+    """図鑑で使う1枚（一番小さいサイズ）。複製が無ければ fallback（元の URL）。"""
+    if not thumbs:
+        return fallback
+    return thumbs[min(thumbs, key=lambda k: int(k) if k.isdigit() else 0)]
+
+
+@instrumented("firebase")
 def register_model_from_url(
     mesh_url: str,
     title_or_meta: Union[str, Dict[str, Any], None] = None,
@@ -38,65 +314,136 @@ def register_model_from_url(
 ) -> Dict[str, Any]:
     """
     mesh_urlからGLBを取得→Storageへ保存→Firestoreへ登録。
-    thumbnail_url が extra に含まれていたら Firestore にも保存する。
+    thumbnail_url が extra に含まれていたら縮小版を Storage に複製し、Firestore にも保存する。
+    軽量版（lod_url）がまだ無ければ登録後にバックグラウンドで作り、できた時点でドキュメントへ追記する。
     """
     extra = extra or {}
     meta = _coerce_meta(title_or_meta, extra)
 
-    # GLBを取得
-    resp = requests.get(mesh_url)
-    resp.raise_for_status()
-
-    filename = f"model_{int(datetime.now().timestamp())}.glb"
-    blob_path = f"models/{filename}"
-    blob = bucket.blob(blob_path)
-    blob.upload_from_string(resp.content, content_type="model/gltf-binary")
+    # GLBを取得 → 内容ハッシュで重複排除して Storage へ
+    blob, digest, size, lod, lod_future = _store_model_blob(mesh_url)
+    blob_path = blob.name
     public_url = blob.public_url
+    lod_url = lod["public_url"] if lod else None
+
+    # サムネイルは自前の Storage に縮小版を置き、図鑑からはそちらを参照する
+    source_thumb = extra.get("thumbnail_url")
+    thumbs = _mirror_thumbnail_safe(source_thumb, digest)
+    thumbnail_url = primary_thumbnail(thumbs, source_thumb)
 
     # Firestore登録
     doc_ref = db.collection("models").document()
     doc_ref.set({
         "title": meta["title"],
         "public_url": public_url,
-        "thumbnail_url": extra.get("thumbnail_url"),  # ★追加
+        "thumbnail_url": thumbnail_url,  # ★追加
+        "thumbnails": thumbs,
+        "source_thumbnail_url": source_thumb,
         "path": blob_path,
+        "sha256": digest,
+        "lod_url": lod_url,
+        "lod_path": lod["path"] if lod else None,
+        "optimization": lod["report"] if lod else None,
         "user": meta["user"],
         "profile": meta["profile"],
         "created_at": firestore.SERVER_TIMESTAMP,
     })
 
-    return {
+    saved = {
         "id": doc_ref.id,
         "title": meta["title"],
         "public_url": public_url,
-        "thumbnail_url": extra.get("thumbnail_url"),
+        "thumbnail_url": thumbnail_url,
+        "thumbnails": thumbs,
         "path": blob_path,
+        "sha256": digest,
+        "lod_url": lod_url,
+        "optimization": lod["report"] if lod else None,
         "user": meta["user"],
         "profile": meta["profile"],
         "created_at": _now_iso(),
     }
+    catalog_cache.add_item(_catalog_item(doc_ref.id, saved, GRID_FIELDS))
+    if lod is None and lod_future is not None:
+        # ドキュメントを書いた後に登録するので、生成済みならこの場で追記される
+        lod_future.add_done_callback(lambda f: _publish_lod(doc_ref.id, f))
+    return saved
 
 
-def list_models(limit: int = 20) -> list:
-    """Firestoreから新しい順で取得。"""
-    q = db.collection("models").order_by("created_at", direction=firestore.Query.DESCENDING).limit(limit)
-    docs = q.stream()
-    items = []
-    for d in docs:
-        obj = d.to_dict() or {}
-        created = obj.get("created_at")
-        if hasattr(created, "isoformat"):
-            created = created.isoformat()
-        elif created is None:
-            created = ""
-        items.append({
-            "id": d.id,
-            "title": obj.get("title") or "生成モデル",
-            "public_url": obj.get("public_url"),
-            "thumbnail_url": obj.get("thumbnail_url"),  # ★追加
-            "path": obj.get("path"),
-            "user": obj.get("user") or "anonymous",
-            "profile": obj.get("profile") or {},
-            "created_at": created,
+def _publish_lod(doc_id: str, lod_future: Future):
+    try:
+        lod = lod_future.result()
+        if lod is None:
+            return
+        db.collection("models").document(doc_id).update({
+            "lod_url": lod["public_url"],
+            "lod_path": lod["path"],
+            "optimization": lod["report"],
         })
-    return items
+        # 一覧のスナップショットは lod_url を含むので取り直させる
+        catalog_cache.invalidate()
+    except Exception as e:
+        print(f"[lod] publish failed for {doc_id}: {e}")
+
+
+# 図鑑グリッドが表示に使うフィールド（一覧ではこれだけ取得する）
+GRID_FIELDS = ["title", "public_url", "lod_url", "thumbnail_url", "thumbnails", "user", "created_at"]
+
+
+def encode_cursor(item: Dict[str, Any]) -> str:
+    raw = json.dumps({"t": item.get("created_at") or "", "id": item["id"]})
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> Dict[str, Any]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        c = json.loads(raw)
+        return {"created_at": datetime.fromisoformat(c["t"]), "__name__": str(c["id"])}
+    except Exception as e:
+        raise ValueError(f"invalid cursor: {cursor}") from e
+
+
+@instrumented("firebase")
+def list_models_page(
+    limit: int = 20, cursor: Optional[str] = None, fields: Optional[list] = GRID_FIELDS
+) -> Tuple[list, Optional[str]]:
+    """
+    Firestoreから新しい順に1ページ分取得し (items, next_cursor) を返す。
+    cursor は前ページの next_cursor（created_at と id のキーセット）。fields=None なら全フィールド。
+    """
+    q = (
+        db.collection("models")
+        .order_by("created_at", direction=firestore.Query.DESCENDING)
+        .order_by("__name__", direction=firestore.Query.DESCENDING)
+    )
+    if fields:
+        q = q.select(fields)
+    if cursor:
+        q = q.start_after(_decode_cursor(cursor))
+    items = [_catalog_item(d.id, d.to_dict() or {}, fields) for d in q.limit(limit).stream()]
+    next_cursor = encode_cursor(items[-1]) if len(items) == limit else None
+    return items, next_cursor
+
+
+def _catalog_item(doc_id: str, obj: Dict[str, Any], fields: Optional[list] = None) -> Dict[str, Any]:
+    created = obj.get("created_at")
+    if hasattr(created, "isoformat"):
+        created = created.isoformat()
+    elif created is None:
+        created = ""
+    item = {
+        "id": doc_id,
+        "title": obj.get("title") or "生成モデル",
+        "public_url": obj.get("public_url"),
+        "lod_url": obj.get("lod_url"),
+        "thumbnail_url": obj.get("thumbnail_url"),  # ★追加
+        "thumbnails": obj.get("thumbnails") or {},
+        "path": obj.get("path"),
+        "user": obj.get("user") or "anonymous",
+        "profile": obj.get("profile") or {},
+        "created_at": created,
+    }
+    if fields:
+        item = {k: v for k, v in item.items() if k == "id" or k in fields}
+    return item
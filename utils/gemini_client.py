@@ -1,9 +1,18 @@
 import os
 import re
 import json
-from typing import Dict, Any, List
+import threading
+from typing import Dict, Any, List, Optional
+
+from utils import metrics
+from utils.metrics import instrumented
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "").strip()
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+
+# 呼び出しごとの締め切り（秒）
+QUESTIONS_TIMEOUT_SEC = float(os.getenv("GEMINI_QUESTIONS_TIMEOUT_SEC", "20"))
+SUMMARY_TIMEOUT_SEC = float(os.getenv("GEMINI_SUMMARY_TIMEOUT_SEC", "8"))
 
 _HIDE_RE = re.compile(
     r"[\(\（\[]\s*(?:強く\s*左|やや\s*左|中立|やや\s*右|強く\s*右)\s*[\)\）\]]"
@@ -53,6 +62,66 @@ LIKERT5 = [
 
 TRAIT_ORDER = ["energy", "imagination", "decision", "order"]
 
+SUMMARY_SYSTEM = (
+    "あなたは日本語で短い診断結果を作るアシスタントです。"
+    "出力はテキストのみ（日本語のみ、英単語は使わない）。"
+    "同じ語の過剰な繰り返しや箇条書き・羅列は避け、自然な文にする。"
+    "2～3文で、以下の構造を守ってください："
+    "1文目:「あなたは、◯◯な傾向があります。」（強く出ている性質だけ1～2個に要約）"
+    "2文目:「とてもいい点は、◯◯です。」"
+    "3文目:「しかし、気を付けるべきポイントは、◯◯です。」（必要なら2文目と連結可）"
+)
+
+# ---- モデル管理
+# google.generativeai は重いので初回利用時に import し、configure とモデル生成は
+# プロセスにつき1回だけ行う（以後は同じモデル/トランスポートを使い回す）
+_MODEL_SPECS = {
+    "questions": {
+        "system_instruction": PROMPT_SYSTEM,
+        "generation_config": {"response_mime_type": "application/json"},
+    },
+    "summary": {
+        "system_instruction": SUMMARY_SYSTEM,
+        "generation_config": {
+            "temperature": 0.7,
+            "max_output_tokens": 220,
+            "response_mime_type": "text/plain",
+        },
+    },
+}
+_models: Dict[str, Any] = {}
+_models_lock = threading.Lock()
+_configured = False
+
+
+def _get_model(name: str):
+    global _configured
+    model = _models.get(name)
+    if model is not None:
+        return model
+    with _models_lock:
+        model = _models.get(name)
+        if model is None:
+            import google.generativeai as genai
+
+            if not _configured:
+                genai.configure(api_key=GEMINI_API_KEY)
+                _configured = True
+            model = genai.GenerativeModel(GEMINI_MODEL, **_MODEL_SPECS[name])
+            _models[name] = model
+    return model
+
+
+def warm_up():
+    """gunicorn ワーカー起動時などに呼び、import とモデル生成を先に済ませる。"""
+    if not GEMINI_API_KEY:
+        return
+    try:
+        for name in _MODEL_SPECS:
+            _get_model(name)
+    except Exception:
+        pass
+
 
 def generate_questions_v1(desired_count: int = 10) -> Dict[str, Any]:
     """Geminiで質問を作成（失敗時はフォールバック）。"""
@@ -61,25 +130,36 @@ def generate_questions_v1(desired_count: int = 10) -> Dict[str, Any]:
     if not GEMINI_API_KEY:
         return {"version": "v1", "questions": _fallback_pool()[:count]}
 
-    try:
-        import google.generativeai as genai
+    return {"version": "v1", "questions": fill_questions(generate_questions_raw(count), count)}
 
-        genai.configure(api_key=GEMINI_API_KEY)
-        model = genai.GenerativeModel(
-            "gemini-1.5-flash",
-            system_instruction=PROMPT_SYSTEM,
-            generation_config={"response_mime_type": "application/json"},
+
+@instrumented("gemini")
+def generate_questions_raw(count: int, timeout: Optional[float] = None) -> List[Dict[str, Any]]:
+    """Geminiの生成結果を正規化して返す（フォールバックで補わない。失敗時は []）。"""
+    if not GEMINI_API_KEY:
+        return []
+    try:
+        resp = _get_model("questions").generate_content(
+            PROMPT_USER_TEMPLATE.format(count=count),
+            request_options={"timeout": timeout or QUESTIONS_TIMEOUT_SEC},
         )
-        resp = model.generate_content(PROMPT_USER_TEMPLATE.format(count=count))
-        data = json.loads(resp.text)
-        qs: List[Dict[str, Any]] = list(data.get("questions", []))
-    except Exception:
+        qs = _parse_questions(resp.text)
+    except Exception as e:
+        metrics.UPSTREAM_ERRORS.inc(service="gemini", op="generate_questions_raw", error=e.__class__.__name__)
         qs = []
+    return _normalize_qs(qs)
+
+
+def _parse_questions(text: str) -> List[Dict[str, Any]]:
+    return list(json.loads(text).get("questions", []))
+
 
-    qs = _normalize_qs(qs)
+def fill_questions(qs: List[Dict[str, Any]], count: int) -> List[Dict[str, Any]]:
+    """不足分をフォールバックの質問で補って count 問にする。"""
+    qs = list(qs)
     if len(qs) < count:
         qs = _topup_to_count(qs, count)
-    return {"version": "v1", "questions": qs[:count]}
+    return qs[:count]
 
 
 def _normalize_qs(qs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
@@ -184,52 +264,46 @@ def _fallback_pool() -> List[Dict[str, Any]]:
     return F
 
 
-def summarize_profile_jp(profile: Dict[str, Any]) -> str:
+@instrumented("gemini")
+def summarize_profile_jp(profile: Dict[str, Any], timeout: Optional[float] = None) -> str:
     """
     scores_to_profile() が返す profile(dict) から、日本語の1段落（2〜3文）を生成。
     Geminiキーが無い/失敗時は自然なフォールバック文を返す。
     """
     try:
         if not GEMINI_API_KEY:
-            return _fallback_summary(profile)
+            return _summary_fallback(profile, "no_api_key")
 
-        import google.generativeai as genai
+        resp = _get_model("summary").generate_content(
+            _summary_request(profile),
+            request_options={"timeout": timeout or SUMMARY_TIMEOUT_SEC},
+        )
+        return _finish_summary(resp.text, profile)
+    except Exception as e:
+        metrics.UPSTREAM_ERRORS.inc(service="gemini", op="summarize_profile_jp", error=e.__class__.__name__)
+        return _summary_fallback(profile, "error")
 
-        genai.configure(api_key=GEMINI_API_KEY)
 
-        system = (
-            "あなたは日本語で短い診断結果を作るアシスタントです。"
-            "出力はテキストのみ（日本語のみ、英単語は使わない）。"
-            "同じ語の過剰な繰り返しや箇条書き・羅列は避け、自然な文にする。"
-            "2～3文で、以下の構造を守ってください："
-            "1文目:「あなたは、◯◯な傾向があります。」（強く出ている性質だけ1～2個に要約）"
-            "2文目:「とてもいい点は、◯◯です。」"
-            "3文目:「しかし、気を付けるべきポイントは、◯◯です。」（必要なら2文目と連結可）"
-        )
+def _summary_request(profile: Dict[str, Any]) -> str:
+    user = {
+        "instruction": "次のプロファイルから文章を生成してください。",
+        "profile": profile,
+    }
+    return json.dumps(user, ensure_ascii=False)
+
+
+def _summary_fallback(profile: Dict[str, Any], reason: str) -> str:
+    metrics.SUMMARY_FALLBACK.inc(reason=reason)
+    return _fallback_summary(profile)
 
-        user = {
-            "instruction": "次のプロファイルから文章を生成してください。",
-            "profile": profile,
-        }
-
-        model = genai.GenerativeModel(
-            "gemini-1.5-flash",
-            system_instruction=system,
-            generation_config={
-                "temperature": 0.7,
-                "max_output_tokens": 220,
-                "response_mime_type": "text/plain",
-            },
-        )
-        resp = model.generate_content(json.dumps(user, ensure_ascii=False))
-        text = (resp.text or "").strip()
-        if not text:
-            return _fallback_summary(profile)
-        if not text.endswith(("。", "！", "!", "？", "?")):
-            text += "。"
-        return text
-    except Exception:
-        return _fallback_summary(profile)
+
+def _finish_summary(text: Optional[str], profile: Dict[str, Any]) -> str:
+    text = (text or "").strip()
+    if not text:
+        return _summary_fallback(profile, "empty")
+    if not text.endswith(("。", "！", "!", "？", "?")):
+        text += "。"
+    return text
 
 
 
@@ -252,6 +326,11 @@ _JA_COLOR = {
 }
 
 
+def fallback_summary_jp(profile: Dict[str, Any]) -> str:
+    """Geminiを使わない定型のサマリー文。"""
+    return _fallback_summary(profile)
+
+
 def _fallback_summary(profile: Dict[str, Any]) -> str:
     n = profile.get("norm", {})
 
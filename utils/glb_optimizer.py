@@ -0,0 +1,377 @@
+import io
+import json
+import os
+import struct
+import sys
+import time
+from array import array
+from typing import Any, Dict, List, Optional, Tuple
+
+# GLB（バイナリ glTF 2.0）の軽量版（LOD）を作る
+#   - NORMAL / TANGENT を正規化 BYTE、TEXCOORD を正規化 UNSIGNED_SHORT に量子化（KHR_mesh_quantization）
+#   - WEIGHTS を正規化 UNSIGNED_SHORT に（コア仕様で可）
+#   - 埋め込みテクスチャを LOD_TEXTURE_MAX px 以下に縮小（Pillow がある場合のみ）
+# POSITION はスキン付きメッシュだとノード変換で戻せないため量子化しない
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover
+    Image = None
+
+LOD_TEXTURE_MAX = int(os.getenv("LOD_TEXTURE_MAX", "512"))
+LOD_JPEG_QUALITY = 85
+
+GLB_MAGIC = 0x46546C67  # "glTF"
+CHUNK_JSON = 0x4E4F534A
+CHUNK_BIN = 0x004E4942
+
+FLOAT = 5126
+BYTE = 5120
+UNSIGNED_BYTE = 5121
+UNSIGNED_SHORT = 5123
+ARRAY_BUFFER = 34962
+NCOMP = {"SCALAR": 1, "VEC2": 2, "VEC3": 3, "VEC4": 4, "MAT2": 4, "MAT3": 9, "MAT4": 16}
+
+QUANTIZATION_EXT = "KHR_mesh_quantization"
+# bufferView を独自に参照しない（= 組み直しても壊れない）拡張
+_SAFE_EXTENSIONS = (
+    "KHR_materials_",
+    "KHR_texture_transform",
+    "KHR_mesh_quantization",
+    "KHR_lights_punctual",
+    "KHR_animation_pointer",
+    "EXT_texture_webp",
+    "KHR_texture_basisu",
+)
+
+
+class GlbFormatError(ValueError):
+    pass
+
+
+def read_glb(data: bytes) -> Tuple[Dict[str, Any], bytes]:
+    """GLB を (glTF JSON, BIN チャンク) に分解する。"""
+    if len(data) < 20:
+        raise GlbFormatError("too short for GLB")
+    magic, version, length = struct.unpack_from("<III", data, 0)
+    if magic != GLB_MAGIC or version != 2:
+        raise GlbFormatError("not a glTF 2.0 binary")
+    gltf, binary = None, b""
+    pos = 12
+    end = min(length, len(data))
+    while pos + 8 <= end:
+        clen, ctype = struct.unpack_from("<II", data, pos)
+        chunk = data[pos + 8 : pos + 8 + clen]
+        if ctype == CHUNK_JSON:
+            gltf = json.loads(chunk.decode("utf-8"))
+        elif ctype == CHUNK_BIN and not binary:
+            binary = bytes(chunk)
+        pos += 8 + clen
+    if gltf is None:
+        raise GlbFormatError("missing JSON chunk")
+    return gltf, binary
+
+
+def write_glb(gltf: Dict[str, Any], binary: bytes) -> bytes:
+    js = json.dumps(gltf, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    js += b" " * (-len(js) % 4)
+    out = io.BytesIO()
+    total = 12 + 8 + len(js) + (8 + len(binary) + (-len(binary) % 4) if binary else 0)
+    out.write(struct.pack("<III", GLB_MAGIC, 2, total))
+    out.write(struct.pack("<II", len(js), CHUNK_JSON))
+    out.write(js)
+    if binary:
+        pad = -len(binary) % 4
+        out.write(struct.pack("<II", len(binary) + pad, CHUNK_BIN))
+        out.write(binary)
+        out.write(b"\0" * pad)
+    return out.getvalue()
+
+
+# ---- accessor の読み書き
+def _view_bytes(gltf: Dict[str, Any], binary: bytes, view_index: int) -> bytes:
+    view = gltf["bufferViews"][view_index]
+    start = view.get("byteOffset", 0)
+    return binary[start : start + view["byteLength"]]
+
+
+def _read_floats(gltf: Dict[str, Any], binary: bytes, acc: Dict[str, Any]) -> array:
+    n = NCOMP[acc["type"]]
+    count = acc["count"]
+    view = gltf["bufferViews"][acc["bufferView"]]
+    raw = _view_bytes(gltf, binary, acc["bufferView"])
+    offset = acc.get("byteOffset", 0)
+    stride = view.get("byteStride") or n * 4
+    values = array("f")
+    if stride == n * 4:
+        values.frombytes(raw[offset : offset + count * n * 4])
+    else:
+        for i in range(count):
+            start = offset + i * stride
+            values.frombytes(raw[start : start + n * 4])
+    if sys.byteorder != "little":
+        values.byteswap()
+    if len(values) != count * n:
+        raise GlbFormatError("accessor out of range")
+    return values
+
+
+def _pack(values: List[int], n: int, fmt: str, stride: int) -> bytes:
+    """n 成分ずつ fmt で書き、stride バイト境界までゼロ詰めする。"""
+    size = struct.calcsize("<" + fmt * n)
+    pad = b"\0" * (stride - size)
+    packer = struct.Struct("<" + fmt * n).pack
+    out = bytearray()
+    for i in range(0, len(values), n):
+        out += packer(*values[i : i + n])
+        out += pad
+    return bytes(out)
+
+
+def _quantize_snorm8(values: array, n: int) -> bytes:
+    q = [max(-127, min(127, int(round(v * 127.0)))) for v in values]
+    return _pack(q, n, "b", 4)
+
+
+def _quantize_unorm16(values: array, n: int) -> bytes:
+    q = [max(0, min(65535, int(round(v * 65535.0)))) for v in values]
+    return _pack(q, n, "H", ((n * 2 + 3) // 4) * 4)
+
+
+def _quantize_weights(values: array) -> bytes:
+    # 4 成分の合計がちょうど 65535 になるよう最大成分で誤差を吸収する
+    q: List[int] = []
+    for i in range(0, len(values), 4):
+        w = [max(0, min(65535, int(round(v * 65535.0)))) for v in values[i : i + 4]]
+        total = sum(w)
+        if total:
+            k = w.index(max(w))
+            w[k] = max(0, w[k] + 65535 - total)
+        q.extend(w)
+    return _pack(q, 4, "H", 8)
+
+
+def _semantic_kind(semantic: str) -> Optional[str]:
+    if semantic in ("NORMAL", "TANGENT"):
+        return semantic
+    for prefix in ("TEXCOORD_", "WEIGHTS_"):
+        if semantic.startswith(prefix):
+            return prefix[:-1]
+    return None
+
+
+def _accessor_uses(gltf: Dict[str, Any]) -> Dict[int, set]:
+    """accessor → 参照のされ方（量子化できる属性なら種別、それ以外は "other"）。"""
+    uses: Dict[int, set] = {}
+
+    def mark(i, how):
+        if isinstance(i, int):
+            uses.setdefault(i, set()).add(how)
+
+    for mesh in gltf.get("meshes", []):
+        for prim in mesh.get("primitives", []):
+            for sem, i in (prim.get("attributes") or {}).items():
+                mark(i, _semantic_kind(sem) or "other")
+            mark(prim.get("indices"), "other")
+            for target in prim.get("targets") or []:
+                for i in target.values():
+                    mark(i, "other")
+    for skin in gltf.get("skins", []):
+        mark(skin.get("inverseBindMatrices"), "other")
+    for anim in gltf.get("animations", []):
+        for s in anim.get("samplers", []):
+            mark(s.get("input"), "other")
+            mark(s.get("output"), "other")
+    return uses
+
+
+def _quantize_accessor(gltf, binary, index: int, kind: str) -> Optional[bytes]:
+    acc = gltf["accessors"][index]
+    if (
+        acc.get("componentType") != FLOAT
+        or acc.get("sparse")
+        or acc.get("bufferView") is None
+        or acc.get("type") not in NCOMP
+    ):
+        return None
+    n = NCOMP[acc["type"]]
+    values = _read_floats(gltf, binary, acc)
+    if kind in ("NORMAL", "TANGENT"):
+        if n not in (3, 4):
+            return None
+        data, ctype, stride = _quantize_snorm8(values, n), BYTE, 4
+    elif kind == "TEXCOORD":
+        # 0..1 に収まらない UV はテクスチャ変換なしでは表せないので対象外
+        if n != 2 or any(v < 0.0 or v > 1.0 for v in values):
+            return None
+        data, ctype, stride = _quantize_unorm16(values, n), UNSIGNED_SHORT, 4
+    elif kind == "WEIGHTS":
+        if n != 4:
+            return None
+        data, ctype, stride = _quantize_weights(values), UNSIGNED_SHORT, 8
+    else:
+        return None
+    acc["componentType"] = ctype
+    acc["normalized"] = True
+    acc["byteOffset"] = 0
+    acc.pop("min", None)
+    acc.pop("max", None)
+    acc["_new_view"] = {"data": data, "byteStride": stride, "target": ARRAY_BUFFER}
+    return data
+
+
+# ---- テクスチャ
+def _downscale_image(data: bytes, mime: str, max_px: int) -> Optional[Tuple[bytes, str]]:
+    if Image is None or mime not in ("image/png", "image/jpeg"):
+        return None
+    with Image.open(io.BytesIO(data)) as src:
+        if max(src.size) <= max_px:
+            return None
+        src.load()
+        img = src.copy()
+    img.thumbnail((max_px, max_px), Image.LANCZOS)
+    buf = io.BytesIO()
+    if mime == "image/jpeg":
+        img.convert("RGB").save(buf, format="JPEG", quality=LOD_JPEG_QUALITY, optimize=True)
+    else:
+        img.save(buf, format="PNG", optimize=True)
+    out = buf.getvalue()
+    return (out, mime) if len(out) < len(data) else None
+
+
+# ---- 組み立て直し
+def _rebuild(gltf: Dict[str, Any], binary: bytes) -> bytes:
+    """
+    accessor/image に付けた "_new_view" を新しい bufferView として追加し、
+    どこからも参照されなくなった bufferView を落として BIN を詰め直す。
+    """
+    views = gltf.get("bufferViews", [])
+    referenced = set()
+    for acc in gltf.get("accessors", []):
+        if "_new_view" not in acc and acc.get("bufferView") is not None:
+            referenced.add(acc["bufferView"])
+        sparse = acc.get("sparse")
+        if sparse:
+            referenced.add(sparse["indices"]["bufferView"])
+            referenced.add(sparse["values"]["bufferView"])
+    for img in gltf.get("images", []):
+        if "_new_view" not in img and img.get("bufferView") is not None:
+            referenced.add(img["bufferView"])
+
+    out = bytearray()
+    new_views: List[Dict[str, Any]] = []
+    remap: Dict[int, int] = {}
+
+    def append(data: bytes, view: Dict[str, Any]) -> int:
+        out.extend(b"\0" * (-len(out) % 4))
+        view = {k: v for k, v in view.items() if k != "data"}
+        view.update({"buffer": 0, "byteOffset": len(out), "byteLength": len(data)})
+        out.extend(data)
+        new_views.append(view)
+        return len(new_views) - 1
+
+    for i, view in enumerate(views):
+        if i in referenced:
+            remap[i] = append(_view_bytes(gltf, binary, i), view)
+
+    for kind in ("accessors", "images"):
+        for obj in gltf.get(kind, []):
+            nv = obj.pop("_new_view", None)
+            if nv is not None:
+                obj["bufferView"] = append(nv["data"], nv)
+            elif obj.get("bufferView") is not None:
+                obj["bufferView"] = remap[obj["bufferView"]]
+            sparse = obj.get("sparse")
+            if sparse:
+                for part in ("indices", "values"):
+                    sparse[part]["bufferView"] = remap[sparse[part]["bufferView"]]
+
+    gltf["bufferViews"] = new_views
+    gltf["buffers"] = [{"byteLength": len(out)}]
+    return bytes(out)
+
+
+def _unsupported_reason(gltf: Dict[str, Any]) -> Optional[str]:
+    buffers = gltf.get("buffers", [])
+    if len(buffers) > 1 or any("uri" in b for b in buffers):
+        return "external or multiple buffers"
+    for ext in gltf.get("extensionsUsed", []):
+        if not ext.startswith(_SAFE_EXTENSIONS):
+            return f"unsupported extension {ext}"
+    return None
+
+
+def optimize_glb(data: bytes, texture_max: int = LOD_TEXTURE_MAX) -> Tuple[Optional[bytes], Dict[str, Any]]:
+    """
+    GLB を軽量化して (lod_bytes, report) を返す。
+    対応できない構成、または小さくならなかった場合 lod_bytes は None（report に理由）。
+    """
+    t0 = time.perf_counter()
+    report: Dict[str, Any] = {"original_bytes": len(data)}
+    gltf, binary = read_glb(data)
+    reason = _unsupported_reason(gltf)
+    if reason:
+        report.update(skipped=reason, elapsed_ms=int((time.perf_counter() - t0) * 1000))
+        return None, report
+
+    quantized = 0
+    for index, hows in sorted(_accessor_uses(gltf).items()):
+        if len(hows) != 1 or "other" in hows or index >= len(gltf.get("accessors", [])):
+            continue
+        if _quantize_accessor(gltf, binary, index, next(iter(hows))) is not None:
+            quantized += 1
+    if quantized:
+        for key in ("extensionsUsed", "extensionsRequired"):
+            exts = gltf.setdefault(key, [])
+            if QUANTIZATION_EXT not in exts:
+                exts.append(QUANTIZATION_EXT)
+
+    resized = 0
+    for img in gltf.get("images", []):
+        if img.get("bufferView") is None:
+            continue
+        try:
+            small = _downscale_image(
+                _view_bytes(gltf, binary, img["bufferView"]), img.get("mimeType", ""), texture_max
+            )
+        except Exception:
+            small = None
+        if small is not None:
+            img["_new_view"] = {"data": small[0]}
+            img["mimeType"] = small[1]
+            resized += 1
+
+    lod = write_glb(gltf, _rebuild(gltf, binary))
+    report.update(
+        lod_bytes=len(lod),
+        saved_ratio=round(1 - len(lod) / len(data), 4) if data else 0.0,
+        quantized_accessors=quantized,
+        textures_resized=resized,
+        elapsed_ms=int((time.perf_counter() - t0) * 1000),
+    )
+    if len(lod) >= len(data):
+        report["skipped"] = "no size reduction"
+        return None, report
+    return lod, report
+
+
+def main(argv: List[str]) -> int:
+    """
+    python -m utils.glb_optimizer <in.glb> <out.glb>
+    軽量版を out に書き、report を JSON で標準出力に出す（作れなかったときは out を書かない）。
+    Web ワーカーからは CPU とメモリを分けるため、この形で別プロセスとして呼ぶ。
+    """
+    if len(argv) != 2:
+        print("usage: python -m utils.glb_optimizer <in.glb> <out.glb>", file=sys.stderr)
+        return 2
+    with open(argv[0], "rb") as f:
+        data = f.read()
+    lod, report = optimize_glb(data)
+    if lod is not None:
+        with open(argv[1], "wb") as f:
+            f.write(lod)
+    print(json.dumps(report))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,187 @@
+import contextvars
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from utils import rate_limit, tracing
+
+# Webスレッドとは別のワーカープールで重い後処理（Meshy待ち→登録など）を流す
+# ジョブはほぼ Meshy の完了待ち（Webhook/ポーリングで起きるまで眠る）なので CPU はほとんど使わない。
+# 同時に待てるジョブ数 = ワーカー数なので、「1プロセスあたりの同時生成数」を見込んで決める:
+#   (1分あたりの submit 数 / gunicorn の workers) × 待ち時間の分数（Preview で 1〜2 分、Refine は最大 10 分）
+# 超えた分は PENDING のまま並ぶ（pool_stats() / メトリクスで確認できる）
+# ジョブの状態は Firestore の jobs/<id> にも書き、どのワーカーからでも（再起動後も）GET で参照できる。
+# 実行はプロセス内のスレッドなので、プロセスが落ちたジョブは再開できない。
+# 各プロセスは job_owners/<owner> に JOB_HEARTBEAT_SEC 間隔で生存を書き、
+# 途絶えた owner の未完了ジョブは get_job で FAILED（worker lost）として返す
+# （expires_at に Firestore の TTL ポリシーを設定しておけば、終わったジョブの記録も消える）
+JOB_EXPECTED_CONCURRENT = int(os.getenv("JOB_EXPECTED_CONCURRENT", "32"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", str(JOB_EXPECTED_CONCURRENT)))
+JOB_TTL_SEC = int(os.getenv("JOB_TTL_SEC", "3600"))  # 終了したジョブを保持する秒数
+JOB_HEARTBEAT_SEC = float(os.getenv("JOB_HEARTBEAT_SEC", "30"))
+JOB_STALE_SEC = float(os.getenv("JOB_STALE_SEC", "120"))  # owner の生存記録がこれより古ければ落ちたとみなす
+COLLECTION = "jobs"
+OWNER_COLLECTION = "job_owners"
+# 1リクエスト内で独立した上流呼び出しを並列に投げるためのプール（短時間の処理専用）
+FANOUT_WORKERS = int(os.getenv("FANOUT_WORKERS", "16"))
+
+TERMINAL_STATUSES = ("SUCCEEDED", "FAILED")
+
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+_fanout = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix="fanout")
+_jobs: Dict[str, Dict[str, Any]] = {}
+_lock = threading.Lock()
+_OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+_heartbeat_started = False
+
+
+def _db():
+    # Firebase の初期化は実際に参照するときまで遅らせる
+    from utils.firebase_storage import db
+
+    return db
+
+
+def _persist(job: Dict[str, Any]):
+    # 保存できなくてもジョブは続ける（他のワーカーからは見えないだけ）
+    try:
+        _db().collection(COLLECTION).document(job["id"]).set(
+            dict(job, expires_at=datetime.fromtimestamp(time.time() + JOB_TTL_SEC, timezone.utc))
+        )
+    except Exception as e:
+        print(f"[jobs] persist failed for {job['id']}: {e}")
+
+
+def _heartbeat():
+    while True:
+        try:
+            _db().collection(OWNER_COLLECTION).document(_OWNER).set({"heartbeat_at": time.time()})
+        except Exception as e:
+            print(f"[jobs] heartbeat failed: {e}")
+        time.sleep(JOB_HEARTBEAT_SEC)
+
+
+def _start_heartbeat():
+    global _heartbeat_started
+    with _lock:
+        if _heartbeat_started:
+            return
+        _heartbeat_started = True
+    threading.Thread(target=_heartbeat, name="job-heartbeat", daemon=True).start()
+
+
+def _prune_locked(now: float):
+    expired = [
+        jid
+        for jid, j in _jobs.items()
+        if j["status"] in TERMINAL_STATUSES and now - (j["finished_at"] or now) > JOB_TTL_SEC
+    ]
+    for jid in expired:
+        del _jobs[jid]
+
+
+def _update(job_id: str, **fields):
+    with _lock:
+        job = _jobs.get(job_id)
+        if job is None:
+            return
+        job.update(fields)
+        snapshot = dict(job)
+    _persist(snapshot)
+
+
+def _run(job_id: str, kind: str, parent: Optional[tracing.Trace], fn: Callable[..., Any], args, kwargs):
+    _update(job_id, status="RUNNING", started_at=time.time())
+    # 投入元リクエストと同じ trace_id の別トレースとして記録する（応答後も続くため）
+    traced = tracing.start(
+        f"job:{kind}",
+        trace_id=parent.trace_id if parent else None,
+        sampled=parent.sampled if parent else None,
+    )
+    try:
+        # バックグラウンドでのタスク作成はユーザー待ちのリクエストに枠を譲る。
+        # 進捗取得はユーザー自身の生成中タスクの待ちなので既定（最優先）のまま
+        with rate_limit.priority(rate_limit.LOW, kinds=("create",)):
+            result = fn(*args, **kwargs)
+    except Exception as e:
+        _update(
+            job_id,
+            status="FAILED",
+            error=f"{e.__class__.__name__}: {e}",
+            finished_at=time.time(),
+        )
+        tracing.finish(traced, job_id=job_id, status="FAILED", error=e.__class__.__name__)
+        return
+    _update(job_id, status="SUCCEEDED", result=result, finished_at=time.time())
+    tracing.finish(traced, job_id=job_id, status="SUCCEEDED")
+
+
+def submit_job(kind: str, fn: Callable[..., Any], *args, **kwargs) -> str:
+    """fn(*args, **kwargs) をワーカープールに投入して job_id を返す。"""
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    job = {
+        "id": job_id,
+        "kind": kind,
+        "status": "PENDING",
+        "result": None,
+        "error": None,
+        "owner": _OWNER,
+        "created_at": now,
+        "started_at": None,
+        "finished_at": None,
+    }
+    with _lock:
+        _prune_locked(now)
+        _jobs[job_id] = job
+        snapshot = dict(job)
+    _start_heartbeat()
+    _persist(snapshot)
+    _executor.submit(_run, job_id, kind, tracing.current_trace(), fn, args, kwargs)
+    return job_id
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """ジョブ状態のコピーを返す（無ければ None）。他のプロセスのジョブは Firestore から読む。"""
+    with _lock:
+        job = _jobs.get(job_id)
+        if job is not None:
+            return dict(job)
+    snap = _db().collection(COLLECTION).document(job_id).get()
+    if not snap.exists:
+        return None
+    job = snap.to_dict() or {}
+    job.pop("expires_at", None)
+    if job.get("status") not in TERMINAL_STATUSES and not _owner_alive(job.get("owner")):
+        job.update(status="FAILED", error=f"worker lost: {job.get('owner')} stopped before the job finished")
+    return job
+
+
+def _owner_alive(owner: Optional[str]) -> bool:
+    if not owner:
+        return False
+    snap = _db().collection(OWNER_COLLECTION).document(owner).get()
+    if not snap.exists:
+        return False
+    return time.time() - float((snap.to_dict() or {}).get("heartbeat_at") or 0) <= JOB_STALE_SEC
+
+
+def pool_stats() -> Dict[str, int]:
+    """ジョブプールの使用状況（実行中・待ち・ワーカー数）。ベンチマークの利用率計測用。"""
+    with _lock:
+        running = sum(1 for j in _jobs.values() if j["status"] == "RUNNING")
+        pending = sum(1 for j in _jobs.values() if j["status"] == "PENDING")
+    return {"running": running, "pending": pending, "workers": JOB_WORKERS}
+
+
+def fan_out(fn: Callable[..., Any], *args, **kwargs) -> Future:
+    """
+    fn を並列実行用プールに投げて Future を返す（結果の待ち方は呼び出し側で決める）。
+    呼び出し元のコンテキスト（トレース・Meshy の優先度）を引き継いで実行する。
+    """
+    return _fanout.submit(contextvars.copy_context().run, fn, *args, **kwargs)
@@ -1,26 +1,137 @@
 import os
+import random
+import threading
+import time
 import requests
+from requests.adapters import HTTPAdapter
 from typing import Any, Dict, Optional
 
-API_BASE = "https://api.meshy.ai"
+from utils.jobs import JOB_WORKERS
+from utils.pipeline import PIPELINE_WORKERS
+from utils.rate_limit import limiter, parse_retry_after, RateLimitTimeout
+from utils.metrics import instrumented
+
+API_BASE = os.getenv("MESHY_API_BASE", "https://api.meshy.ai").rstrip("/")  # ベンチマークでは bench/fake_meshy.py を指す
 MESHY_API_KEY = os.getenv("MESHY_API_KEY", "").strip()
 HEADERS_JSON = {
     "Authorization": f"Bearer {MESHY_API_KEY}",
     "Content-Type": "application/json",
 }
 
+# ---------- 接続プール / リトライ / タイムアウト
+# ワーカー(プロセス)あたりの keep-alive 接続数。Meshy を呼ぶスレッドは
+# リクエストスレッド（gunicorn --threads = WEB_THREADS）とジョブプール・パイプラインのプールなので、その合計を既定にする
+# （足りないと超えた分の接続は使い捨てになり、呼ぶたびに TLS ハンドシェイクからやり直す）
+WEB_THREADS = int(os.getenv("WEB_THREADS", "16"))
+POOL_SIZE = int(os.getenv("MESHY_POOL_SIZE", str(WEB_THREADS + JOB_WORKERS + PIPELINE_WORKERS)))
+MAX_RETRIES = int(os.getenv("MESHY_MAX_RETRIES", "3"))
+BACKOFF_BASE_SEC = float(os.getenv("MESHY_BACKOFF_BASE_SEC", "0.5"))
+BACKOFF_MAX_SEC = float(os.getenv("MESHY_BACKOFF_MAX_SEC", "8"))
+
+# エンドポイント種別ごとの (connect, read) タイムアウト
+TIMEOUTS = {
+    "create": (5, 60),     # タスク作成
+    "status": (3, 15),     # 進捗ポーリング
+    "download": (5, 120),  # GLB などのダウンロード
+}
+
+# 作成系(POST)は二重作成を避けるため 429 のみ、参照系は 5xx もリトライ
+RETRY_STATUSES = {
+    "create": {429},
+    "status": {429, 500, 502, 503, 504},
+    "download": {429, 500, 502, 503, 504},
+}
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
 class MeshyError(Exception):
     pass
 
+class MeshyRateLimited(MeshyError):
+    """
+    レート制限で呼べなかった（枠の待ちが上限を超えた、または Meshy が 429 を返し続けた）。
+    一時的なものなので、API は status（503/429）と Retry-After で返し、待機ループは再試行する。
+    """
+    def __init__(self, message: str, retry_after: float, status: int = 503):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.status = status
+
+def get_session() -> requests.Session:
+    """プロセス内で共有する keep-alive セッション（遅延生成）。"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                s = requests.Session()
+                adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+                s.mount("https://", adapter)
+                s.mount("http://", adapter)
+                _session = s
+    return _session
+
+def _backoff_sec(attempt: int) -> float:
+    # full jitter: 0 〜 min(max, base * 2^attempt)
+    return random.uniform(0, min(BACKOFF_MAX_SEC, BACKOFF_BASE_SEC * (2 ** attempt)))
+
+def _acquire(kind: str):
+    try:
+        limiter.acquire(kind)
+    except RateLimitTimeout as e:
+        raise MeshyRateLimited(f"rate limited: {e}", retry_after=e.retry_after) from e
+
+def _retry_delay(resp, kind: str, attempt: int) -> float:
+    # Retry-After があればそれに従い、同じ種別の他スレッドもまとめて待たせる
+    delay = parse_retry_after(resp.headers.get("Retry-After")) if resp.status_code in (429, 503) else None
+    if delay is None:
+        delay = _backoff_sec(attempt)
+    if resp.status_code == 429:
+        limiter.penalize(kind, delay)
+    return delay
+
+def _request(method: str, url: str, *, kind: str, **kwargs) -> requests.Response:
+    """
+    共有セッション経由で送信。送信前にレート制限の枠を取り、
+    429/5xx と接続エラーはジッタ付き指数バックオフ（Retry-After 優先）で再試行。
+    """
+    kwargs.setdefault("timeout", TIMEOUTS[kind])
+    retry_statuses = RETRY_STATUSES[kind]
+    attempt = 0
+    while True:
+        delay = None
+        _acquire(kind)
+        try:
+            resp = get_session().request(method, url, **kwargs)
+        except requests.exceptions.ConnectTimeout:
+            # 接続確立前の失敗は作成系でも安全に再試行できる
+            if attempt >= MAX_RETRIES:
+                raise
+        except (requests.ConnectionError, requests.Timeout):
+            # 送信済みかもしれないので作成系は再試行しない
+            if attempt >= MAX_RETRIES or kind == "create":
+                raise
+        else:
+            if resp.status_code not in retry_statuses or attempt >= MAX_RETRIES:
+                return resp
+            delay = _retry_delay(resp, kind, attempt)
+            resp.close()
+        time.sleep(_backoff_sec(attempt) if delay is None else delay)
+        attempt += 1
+
 def _raise_for_api_error(resp: requests.Response):
     if resp.status_code >= 400:
         try:
             j = resp.json()
         except Exception:
             j = {"message": resp.text}
+        if resp.status_code == 429:
+            retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+            raise MeshyRateLimited(f"{resp.status_code} {j}", retry_after=retry_after or BACKOFF_MAX_SEC, status=429)
         raise MeshyError(f"{resp.status_code} {j}")
 
 # ---------- Text-to-3D (v2)
+@instrumented("meshy")
 def create_text_to_3d_preview(payload: Dict[str, Any]) -> str:
     """Returns preview task_id"""
     body = {
@@ -33,10 +144,11 @@ def create_text_to_3d_preview(payload: Dict[str, Any]) -> str:
         "should_remesh": True,
     }
     body.update(payload or {})
-    resp = requests.post(f"{API_BASE}/openapi/v2/text-to-3d", json=body, headers=HEADERS_JSON, timeout=60)
+    resp = _request("POST", f"{API_BASE}/openapi/v2/text-to-3d", kind="create", json=body, headers=HEADERS_JSON)
     _raise_for_api_error(resp)
     return resp.json().get("result")
 
+@instrumented("meshy")
 def create_text_to_3d_refine(payload: Dict[str, Any]) -> str:
     """payload must include preview_task_id; returns refine task_id"""
     body = {
@@ -44,16 +156,18 @@ def create_text_to_3d_refine(payload: Dict[str, Any]) -> str:
         "enable_pbr": True,
     }
     body.update(payload or {})
-    resp = requests.post(f"{API_BASE}/openapi/v2/text-to-3d", json=body, headers=HEADERS_JSON, timeout=60)
+    resp = _request("POST", f"{API_BASE}/openapi/v2/text-to-3d", kind="create", json=body, headers=HEADERS_JSON)
     _raise_for_api_error(resp)
     return resp.json().get("result")
 
+@instrumented("meshy")
 def get_text_to_3d_task(task_id: str) -> Dict[str, Any]:
-    resp = requests.get(f"{API_BASE}/openapi/v2/text-to-3d/{task_id}", headers={"Authorization": f"Bearer {MESHY_API_KEY}"}, timeout=60)
+    resp = _request("GET", f"{API_BASE}/openapi/v2/text-to-3d/{task_id}", kind="status", headers={"Authorization": f"Bearer {MESHY_API_KEY}"})
     _raise_for_api_error(resp)
     return resp.json()
 
 # ---------- Rigging (v1)
+@instrumented("meshy")
 def create_rigging_task(*, input_task_id: Optional[str] = None, model_url: Optional[str] = None,
                         height_meters: float = 1.7, texture_image_url: Optional[str] = None) -> str:
     if not input_task_id and not model_url:
@@ -68,16 +182,18 @@ def create_rigging_task(*, input_task_id: Optional[str] = None, model_url: Optio
     if texture_image_url:
         body["texture_image_url"] = texture_image_url
 
-    resp = requests.post(f"{API_BASE}/openapi/v1/rigging", json=body, headers=HEADERS_JSON, timeout=60)
+    resp = _request("POST", f"{API_BASE}/openapi/v1/rigging", kind="create", json=body, headers=HEADERS_JSON)
     _raise_for_api_error(resp)
     return resp.json().get("result")
 
+@instrumented("meshy")
 def get_rigging_task(task_id: str) -> Dict[str, Any]:
-    resp = requests.get(f"{API_BASE}/openapi/v1/rigging/{task_id}", headers={"Authorization": f"Bearer {MESHY_API_KEY}"}, timeout=60)
+    resp = _request("GET", f"{API_BASE}/openapi/v1/rigging/{task_id}", kind="status", headers={"Authorization": f"Bearer {MESHY_API_KEY}"})
     _raise_for_api_error(resp)
     return resp.json()
 
 # ---------- Animation (v1)
+@instrumented("meshy")
 def create_animation_task(*, rig_task_id: str, action_id: int, post_process: Optional[Dict[str, Any]] = None) -> str:
     if not rig_task_id:
         raise MeshyError("rig_task_id is required.")
@@ -88,21 +204,24 @@ def create_animation_task(*, rig_task_id: str, action_id: int, post_process: Opt
     if post_process:
         body["post_process"] = post_process
 
-    resp = requests.post(f"{API_BASE}/openapi/v1/animations", json=body, headers=HEADERS_JSON, timeout=60)
+    resp = _request("POST", f"{API_BASE}/openapi/v1/animations", kind="create", json=body, headers=HEADERS_JSON)
     _raise_for_api_error(resp)
     return resp.json().get("result")
 
+@instrumented("meshy")
 def get_animation_task(task_id: str) -> Dict[str, Any]:
-    resp = requests.get(f"{API_BASE}/openapi/v1/animations/{task_id}", headers={"Authorization": f"Bearer {MESHY_API_KEY}"}, timeout=60)
+    resp = _request("GET", f"{API_BASE}/openapi/v1/animations/{task_id}", kind="status", headers={"Authorization": f"Bearer {MESHY_API_KEY}"})
     _raise_for_api_error(resp)
     return resp.json()
 
 # ---------- Util
+@instrumented("meshy")
 def download_file(url: str, dest_path: str) -> str:
-    r = requests.get(url, stream=True, timeout=120)
-    _raise_for_api_error(r)
-    with open(dest_path, "wb") as f:
-        for chunk in r.iter_content(chunk_size=1024 * 1024):
-            if chunk:
-                f.write(chunk)
+    r = _request("GET", url, kind="download", stream=True)
+    with r:
+        _raise_for_api_error(r)
+        with open(dest_path, "wb") as f:
+            for chunk in r.iter_content(chunk_size=1024 * 1024):
+                if chunk:
+                    f.write(chunk)
     return dest_path
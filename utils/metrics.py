@@ -0,0 +1,220 @@
+import bisect
+import contextlib
+import functools
+import hmac
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from utils import tracing
+
+# Prometheus テキスト形式のメトリクス（依存を増やさないよう最小限を自前で実装）
+# 値はワーカープロセスごと（gunicorn の複数ワーカーはスクレイプのたびに別のプロセスに当たりうる）
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "").strip()  # 設定時は Authorization: Bearer <token> が必要
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+LabelKey = Tuple[str, ...]
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, Any]) -> LabelKey:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def _fmt_labels(self, key: LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ""
+        body = ",".join(f'{n}="{_escape(v)}"' for n, v in pairs)
+        return "{" + body + "}"
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{self._fmt_labels(k)} {_num(v)}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, doc, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[LabelKey, list] = {}  # key -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            v = self._values.get(key)
+            if v is None:
+                v = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            if i < len(self.buckets):
+                v[i] += 1
+            v[-2] += value
+            v[-1] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        out = []
+        for key, v in items:
+            acc = 0
+            for bound, n in zip(self.buckets, v):
+                acc += n
+                out.append(f"{self.name}_bucket{self._fmt_labels(key, (('le', _num(bound)),))} {acc}")
+            out.append(f"{self.name}_bucket{self._fmt_labels(key, (('le', '+Inf'),))} {v[-1]}")
+            out.append(f"{self.name}_sum{self._fmt_labels(key)} {_num(v[-2])}")
+            out.append(f"{self.name}_count{self._fmt_labels(key)} {v[-1]}")
+        return out
+
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _num(v: float) -> str:
+    return repr(float(v)) if v != int(v) else str(int(v))
+
+
+REGISTRY: List[_Metric] = []
+
+
+def render() -> str:
+    return "\n".join(line for m in REGISTRY for line in m.render()) + "\n"
+
+
+# ---- アプリ共通のメトリクス
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests by route and status.", ("method", "route", "status"))
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency by route.", ("method", "route"))
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests currently being served.", ("route",))
+
+UPSTREAM_LATENCY = Histogram(
+    "upstream_call_duration_seconds", "Latency of calls to Meshy / Gemini / Firebase.", ("service", "op")
+)
+UPSTREAM_ERRORS = Counter(
+    "upstream_call_errors_total", "Failed calls to Meshy / Gemini / Firebase.", ("service", "op", "error")
+)
+CACHE_REQUESTS = Counter("cache_requests_total", "Cache lookups by cache and result.", ("cache", "result"))
+SUMMARY_FALLBACK = Counter(
+    "summary_fallback_total", "Diagnosis summaries that fell back to the fixed template, by reason.", ("reason",)
+)
+SUBMIT_PHASE = Histogram("submit_phase_seconds", "Time /api/quiz/submit spends waiting on each branch.", ("phase",))
+
+
+def cache_result(cache: str, result: str):
+    CACHE_REQUESTS.inc(cache=cache, result=result)
+
+
+def instrumented(service: str, op: Optional[str] = None) -> Callable:
+    """
+    関数の所要時間と例外を upstream_call_* に記録するデコレータ。
+    トレース中のリクエストでは "<service>.<op>" の span にもなる。
+    """
+
+    def deco(fn: Callable) -> Callable:
+        name = op or fn.__name__
+        span_name = f"{service}.{name}"
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                with tracing.span(span_name):
+                    return fn(*args, **kwargs)
+            except Exception as e:
+                UPSTREAM_ERRORS.inc(service=service, op=name, error=e.__class__.__name__)
+                raise
+            finally:
+                UPSTREAM_LATENCY.observe(time.perf_counter() - t0, service=service, op=name)
+
+        return wrapper
+
+    return deco
+
+
+def init_metrics(app):
+    """ルートごとの所要時間・同時実行数の計測と /metrics を登録する。"""
+    from flask import Response, g, request
+
+    def _route() -> str:
+        rule = request.url_rule
+        return rule.rule if rule is not None else "unmatched"
+
+    @app.before_request
+    def _metrics_start():
+        g._metrics_t0 = time.perf_counter()
+        g._metrics_route = _route()
+        HTTP_IN_FLIGHT.inc(route=g._metrics_route)
+
+    @app.after_request
+    def _metrics_status(resp):
+        g._metrics_status = resp.status_code
+        return resp
+
+    @app.teardown_request
+    def _metrics_end(exc):
+        t0 = g.pop("_metrics_t0", None)
+        if t0 is None:
+            return
+        route = g.pop("_metrics_route", "unmatched")
+        status = g.pop("_metrics_status", 500)
+        HTTP_IN_FLIGHT.dec(route=route)
+        HTTP_LATENCY.observe(time.perf_counter() - t0, method=request.method, route=route)
+        HTTP_REQUESTS.inc(method=request.method, route=route, status=status)
+
+    @app.get("/metrics")
+    def metrics_endpoint():
+        auth = request.headers.get("Authorization", "")
+        if METRICS_TOKEN and not hmac.compare_digest(auth, f"Bearer {METRICS_TOKEN}"):
+            return Response("forbidden\n", status=403, mimetype="text/plain")
+        return Response(render(), mimetype="text/plain; version=0.0.4")
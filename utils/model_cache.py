@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from utils import metrics
+
+# 生成パラメータ → 完成済みモデル のキャッシュ（Firestore: model_cache/<key>）
+# profile_to_prompt の出力は有限個なので、同じプロンプトは既存モデルを返せば済む
+MODEL_CACHE_ENABLED = os.getenv("MODEL_CACHE_ENABLED", "1").lower() in ("1", "true", "on")
+MODEL_CACHE_FRESH_RATE = float(os.getenv("MODEL_CACHE_FRESH_RATE", "0.1"))  # ヒット時でも新規生成する確率
+MODEL_CACHE_MAX_VARIANTS = int(os.getenv("MODEL_CACHE_MAX_VARIANTS", "5"))  # 1キーあたりの保持数
+PENDING_TTL_SEC = 3600
+TRIM_RETRIES = 3
+
+COLLECTION = "model_cache"
+# Preview → 生成パラメータ の対応付け。Refine はどのワーカーに届くか分からないので Firestore に置く
+# （expires_at に Firestore の TTL ポリシーを設定しておけば、Refine されなかった分も消える）
+PENDING_COLLECTION = "model_cache_pending"
+
+_memo: Dict[str, List[Dict[str, Any]]] = {}  # key -> variants
+_lock = threading.Lock()
+
+
+def cache_params(
+    prompt: str, negative: str, art_style: str, should_remesh: bool, is_a_t_pose: bool
+) -> Dict[str, Any]:
+    return {
+        "prompt": prompt,
+        "negative_prompt": negative,
+        "art_style": art_style,
+        "should_remesh": bool(should_remesh),
+        "is_a_t_pose": bool(is_a_t_pose),
+    }
+
+
+def cache_key(params: Dict[str, Any]) -> str:
+    raw = json.dumps(params, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _db():
+    # Firebase の初期化は実際に参照するときまで遅らせる（cache_key だけ使うスクリプト向け）
+    from utils.firebase_storage import db
+
+    return db
+
+
+def _collection():
+    return _db().collection(COLLECTION)
+
+
+def _variants(key: str) -> List[Dict[str, Any]]:
+    with _lock:
+        if key in _memo:
+            return _memo[key]
+    snap = _collection().document(key).get()
+    variants = list((snap.to_dict() or {}).get("variants") or []) if snap.exists else []
+    if variants:
+        with _lock:
+            _memo[key] = variants
+    return variants
+
+
+def lookup(key: str) -> Optional[Dict[str, Any]]:
+    """
+    キャッシュ済みのバリアントを1つ返す。無い場合、または fresh 判定で
+    新規生成させる場合は None。
+    """
+    if not MODEL_CACHE_ENABLED:
+        return None
+    try:
+        variants = _variants(key)
+    except Exception:
+        metrics.cache_result("model", "error")
+        return None
+    if not variants:
+        metrics.cache_result("model", "miss")
+        return None
+    if len(variants) < MODEL_CACHE_MAX_VARIANTS and random.random() < MODEL_CACHE_FRESH_RATE:
+        metrics.cache_result("model", "fresh")
+        return None
+    metrics.cache_result("model", "hit")
+    return random.choice(variants)
+
+
+def count_variants(key: str) -> int:
+    return len(_variants(key))
+
+
+def add_variant(key: str, params: Dict[str, Any], variant: Dict[str, Any]):
+    from firebase_admin import firestore
+
+    doc = _collection().document(key)
+    doc.set(
+        {
+            "params": params,
+            "variants": firestore.ArrayUnion([variant]),
+            "updated_at": firestore.SERVER_TIMESTAMP,
+        },
+        merge=True,
+    )
+    variants = _trim(doc)
+    with _lock:
+        _memo[key] = variants
+
+
+def _trim(doc) -> List[Dict[str, Any]]:
+    """
+    ArrayUnion の後で上限を超えていたら古い順に残して切り詰める。
+    同時に追加されたワーカーと競合したら（update_time の不一致）読み直してやり直す。
+    """
+    from google.api_core.exceptions import FailedPrecondition
+
+    variants: List[Dict[str, Any]] = []
+    for _ in range(TRIM_RETRIES):
+        snap = doc.get()
+        variants = list((snap.to_dict() or {}).get("variants") or [])
+        if len(variants) <= MODEL_CACHE_MAX_VARIANTS:
+            return variants
+        try:
+            doc.update(
+                {"variants": variants[:MODEL_CACHE_MAX_VARIANTS]},
+                option=_db().write_option(last_update_time=snap.update_time),
+            )
+            break
+        except FailedPrecondition:
+            continue
+    return variants[:MODEL_CACHE_MAX_VARIANTS]
+
+
+# ---- Preview → Refine の対応付け（Refine 完成時にキャッシュへ入れるため）
+def note_pending(preview_task_id: str, key: str, params: Dict[str, Any]):
+    now = time.time()
+    try:
+        _db().collection(PENDING_COLLECTION).document(preview_task_id).set(
+            {
+                "key": key,
+                "params": params,
+                "created_at": now,
+                "expires_at": datetime.fromtimestamp(now + PENDING_TTL_SEC, timezone.utc),
+            }
+        )
+    except Exception as e:
+        # 記録できなくても生成は続ける（その Refine がキャッシュに入らないだけ）
+        print(f"[model_cache] note_pending failed for {preview_task_id}: {e}")
+
+
+def pop_pending(preview_task_id: str) -> Optional[tuple]:
+    """(key, params) を返して対応付けを消す。キャッシュ対象の Preview でなければ None。"""
+    doc = _db().collection(PENDING_COLLECTION).document(preview_task_id)
+    try:
+        snap = doc.get()
+        if not snap.exists:
+            return None
+        doc.delete()
+    except Exception as e:
+        print(f"[model_cache] pop_pending failed for {preview_task_id}: {e}")
+        return None
+    v = snap.to_dict() or {}
+    if time.time() - float(v.get("created_at") or 0) > PENDING_TTL_SEC or not v.get("key"):
+        return None
+    return v["key"], v.get("params") or {}
@@ -0,0 +1,419 @@
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+from utils import tracing
+from utils.jobs import JOB_EXPECTED_CONCURRENT
+
+# サーバー側で段階（stage）を DAG として実行するパイプライン
+# - 依存が揃った stage から専用プールで並列に走らせる（Refine 後の保存とリギングなど）
+# - 状態は Firestore の pipelines/<id> に保存し、どのワーカーからでも GET で参照できる
+# - 実行中のパイプラインごとに heartbeat スレッドが PIPELINE_HEARTBEAT_SEC 間隔で状態を書く。
+#   実行していたプロセスが落ちて heartbeat が途絶えたら、次に GET したプロセスが引き継いで再開する
+#   stage は ctx.save() で残した値（作成済みの task_id など）を使って続きから実行できるように書く
+# - 書き込みはすべて前回の update_time を条件にする。他のプロセスに引き継がれていたら（owner が違えば）
+#   このプロセスの実行は止め、以後は書かない（進行中の stage は次の progress/save で PipelineLost になる）
+# - stage もほぼ Meshy の完了待ちでワーカーを1本占有する。診断1件ごとに1本走るので、
+#   ジョブプールと同じく「1プロセスあたりの同時生成数」（JOB_EXPECTED_CONCURRENT）を既定にする
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", str(JOB_EXPECTED_CONCURRENT)))
+PIPELINE_STALE_SEC = float(os.getenv("PIPELINE_STALE_SEC", "90"))  # heartbeat がこれより古ければ引き継ぐ
+PIPELINE_HEARTBEAT_SEC = float(os.getenv("PIPELINE_HEARTBEAT_SEC", "15"))  # STALE より十分短くする
+PIPELINE_SAVE_INTERVAL_SEC = float(os.getenv("PIPELINE_SAVE_INTERVAL_SEC", "5"))  # 進捗だけの変更を保存する間隔
+PIPELINE_TTL_SEC = int(os.getenv("PIPELINE_TTL_SEC", "3600"))  # 終了したパイプラインをメモリに残す秒数
+COLLECTION = "pipelines"
+
+# stage の状態: PENDING → QUEUED（プールに投入済み）→ RUNNING（ワーカーで実行中）→ 終了状態
+TERMINAL_STATUSES = ("SUCCEEDED", "FAILED", "SKIPPED")
+
+_executor = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix="pipeline")
+_builders: Dict[str, Callable[[Dict[str, Any]], List["Stage"]]] = {}
+_runs: Dict[str, "_Run"] = {}
+_lock = threading.Lock()
+_OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+class PipelineError(Exception):
+    pass
+
+
+class PipelineLost(PipelineError):
+    """他のプロセスに引き継がれたので、このプロセスでの実行をやめる。"""
+
+
+class Stage:
+    def __init__(
+        self,
+        name: str,
+        fn: Callable[["StageContext"], Optional[Dict[str, Any]]],
+        deps: Sequence[str] = (),
+        weight: float = 1.0,
+        optional: bool = False,
+    ):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.weight = weight
+        self.optional = optional  # 失敗してもパイプライン全体は失敗にしない
+
+
+class StageContext:
+    """stage 関数に渡す。params はパイプラインの入力、results は依存 stage の戻り値。"""
+
+    def __init__(self, run: "_Run", stage: Stage):
+        self._run = run
+        self.stage = stage
+        self.pipeline_id = run.id
+        self.params: Dict[str, Any] = run.doc["params"]
+        self.results: Dict[str, Dict[str, Any]] = {
+            name: run.doc["stages"][name].get("result") or {} for name in stage.deps
+        }
+        self.state: Dict[str, Any] = dict(run.doc["stages"][stage.name].get("state") or {})
+
+    def save(self, **fields):
+        """再開時に使う値（作成済みの task_id など）をすぐに保存する。"""
+        self.state.update(fields)
+        self._run.update_stage(self.stage.name, persist=True, state=dict(self.state))
+        self._run.check()
+
+    def progress(self, pct: Any):
+        self._run.check()
+        try:
+            pct = max(0, min(100, int(pct or 0)))
+        except (TypeError, ValueError):
+            return
+        self._run.update_stage(self.stage.name, persist=False, progress=pct)
+
+
+def register(kind: str, builder: Callable[[Dict[str, Any]], List[Stage]]):
+    """kind ごとに params から stage の一覧を組み立てる関数を登録する（再開時にも使う）。"""
+    _builders[kind] = builder
+
+
+def _db():
+    # Firebase の初期化は実際に参照するときまで遅らせる
+    from utils.firebase_storage import db
+
+    return db
+
+
+def _collection():
+    return _db().collection(COLLECTION)
+
+
+class _Run:
+    def __init__(self, doc: Dict[str, Any], stages: List[Stage], update_time=None):
+        self.id = doc["id"]
+        self.doc = doc
+        self.stages = {s.name: s for s in stages}
+        self.lock = threading.Lock()
+        self.persist_lock = threading.Lock()
+        self.saved_at = 0.0
+        self.finished_at: Optional[float] = None
+        self.update_time = update_time  # 最後に書いたときの Firestore の update_time（条件付き書き込み用）
+        self.lost = False
+        self.version = 0  # 状態が変わるたびに増やす（watch の待機者を起こす）
+        self.changed = threading.Condition(self.lock)
+        self._stopped = threading.Event()
+
+    def start_heartbeat(self):
+        threading.Thread(target=self._heartbeat, name=f"pipeline-hb-{self.id[:8]}", daemon=True).start()
+
+    def _heartbeat(self):
+        # stage の進捗が止まって見える間（Webhook 待ちや長い保存）も生存を知らせる
+        while not self._stopped.wait(PIPELINE_HEARTBEAT_SEC):
+            self.persist()
+
+    def stop(self):
+        self._stopped.set()
+
+    def check(self):
+        if self.lost:
+            raise PipelineLost(f"pipeline {self.id} was taken over by another process")
+
+    def _changed_locked(self):
+        self.version += 1
+        self.changed.notify_all()
+
+    # ---- 状態の更新と保存
+    def update_stage(self, name: str, persist: bool, **fields):
+        with self.lock:
+            self.doc["stages"][name].update(fields)
+            self.doc["updated_at"] = time.time()
+            self._changed_locked()
+            due = persist or time.monotonic() - self.saved_at >= PIPELINE_SAVE_INTERVAL_SEC
+        if due:
+            self.persist()
+
+    def persist(self):
+        # 書き込みの順序を保つ（古いスナップショットで新しい状態を上書きしない）
+        with self.persist_lock:
+            if self.lost:
+                return
+            with self.lock:
+                self.doc["heartbeat_at"] = time.time()
+                snapshot = _copy_doc(self.doc)
+                self.saved_at = time.monotonic()
+            try:
+                self._write(snapshot)
+            except PipelineLost as e:
+                print(f"[pipeline] {e}; stopping here")
+                self.lost = True
+                self.stop()
+                with self.lock:
+                    self._changed_locked()  # watch は Firestore の読み取りに切り替える
+                with _lock:
+                    if _runs.get(self.id) is self:
+                        del _runs[self.id]
+            except Exception as e:
+                # 保存できなくてもメモリ上では続ける（別ワーカーからは見えないだけ）
+                print(f"[pipeline] persist failed for {self.id}: {e}")
+
+    def _write(self, snapshot: Dict[str, Any]):
+        """前回の書き込みから誰も書いていなければ保存する。引き継がれていたら PipelineLost。"""
+        from google.api_core.exceptions import FailedPrecondition
+
+        ref = _collection().document(self.id)
+        if self.update_time is None:
+            # 作成直後（id は新しい uuid なので他に書く者はいない）
+            self.update_time = ref.set(snapshot).update_time
+            return
+        for _ in range(2):
+            try:
+                result = ref.update(snapshot, option=_db().write_option(last_update_time=self.update_time))
+                self.update_time = result.update_time
+                return
+            except FailedPrecondition:
+                snap = ref.get()
+                if not snap.exists or (snap.to_dict() or {}).get("owner") != _OWNER:
+                    raise PipelineLost(f"pipeline {self.id} was taken over by another process")
+                # 自分の前回の書き込みが応答前に失敗扱いになっていた場合は、その update_time からやり直す
+                self.update_time = snap.update_time
+
+    # ---- 実行
+    def schedule(self):
+        """依存が揃った stage を投入し、失敗した依存を持つ stage は SKIPPED にする。全部終われば締める。"""
+        to_start: List[Stage] = []
+        with self.lock:
+            states = self.doc["stages"]
+            changed = True
+            while changed:
+                changed = False
+                for name, st in states.items():
+                    if st["status"] != "PENDING":
+                        continue
+                    deps = [states[d]["status"] for d in self.stages[name].deps]
+                    if any(s in ("FAILED", "SKIPPED") for s in deps):
+                        st.update(status="SKIPPED", finished_at=time.time())
+                        changed = True
+                    elif all(s == "SUCCEEDED" for s in deps):
+                        st.update(status="QUEUED", progress=0)
+                        to_start.append(self.stages[name])
+            done = all(st["status"] in TERMINAL_STATUSES for st in states.values())
+            if done:
+                failed = [
+                    n for n, st in states.items()
+                    if st["status"] != "SUCCEEDED" and not self.stages[n].optional
+                ]
+                self.doc["status"] = "FAILED" if failed else "SUCCEEDED"
+                self.doc["finished_at"] = time.time()
+                self.finished_at = time.time()
+            self._changed_locked()
+        self.persist()
+        if done or self.lost:
+            self.stop()
+            return
+        for stage in to_start:
+            _executor.submit(self._run_stage, stage)
+
+    def _run_stage(self, stage: Stage):
+        if self.lost:
+            return
+        self.update_stage(stage.name, persist=False, status="RUNNING", started_at=time.time(), progress=0)
+        traced = tracing.start(f"pipeline:{stage.name}")
+        ctx = StageContext(self, stage)
+        try:
+            result = stage.fn(ctx) or {}
+        except PipelineLost:
+            tracing.finish(traced, pipeline_id=self.id, status="LOST")
+            return
+        except Exception as e:
+            print(f"[pipeline] {self.id} {stage.name} failed: {e.__class__.__name__}: {e}")
+            self.update_stage(
+                stage.name, persist=False,
+                status="FAILED", error=f"{e.__class__.__name__}: {e}", finished_at=time.time(),
+            )
+            tracing.finish(traced, pipeline_id=self.id, status="FAILED")
+        else:
+            self.update_stage(
+                stage.name, persist=False,
+                status="SUCCEEDED", progress=100, result=result, finished_at=time.time(),
+            )
+            tracing.finish(traced, pipeline_id=self.id, status="SUCCEEDED")
+        self.schedule()
+
+
+def _copy_doc(doc: Dict[str, Any]) -> Dict[str, Any]:
+    out = dict(doc)
+    out["stages"] = {k: dict(v) for k, v in doc["stages"].items()}
+    return out
+
+
+def _prune_locked(now: float):
+    for pid in [p for p, r in _runs.items() if r.finished_at and now - r.finished_at > PIPELINE_TTL_SEC]:
+        del _runs[pid]
+
+
+def create(kind: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """パイプラインを作って実行を始め、状態（view）を返す。組み立てられない入力は ValueError。"""
+    stages = _builders[kind](params)
+    if not stages:
+        raise ValueError("nothing to run")
+    now = time.time()
+    doc = {
+        "id": uuid.uuid4().hex,
+        "kind": kind,
+        "params": params,
+        "status": "RUNNING",
+        "stages": {
+            s.name: {"status": "PENDING", "deps": list(s.deps), "weight": s.weight, "progress": 0}
+            for s in stages
+        },
+        "owner": _OWNER,
+        "created_at": now,
+        "updated_at": now,
+        "finished_at": None,
+    }
+    run = _Run(doc, stages)
+    with _lock:
+        _prune_locked(now)
+        _runs[run.id] = run
+    run.start_heartbeat()
+    run.schedule()
+    with run.lock:
+        return view(_copy_doc(run.doc))
+
+
+def get(pipeline_id: str) -> Optional[Dict[str, Any]]:
+    """状態（view）を返す。他のプロセスが実行中のものは Firestore から読み、止まっていれば引き継ぐ。"""
+    with _lock:
+        run = _runs.get(pipeline_id)
+    if run is not None:
+        with run.lock:
+            return view(_copy_doc(run.doc))
+    snap = _collection().document(pipeline_id).get()
+    if not snap.exists:
+        return None
+    doc = snap.to_dict() or {}
+    if doc.get("status") == "RUNNING" and time.time() - float(doc.get("heartbeat_at") or 0) > PIPELINE_STALE_SEC:
+        resumed = _adopt(snap, doc)
+        if resumed is not None:
+            return resumed
+    return view(doc)
+
+
+def watch(pipeline_id: str, keepalive: float) -> Iterator[Optional[Dict[str, Any]]]:
+    """
+    状態（view）が変わるたびに返し、終了状態を返したら終わる（keepalive 秒変化が無ければ None を返す）。
+    このプロセスで実行中ならメモリ上の更新を待つので Firestore は読まない。
+    他のプロセスが実行中なら、保存される間隔（PIPELINE_SAVE_INTERVAL_SEC）ごとに読む。
+    """
+    last: Optional[Dict[str, Any]] = None
+    seen = -1
+    quiet_since = time.monotonic()
+    while True:
+        with _lock:
+            run = _runs.get(pipeline_id)
+        if run is not None and not run.lost:
+            with run.lock:
+                if run.version == seen:
+                    run.changed.wait(keepalive)
+                seen = run.version
+                current = view(_copy_doc(run.doc))
+        else:
+            if last is not None:
+                time.sleep(PIPELINE_SAVE_INTERVAL_SEC)
+            current = get(pipeline_id)  # 止まっていればここで引き継ぎ、次からはメモリ上を見る
+            if current is None:
+                return
+        if current != last:
+            last = current
+            quiet_since = time.monotonic()
+            yield current
+            if current["status"] != "RUNNING":
+                return
+        elif time.monotonic() - quiet_since >= keepalive:
+            quiet_since = time.monotonic()
+            yield None
+
+
+def pool_stats() -> Dict[str, int]:
+    """stage 実行プールの使用状況（実行中・待ち・ワーカー数）。ベンチマークの利用率計測用。"""
+    with _lock:
+        runs = list(_runs.values())
+    running = pending = 0
+    for run in runs:
+        with run.lock:
+            statuses = [st["status"] for st in run.doc["stages"].values()]
+        running += statuses.count("RUNNING")
+        pending += statuses.count("QUEUED")
+    return {"running": running, "pending": pending, "workers": PIPELINE_WORKERS}
+
+
+def _adopt(snap, doc: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """止まったパイプラインを楽観ロック（update_time）で確保し、途中の stage からやり直す。"""
+    builder = _builders.get(doc.get("kind"))
+    if builder is None:
+        return None
+    try:
+        result = _collection().document(snap.id).update(
+            {"owner": _OWNER, "heartbeat_at": time.time()},
+            option=_db().write_option(last_update_time=snap.update_time),
+        )
+    except Exception as e:
+        print(f"[pipeline] could not adopt {snap.id}: {e}")
+        return None
+    print(f"[pipeline] resuming {snap.id} (was {doc.get('owner')})")
+    doc["owner"] = _OWNER
+    for st in doc["stages"].values():
+        if st["status"] in ("QUEUED", "RUNNING"):
+            st["status"] = "PENDING"  # state（task_id など）は残し、stage 側で続きから実行する
+    run = _Run(doc, builder(doc["params"]), update_time=result.update_time)
+    with _lock:
+        existing = _runs.get(run.id)
+        if existing is not None and not existing.lost:
+            run = existing
+        else:
+            _runs[run.id] = run
+    if run is not existing:
+        run.start_heartbeat()
+        run.schedule()
+    with run.lock:
+        return view(_copy_doc(run.doc))
+
+
+def view(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """API で返す形。progress は stage の重み付き平均、current は実行中の stage。"""
+    stages = doc.get("stages") or {}
+    total = sum(float(st.get("weight") or 0) for st in stages.values()) or 1.0
+    done = sum(
+        float(st.get("weight") or 0) * (100 if st["status"] in TERMINAL_STATUSES else st.get("progress") or 0)
+        for st in stages.values()
+    )
+    return {
+        "id": doc.get("id"),
+        "kind": doc.get("kind"),
+        "status": doc.get("status"),
+        "progress": int(done / total),
+        "current": [name for name, st in stages.items() if st["status"] == "RUNNING"],
+        "stages": {
+            name: {k: st.get(k) for k in ("status", "progress", "result", "error", "state", "started_at", "finished_at")}
+            for name, st in stages.items()
+        },
+        "created_at": doc.get("created_at"),
+        "updated_at": doc.get("updated_at"),
+        "finished_at": doc.get("finished_at"),
+    }
@@ -0,0 +1,127 @@
+import itertools
+from typing import Iterator
+
+# 診断スコア → プロファイル → 生成プロンプト
+# app.py と一括処理スクリプト（scripts/）の両方から使う
+
+# ---- アートスタイル
+ALLOWED_ART_STYLES = {"realistic", "sculpture"}
+STYLE_FALLBACKS = {
+    "cartoon": "realistic",
+    "lowpoly": "realistic",
+    "anime": "realistic",
+    "toon": "realistic",
+}
+
+
+def normalize_art_style(s: str | None) -> str:
+    if not s:
+        return "realistic"
+    s = s.strip().lower()
+    return s if s in ALLOWED_ART_STYLES else STYLE_FALLBACKS.get(s, "realistic")
+
+
+# ---- スコア定義
+TRAITS = [
+    {"id": "energy", "left": "内向的", "right": "外交的"},
+    {"id": "imagination", "left": "現実志向", "right": "直感的"},
+    {"id": "decision", "left": "感情重視", "right": "論理重視"},
+    {"id": "order", "left": "柔軟", "right": "計画的"},
+]
+FIVE_CHOICES_SCORES = [-2, -1, 0, 1, 2]
+
+
+def scores_to_profile(scores: dict[str, int]) -> dict:
+    norm = {k: max(-1.0, min(1.0, v / 20.0)) for k, v in scores.items()}
+    vibe = []
+    if norm.get("energy", 0) > 0.2:
+        vibe.append("cheerful")
+    elif norm.get("energy", 0) < -0.2:
+        vibe.append("calm")
+    if norm.get("decision", 0) > 0.2:
+        vibe.append("cool and sharp")
+    elif norm.get("decision", 0) < -0.2:
+        vibe.append("cute and friendly")
+    theme = "fantasy mage" if norm.get("imagination", 0) > 0 else "student uniform"
+    details = (
+        "tidy and organized outfit"
+        if norm.get("order", 0) > 0
+        else "playful accessories"
+    )
+    e = norm.get("energy", 0)
+    d = norm.get("decision", 0)
+    if e >= 0.3 and d <= 0:
+        color = "pastel pink"
+    elif e >= 0.3 and d > 0:
+        color = "mint green"
+    elif e < 0.3 and d > 0:
+        color = "navy blue"
+    else:
+        color = "lavender"
+    return {
+        "vibe": vibe or ["balanced"],
+        "theme": theme,
+        "details": details,
+        "color": color,
+        "norm": norm,
+    }
+
+
+def profile_to_prompt(profile: dict) -> tuple[str, str]:
+    """リギングしやすい“人型二足歩行”の指示に最適化"""
+    tags = [
+        "humanoid bipedal character, humanlike proportions",
+        "clear limbs and joints, rig-friendly topology",
+        "standing A or T-pose, facing front",
+        ", ".join(profile["vibe"]),
+        f'{profile["color"]} color scheme',
+        profile["theme"],
+        profile["details"],
+        "anime or stylized, cel-shaded, clean topology",
+        "single character, full-body",
+    ]
+    prompt = ", ".join(tags)
+    negative = "super-deformed, chibi, 2.5-heads, big head small body, low quality, low resolution, low poly, deformed hands, extra limbs, photorealistic"
+    return prompt, negative
+
+
+def scores_to_summary_lines(profile: dict) -> list[str]:
+    n = profile["norm"]
+
+    def side(t, l, r):
+        v = n.get(t, 0)
+        if v > 0.3:
+            return f"{r}寄り"
+        if v < -0.3:
+            return f"{l}寄り"
+        return "バランス型"
+
+    return [
+        f"エネルギー: {side('energy','内向','外向')} / 発想: {side('imagination','現実','直感')}",
+        f"判断: {side('decision','感情','論理')} / 進め方: {side('order','柔軟','計画')}",
+        f"雰囲気は {', '.join(profile['vibe'])}、テーマは {profile['theme']}、基調色は {profile['color']}。",
+    ]
+
+
+# スコアの各区間の代表値（scores_to_profile の閾値 -0.2 / 0 / 0.2 / 0.3 をまたぐ値）
+_REPRESENTATIVE_SCORES = [-6, -4, -2, 0, 2, 4, 6]
+
+
+def iter_all_profiles() -> Iterator[dict]:
+    """norm が取り得る全ての値（-1.0〜1.0 の 0.1 刻み）の組み合わせでプロファイルを列挙する。"""
+    ids = [t["id"] for t in TRAITS]
+    for combo in itertools.product(range(-20, 21, 2), repeat=len(ids)):
+        yield scores_to_profile(dict(zip(ids, combo)))
+
+
+def iter_profiles() -> Iterator[dict]:
+    """scores_to_profile が取り得るプロファイルを、プロンプトが重複しないように列挙する。"""
+    seen = set()
+    ids = [t["id"] for t in TRAITS]
+    for combo in itertools.product(_REPRESENTATIVE_SCORES, repeat=len(ids)):
+        profile = scores_to_profile(dict(zip(ids, combo)))
+        prompt, _ = profile_to_prompt(profile)
+        if prompt in seen:
+            continue
+        seen.add(prompt)
+        yield profile
@@ -0,0 +1,136 @@
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import deque
+from typing import Any, Deque, Dict, List
+
+from utils import metrics
+from utils.gemini_client import (
+    GEMINI_API_KEY,
+    generate_questions_raw,
+    fill_questions,
+    _fallback_pool,
+)
+
+# 事前生成した質問セットのプール
+# リクエストはプールから即返し、残りが少なくなったらバックグラウンドで Gemini から補充する
+QUESTION_SET_SIZE = 10
+QUESTION_POOL_SIZE = int(os.getenv("QUESTION_POOL_SIZE", "8"))
+QUESTION_POOL_LOW_WATER = int(os.getenv("QUESTION_POOL_LOW_WATER", "3"))
+QUESTION_POOL_PATH = os.getenv("QUESTION_POOL_PATH", "").strip()  # 空ならメモリのみ
+REFILL_RETRY_SEC = 30  # Gemini 失敗時に次の補充を試すまでの秒数
+
+_pool: Deque[List[Dict[str, Any]]] = deque()
+_lock = threading.Lock()
+_refilling = False
+_last_failure = None  # 直近の Gemini 失敗時刻(monotonic)
+
+_TITLE_STRIP_RE = re.compile(r"[\s、。,.!！?？「」『』（）()・]+")
+
+
+def normalize_title(title: str) -> str:
+    return _TITLE_STRIP_RE.sub("", unicodedata.normalize("NFKC", title or "")).lower()
+
+
+def _dedupe(qs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    seen, out = set(), []
+    for q in qs:
+        key = normalize_title(q.get("title", ""))
+        if not key or key in seen:
+            continue
+        seen.add(key)
+        out.append(q)
+    return out
+
+
+def _signature(qs: List[Dict[str, Any]]) -> frozenset:
+    return frozenset(normalize_title(q.get("title", "")) for q in qs)
+
+
+def _save_locked():
+    if not QUESTION_POOL_PATH:
+        return
+    tmp = QUESTION_POOL_PATH + ".tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(list(_pool), f, ensure_ascii=False)
+        os.replace(tmp, QUESTION_POOL_PATH)
+    except OSError:
+        pass
+
+
+def _load():
+    if not QUESTION_POOL_PATH or not os.path.exists(QUESTION_POOL_PATH):
+        return
+    try:
+        with open(QUESTION_POOL_PATH, encoding="utf-8") as f:
+            sets = json.load(f)
+    except (OSError, ValueError):
+        return
+    with _lock:
+        for qs in sets[:QUESTION_POOL_SIZE]:
+            if isinstance(qs, list) and len(qs) >= QUESTION_SET_SIZE:
+                _pool.append(qs)
+
+
+def _add_set(qs: List[Dict[str, Any]]) -> bool:
+    """重複を除いた質問セットをプールへ追加（既存セットと同じ内容なら捨てる）。"""
+    qs = fill_questions(_dedupe(qs), QUESTION_SET_SIZE)
+    sig = _signature(qs)
+    with _lock:
+        if any(_signature(s) == sig for s in _pool):
+            return False
+        _pool.append(qs)
+        _save_locked()
+        return True
+
+
+def _refill_loop():
+    global _refilling, _last_failure
+    try:
+        while True:
+            with _lock:
+                if len(_pool) >= QUESTION_POOL_SIZE:
+                    return
+            qs = generate_questions_raw(QUESTION_SET_SIZE)
+            if not qs:
+                _last_failure = time.monotonic()
+                return
+            _add_set(qs)
+    finally:
+        with _lock:
+            _refilling = False
+
+
+def start_refill():
+    """プールが下限を割っていれば補充スレッドを起動する（多重起動しない）。"""
+    global _refilling
+    if not GEMINI_API_KEY:
+        return
+    with _lock:
+        if _refilling or len(_pool) >= QUESTION_POOL_LOW_WATER:
+            return
+        if _last_failure is not None and time.monotonic() - _last_failure < REFILL_RETRY_SEC:
+            return
+        _refilling = True
+    threading.Thread(target=_refill_loop, name="question-refill", daemon=True).start()
+
+
+def get_question_set(desired_count: int = 10) -> Dict[str, Any]:
+    """プールから質問セットを1つ取り出して返す。空のときだけフォールバックの質問を使う。"""
+    count = max(1, min(QUESTION_SET_SIZE, int(desired_count or QUESTION_SET_SIZE)))
+    with _lock:
+        qs = _pool.popleft() if _pool else None
+        if qs is not None:
+            _save_locked()
+    start_refill()
+    metrics.cache_result("question_pool", "miss" if qs is None else "hit")
+    if qs is None:
+        return {"version": "v1", "questions": _fallback_pool()[:count]}
+    return {"version": "v1", "questions": qs[:count]}
+
+
+_load()
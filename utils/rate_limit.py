@@ -0,0 +1,146 @@
+import contextlib
+import contextvars
+import heapq
+import itertools
+import os
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Optional, Sequence
+
+# Meshy API 呼び出しのクライアント側レート制限（ワーカープロセス内のスレッドで共有）
+# - 種別（create / status）ごとにトークンバケットを持ち、作成と進捗取得が枠を奪い合わないようにする
+# - 空きを待つ呼び出しは優先度順（同じ優先度なら到着順）にトークンを受け取る
+# - 429 を受けたら（Retry-After があればその秒数）、その種別のバケットを全員分止める
+# 制限値はプロセスあたり。gunicorn のワーカー数を掛けたものが全体の上限になる
+HIGH, NORMAL, LOW = 0, 1, 2
+
+RATE_LIMITS = {
+    # kind: (1秒あたりの補充数, バケット容量)
+    "create": (
+        float(os.getenv("MESHY_CREATE_RATE", "2")),
+        float(os.getenv("MESHY_CREATE_BURST", "5")),
+    ),
+    "status": (
+        float(os.getenv("MESHY_STATUS_RATE", "10")),
+        float(os.getenv("MESHY_STATUS_BURST", "20")),
+    ),
+}
+RATE_LIMIT_MAX_WAIT_SEC = float(os.getenv("MESHY_RATE_LIMIT_MAX_WAIT_SEC", "30"))  # これ以上は待たずに諦める
+RETRY_AFTER_MAX_SEC = 60.0
+
+# 明示しない場合の優先度: ユーザーが待っている進捗取得を最優先、作成は通常
+_DEFAULT_PRIORITY = {"status": HIGH, "create": NORMAL}
+_priority: contextvars.ContextVar[Optional[Dict[str, int]]] = contextvars.ContextVar("meshy_priority", default=None)
+
+
+class RateLimitTimeout(Exception):
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after  # 前に並んでいる分が捌けるまでの目安秒数
+
+
+@contextlib.contextmanager
+def priority(level: int, kinds: Sequence[str] = ("create", "status")):
+    """このブロック内（同じスレッド/コンテキスト）の、kinds に当たる Meshy 呼び出しの優先度を level にする。"""
+    token = _priority.set({**(_priority.get() or {}), **{k: level for k in kinds}})
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority(kind: str) -> int:
+    p = (_priority.get() or {}).get(kind)
+    return _DEFAULT_PRIORITY.get(kind, NORMAL) if p is None else p
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After ヘッダ（秒数 or HTTP-date）を秒数にする。"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        sec = float(value)
+    except ValueError:
+        try:
+            sec = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return max(0.0, min(RETRY_AFTER_MAX_SEC, sec))
+
+
+class _Bucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def wait_time(self, now: float) -> float:
+        """トークンが1つ取れるまでの秒数（0 なら今取れる）。"""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        # 停止中の分は補充しない（解除直後にまとめて払い出さない）
+        elapsed = now - max(self.updated, self.blocked_until)
+        self.tokens = min(self.burst, self.tokens + max(0.0, elapsed) * self.rate)
+        self.updated = now
+        if self.tokens >= 1.0:
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    def __init__(self, limits: Dict[str, tuple]):
+        self._buckets = {k: _Bucket(rate, burst) for k, (rate, burst) in limits.items() if rate > 0}
+        self._waiters: Dict[str, List[tuple]] = {k: [] for k in self._buckets}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def acquire(self, kind: str, prio: Optional[int] = None, timeout: Optional[float] = None):
+        """kind のトークンを1つ取る。順番が来るまで待ち、timeout 秒を超えたら RateLimitTimeout。"""
+        bucket = self._buckets.get(kind)
+        if bucket is None:
+            return
+        prio = current_priority(kind) if prio is None else prio
+        timeout = RATE_LIMIT_MAX_WAIT_SEC if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        waiters = self._waiters[kind]
+        entry = (prio, next(self._seq))
+        with self._cond:
+            heapq.heappush(waiters, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = None
+                    if waiters[0] is entry:
+                        wait = bucket.wait_time(now)
+                        if wait <= 0:
+                            bucket.tokens -= 1.0
+                            return
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        raise RateLimitTimeout(
+                            f"{kind}: waited {timeout:.0f}s for a rate limit slot",
+                            retry_after=max(wait or 0.0, len(waiters) / bucket.rate),
+                        )
+                    self._cond.wait(remaining if wait is None else min(wait, remaining))
+            finally:
+                waiters.remove(entry)
+                heapq.heapify(waiters)
+                self._cond.notify_all()
+
+    def penalize(self, kind: str, seconds: float):
+        """上流から待てと言われた（Retry-After）ので、kind の払い出しを seconds 秒止める。"""
+        bucket = self._buckets.get(kind)
+        if bucket is None or seconds <= 0:
+            return
+        with self._cond:
+            now = time.monotonic()
+            bucket.blocked_until = max(bucket.blocked_until, now + seconds)
+            bucket.tokens = min(bucket.tokens, 0.0)
+            self._cond.notify_all()
+
+
+limiter = RateLimiter(RATE_LIMITS)
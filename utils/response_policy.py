@@ -0,0 +1,174 @@
+import gzip
+import hashlib
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+from flask import Flask, request
+from werkzeug.security import safe_join
+
+# レスポンスのキャッシュ方針と圧縮
+#   - /static: url_for に内容ハッシュ (?v=) を付け、一致するものは immutable で長期キャッシュ
+#   - /downloads: ファイル名が URL のハッシュなので immutable（Range/条件付きは send_file 任せ）
+#   - JSON/テキストは gzip（brotli があれば br）で圧縮。SSE・ファイル・部分レスポンスは触らない
+#   - no-store は動的な /api/* だけ。HTML は毎回再検証させる
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+COMPRESS_MIN_BYTES = 1024
+STATIC_COMPRESS_MAX_BYTES = 2 * 1024 * 1024  # これより大きい静的ファイルはメモリ上で圧縮しない
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5         # 動的レスポンス（毎回圧縮する）
+BROTLI_QUALITY_STATIC = 11  # 静的ファイル（結果をメモリに保持）
+
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/javascript",
+    "text/javascript",
+    "text/html",
+    "text/css",
+    "text/plain",
+    "image/svg+xml",
+    "model/gltf+json",
+)
+
+_fingerprints: Dict[str, Tuple[float, str]] = {}  # path -> (mtime, hash)
+_static_encoded: Dict[Tuple[str, float, str], bytes] = {}  # (path, mtime, encoding) -> body
+_lock = threading.Lock()
+
+
+def _static_path(app: Flask, filename: str) -> Optional[str]:
+    path = safe_join(app.static_folder, filename)
+    return path if path and os.path.isfile(path) else None
+
+
+def fingerprint(app: Flask, filename: str) -> Optional[str]:
+    """静的ファイルの内容ハッシュ（先頭12桁）。mtime が変わったら計算し直す。"""
+    path = _static_path(app, filename)
+    if path is None:
+        return None
+    mtime = os.path.getmtime(path)
+    with _lock:
+        hit = _fingerprints.get(path)
+        if hit and hit[0] == mtime:
+            return hit[1]
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:12]
+    with _lock:
+        _fingerprints[path] = (mtime, digest)
+    return digest
+
+
+def _choose_encoding() -> Optional[str]:
+    accept = request.accept_encodings
+    if brotli is not None and accept["br"]:
+        return "br"
+    if accept["gzip"]:
+        return "gzip"
+    return None
+
+
+def _encode(body: bytes, encoding: str, static: bool = False) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY_STATIC if static else BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def _compressible(resp) -> bool:
+    return (
+        resp.status_code == 200
+        and resp.mimetype in COMPRESSIBLE_TYPES
+        and "Content-Encoding" not in resp.headers
+        and "Content-Range" not in resp.headers
+    )
+
+
+def _weaken_etag(resp):
+    # 圧縮後は別表現なので弱い ETag にする（werkzeug の If-None-Match は弱い比較なので 304 はそのまま効く）
+    etag, weak = resp.get_etag()
+    if etag and not weak:
+        resp.set_etag(etag, weak=True)
+
+
+def _compress_dynamic(resp):
+    if resp.direct_passthrough or resp.is_streamed:
+        return
+    body = resp.get_data()
+    if len(body) < COMPRESS_MIN_BYTES:
+        return
+    encoding = _choose_encoding()
+    if encoding is None:
+        return
+    resp.set_data(_encode(body, encoding))
+    resp.headers["Content-Encoding"] = encoding
+    _weaken_etag(resp)
+
+
+def _compress_static(app: Flask, resp):
+    filename = (request.view_args or {}).get("filename") or ""
+    path = _static_path(app, filename)
+    if path is None:
+        return
+    size = os.path.getsize(path)
+    if size < COMPRESS_MIN_BYTES or size > STATIC_COMPRESS_MAX_BYTES:
+        return
+    encoding = _choose_encoding()
+    if encoding is None:
+        return
+    key = (path, os.path.getmtime(path), encoding)
+    with _lock:
+        body = _static_encoded.get(key)
+    if body is None:
+        with open(path, "rb") as f:
+            body = _encode(f.read(), encoding, static=True)
+        with _lock:
+            for old in [k for k in _static_encoded if k[0] == path and k[1] != key[1]]:
+                del _static_encoded[old]
+            _static_encoded[key] = body
+    resp.close()
+    resp.direct_passthrough = False
+    resp.set_data(body)
+    resp.headers["Content-Encoding"] = encoding
+    resp.headers.pop("Accept-Ranges", None)  # Range は非圧縮の表現に対してだけ受ける
+    _weaken_etag(resp)
+
+
+def init_response_policy(app: Flask):
+    """静的ファイルの fingerprint 付与と、after_request でのキャッシュ・圧縮ヘッダを登録する。"""
+
+    @app.url_defaults
+    def _static_fingerprint(endpoint, values):
+        if endpoint == "static" and "filename" in values and "v" not in values:
+            v = fingerprint(app, values["filename"])
+            if v:
+                values["v"] = v
+
+    @app.after_request
+    def _apply_policy(resp):
+        endpoint = request.endpoint or ""
+        if endpoint == "static":
+            v = request.args.get("v")
+            if v and v == fingerprint(app, (request.view_args or {}).get("filename") or ""):
+                resp.headers["Cache-Control"] = IMMUTABLE
+            else:
+                resp.headers.setdefault("Cache-Control", REVALIDATE)
+            if _compressible(resp):
+                _compress_static(app, resp)
+        elif endpoint == "serve_download":
+            if resp.status_code in (200, 206, 304):
+                resp.headers["Cache-Control"] = IMMUTABLE
+        elif request.path.startswith("/api/"):
+            # キャッシュ方針を個別に決めたレスポンス（図鑑一覧など）はそのまま
+            resp.headers.setdefault("Cache-Control", "no-store")
+            if _compressible(resp):
+                _compress_dynamic(resp)
+        else:
+            resp.headers.setdefault("Cache-Control", REVALIDATE)
+            if _compressible(resp):
+                _compress_dynamic(resp)
+        resp.vary.add("Accept-Encoding")
+        return resp
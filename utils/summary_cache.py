@@ -0,0 +1,175 @@
+import atexit
+import json
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from utils.gemini_client import summarize_profile_jp, fallback_summary_jp
+from utils import metrics
+
+# 診断サマリー（Gemini）のキャッシュ
+# スコアは離散的なので、profile を正規化したキーごとに文章を使い回す
+# ファイルは scripts/precompute_summaries.py が書き出し、サーバーは起動時に読むだけ
+# （gunicorn の各ワーカーが書き戻すと最後に書いたプロセスの内容だけが残るため）。
+# 実行中に生成した文章はプロセス内にだけ持つ
+SUMMARY_CACHE_PATH = os.getenv(
+    "SUMMARY_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "summary_cache.json"),
+)
+# 1 にすると実行中も定期的に書き戻す（ワーカーが1つの開発環境向け）
+SUMMARY_CACHE_WRITEBACK = os.getenv("SUMMARY_CACHE_WRITEBACK", "0").lower() in ("1", "true", "on")
+SUMMARY_VARIANTS = int(os.getenv("SUMMARY_VARIANTS", "3"))  # 1キーあたり保持する文章数
+SUMMARY_CACHE_MAX_ENTRIES = int(os.getenv("SUMMARY_CACHE_MAX_ENTRIES", "5000"))
+SUMMARY_CACHE_TTL_SEC = float(os.getenv("SUMMARY_CACHE_TTL_SEC", str(30 * 24 * 3600)))  # 0 で無期限
+SAVE_INTERVAL_SEC = 30
+
+TRAIT_KEYS = ["energy", "imagination", "decision", "order"]
+
+_entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()  # key -> {"variants": [...], "created_at": ts}
+_lock = threading.Lock()
+_dirty = False
+_last_save = 0.0
+
+
+def _bucket(v: Any) -> float:
+    # _fallback_summary と同じ閾値（強=0.45, 弱=0.20）で丸める
+    try:
+        v = float(v or 0.0)
+    except (TypeError, ValueError):
+        v = 0.0
+    if v >= 0.45:
+        return 0.6
+    if v >= 0.2:
+        return 0.3
+    if v <= -0.45:
+        return -0.6
+    if v <= -0.2:
+        return -0.3
+    return 0.0
+
+
+def canonical_profile(profile: Dict[str, Any]) -> Dict[str, Any]:
+    """文章に効く要素だけ残し、norm を代表値に丸めた profile。"""
+    norm = profile.get("norm") or {}
+    return {
+        "vibe": list(profile.get("vibe") or []),
+        "theme": profile.get("theme"),
+        "details": profile.get("details"),
+        "color": profile.get("color"),
+        "norm": {k: _bucket(norm.get(k)) for k in TRAIT_KEYS},
+    }
+
+
+def summary_key(profile: Dict[str, Any]) -> str:
+    return json.dumps(canonical_profile(profile), sort_keys=True, ensure_ascii=False)
+
+
+def _expired(entry: Dict[str, Any], now: float) -> bool:
+    return SUMMARY_CACHE_TTL_SEC > 0 and now - entry.get("created_at", now) > SUMMARY_CACHE_TTL_SEC
+
+
+def _load():
+    if not SUMMARY_CACHE_PATH or not os.path.exists(SUMMARY_CACHE_PATH):
+        return
+    try:
+        with open(SUMMARY_CACHE_PATH, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return
+    now = time.time()
+    with _lock:
+        for key, entry in data.items():
+            if isinstance(entry, dict) and entry.get("variants") and not _expired(entry, now):
+                _entries[key] = entry
+        while len(_entries) > SUMMARY_CACHE_MAX_ENTRIES:
+            _entries.popitem(last=False)
+
+
+def save():
+    """キャッシュを SUMMARY_CACHE_PATH に書き出す。"""
+    global _dirty, _last_save
+    if not SUMMARY_CACHE_PATH:
+        return
+    with _lock:
+        data = dict(_entries)
+        _dirty = False
+        _last_save = time.monotonic()
+    tmp = f"{SUMMARY_CACHE_PATH}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(SUMMARY_CACHE_PATH) or ".", exist_ok=True)
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, SUMMARY_CACHE_PATH)
+    except OSError:
+        pass
+
+
+def _maybe_save():
+    if not SUMMARY_CACHE_WRITEBACK:
+        return
+    with _lock:
+        due = _dirty and time.monotonic() - _last_save >= SAVE_INTERVAL_SEC
+    if due:
+        save()
+
+
+def _variants(key: str) -> List[str]:
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            return []
+        if _expired(entry, time.time()):
+            del _entries[key]
+            return []
+        _entries.move_to_end(key)
+        return list(entry["variants"])
+
+
+def add_variant(key: str, text: str):
+    global _dirty
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            entry = {"variants": [], "created_at": time.time()}
+            _entries[key] = entry
+        if text not in entry["variants"]:
+            entry["variants"].append(text)
+            _dirty = True
+        _entries.move_to_end(key)
+        while len(_entries) > SUMMARY_CACHE_MAX_ENTRIES:
+            _entries.popitem(last=False)
+
+
+def generate_variant(profile: Dict[str, Any], timeout: Optional[float] = None) -> Optional[str]:
+    """Gemini で1件生成してキャッシュへ追加する。フォールバック文になった場合は None。"""
+    canon = canonical_profile(profile)
+    text = summarize_profile_jp(canon, timeout=timeout)
+    if text == fallback_summary_jp(canon):
+        return None
+    add_variant(summary_key(profile), text)
+    return text
+
+
+def get_summary(profile: Dict[str, Any], timeout: Optional[float] = None) -> str:
+    """
+    キャッシュ済みの文章を返す。保持数が SUMMARY_VARIANTS に満たないキーは
+    新しく生成して追加する（生成に失敗したら既存の文章かフォールバック文）。
+    """
+    key = summary_key(profile)
+    variants = _variants(key)
+    if len(variants) >= max(1, SUMMARY_VARIANTS):
+        metrics.cache_result("summary", "hit")
+        return random.choice(variants)
+    metrics.cache_result("summary", "miss")
+    text = generate_variant(profile, timeout=timeout)
+    _maybe_save()
+    if text:
+        return text
+    return random.choice(variants) if variants else fallback_summary_jp(profile)
+
+
+_load()
+atexit.register(lambda: SUMMARY_CACHE_WRITEBACK and _dirty and save())
@@ -0,0 +1,117 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from utils import metrics
+
+# Meshy タスク状態の短期キャッシュ + single-flight
+# - 進行中のタスクは TTL 秒だけ使い回す
+# - 同じ task_id への同時取得は 1 本の上流リクエストにまとめる
+# - 終了状態（SUCCEEDED/FAILED など）に達したら以後は上流に問い合わせない
+TASK_CACHE_TTL_SEC = float(os.getenv("TASK_CACHE_TTL_SEC", "1.0"))
+TASK_CACHE_MAX_ENTRIES = int(os.getenv("TASK_CACHE_MAX_ENTRIES", "2000"))
+
+TERMINAL_STATUSES = {"SUCCEEDED", "FAILED", "CANCELED", "CANCELLED", "EXPIRED"}
+
+
+class _Flight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[BaseException] = None
+
+
+_entries: "OrderedDict[str, tuple]" = OrderedDict()  # task_id -> (data, fetched_at)
+_inflight: Dict[str, _Flight] = {}
+_lock = threading.Lock()
+_updated = threading.Condition(_lock)
+_versions: Dict[str, int] = {}  # task_id -> 更新回数（待機中のスレッドを起こす判定用）
+
+
+def is_terminal(data: Optional[Dict[str, Any]]) -> bool:
+    return bool(data) and data.get("status") in TERMINAL_STATUSES
+
+
+def _fresh_locked(task_id: str, ttl: float) -> Optional[Dict[str, Any]]:
+    e = _entries.get(task_id)
+    if e is None:
+        return None
+    data, fetched_at = e
+    if is_terminal(data) or time.monotonic() - fetched_at < ttl:
+        _entries.move_to_end(task_id)
+        return data
+    return None
+
+
+def put_task_status(task_id: str, data: Dict[str, Any]):
+    """取得済み（または外部から通知された）タスク状態をキャッシュに入れる。"""
+    with _lock:
+        prev = _entries.get(task_id)
+        # 終了状態を進行中の古い応答で上書きしない
+        if prev is not None and is_terminal(prev[0]) and not is_terminal(data):
+            return
+        _entries[task_id] = (data, time.monotonic())
+        _entries.move_to_end(task_id)
+        while len(_entries) > TASK_CACHE_MAX_ENTRIES:
+            old_id, _ = _entries.popitem(last=False)
+            _versions.pop(old_id, None)
+        _versions[task_id] = _versions.get(task_id, 0) + 1
+        _updated.notify_all()
+
+
+def wait_for_update(task_id: str, timeout: float) -> bool:
+    """task_id の状態が更新される（Webhook 受信など）まで最大 timeout 秒待つ。"""
+    deadline = time.monotonic() + timeout
+    with _lock:
+        start = _versions.get(task_id, 0)
+        while _versions.get(task_id, 0) == start:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            _updated.wait(remaining)
+        return True
+
+
+def get_task_status(
+    task_id: str,
+    fetch: Callable[[str], Dict[str, Any]],
+    ttl: Optional[float] = None,
+) -> Dict[str, Any]:
+    """
+    キャッシュが新しければそれを返し、古ければ fetch(task_id) で取り直す。
+    取得中の別スレッドがいれば、その結果を待って共有する。
+    返す dict は共有オブジェクトなので呼び出し側で書き換えないこと。
+    """
+    ttl = TASK_CACHE_TTL_SEC if ttl is None else ttl
+    with _lock:
+        data = _fresh_locked(task_id, ttl)
+        if data is not None:
+            metrics.cache_result("task_status", "hit")
+            return data
+        flight = _inflight.get(task_id)
+        leader = flight is None
+        if leader:
+            flight = _Flight()
+            _inflight[task_id] = flight
+
+    metrics.cache_result("task_status", "miss" if leader else "shared")
+    if not leader:
+        flight.event.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    try:
+        data = fetch(task_id)
+        flight.result = data
+        put_task_status(task_id, data)
+        return data
+    except BaseException as e:
+        flight.error = e
+        raise
+    finally:
+        with _lock:
+            _inflight.pop(task_id, None)
+        flight.event.set()
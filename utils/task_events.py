@@ -0,0 +1,113 @@
+import os
+import queue
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from utils.meshy_client import MeshyRateLimited
+from utils.task_cache import get_task_status, is_terminal
+
+# タスク進捗の購読（SSE 用）
+# task_id ごとに 1 本だけウォッチャースレッドを立て、購読者全員に配信する
+WATCH_INTERVAL_SEC = float(os.getenv("TASK_WATCH_INTERVAL_SEC", "1.5"))
+# Webhook の有無にかかわらず既定は固定間隔（通知が届かないときの保険として同じ間隔で見る）
+WATCH_MAX_INTERVAL_SEC = float(os.getenv("TASK_WATCH_MAX_INTERVAL_SEC", str(WATCH_INTERVAL_SEC)))
+WATCH_MAX_ERRORS = int(os.getenv("TASK_WATCH_MAX_ERRORS", "5"))
+
+
+class _Watcher:
+    def __init__(self, task_id: str, fetch: Callable[[str], Dict[str, Any]]):
+        self.task_id = task_id
+        self.fetch = fetch
+        self.subscribers: List[queue.Queue] = []
+        self.last: Optional[Dict[str, Any]] = None
+        self.wakeup = threading.Event()
+        self.done = False
+
+
+_watchers: Dict[str, _Watcher] = {}
+_lock = threading.Lock()
+
+
+def _changed(prev: Optional[Dict[str, Any]], cur: Dict[str, Any]) -> bool:
+    if prev is None:
+        return True
+    return prev.get("status") != cur.get("status") or prev.get("progress") != cur.get("progress")
+
+
+def _broadcast_locked(w: _Watcher, event: str, data: Dict[str, Any]):
+    for q in w.subscribers:
+        q.put((event, data))
+
+
+def publish(task_id: str, data: Dict[str, Any]):
+    """新しいタスク状態を購読者へ配信する（変化が無ければ何もしない）。"""
+    with _lock:
+        w = _watchers.get(task_id)
+        if w is None or w.done or not _changed(w.last, data):
+            return
+        w.last = data
+        _broadcast_locked(w, "progress", data)
+        if is_terminal(data):
+            w.done = True
+            _watchers.pop(task_id, None)
+            w.wakeup.set()
+
+
+def _run(w: _Watcher):
+    errors = 0
+    interval = WATCH_INTERVAL_SEC
+    while True:
+        with _lock:
+            if w.done or not w.subscribers:
+                w.done = True
+                if _watchers.get(w.task_id) is w:
+                    del _watchers[w.task_id]
+                return
+        try:
+            data = get_task_status(w.task_id, w.fetch)
+            errors = 0
+            publish(w.task_id, data)
+        except MeshyRateLimited:
+            pass  # 枠が空かなかっただけ。エラーには数えず次の周期で取り直す
+        except Exception as e:
+            errors += 1
+            if errors >= WATCH_MAX_ERRORS:
+                with _lock:
+                    _broadcast_locked(w, "error", {"error": str(e)})
+                    w.done = True
+                    if _watchers.get(w.task_id) is w:
+                        del _watchers[w.task_id]
+                return
+        w.wakeup.wait(interval)
+        w.wakeup.clear()
+        interval = min(interval * 2, WATCH_MAX_INTERVAL_SEC)
+
+
+def subscribe(task_id: str, fetch: Callable[[str], Dict[str, Any]]) -> queue.Queue:
+    """
+    task_id の進捗を受け取るキューを返す。要素は (event, data)。
+    event は "progress"（data に status/progress）または "error"。
+    """
+    q: queue.Queue = queue.Queue()
+    start = False
+    with _lock:
+        w = _watchers.get(task_id)
+        if w is None:
+            w = _Watcher(task_id, fetch)
+            _watchers[task_id] = w
+            start = True
+        w.subscribers.append(q)
+        if w.last is not None:
+            q.put(("progress", w.last))
+    if start:
+        threading.Thread(target=_run, args=(w,), name=f"watch-{task_id}", daemon=True).start()
+    return q
+
+
+def unsubscribe(task_id: str, q: queue.Queue):
+    with _lock:
+        w = _watchers.get(task_id)
+        if w is not None and q in w.subscribers:
+            w.subscribers.remove(q)
+            if not w.subscribers:
+                w.wakeup.set()
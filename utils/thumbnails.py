@@ -0,0 +1,56 @@
+import io
+import os
+from typing import Dict, Optional, Tuple
+
+# サムネイルの縮小・WebP 変換（Pillow が無い環境では元画像をそのまま使う）
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover
+    Image = None
+
+THUMB_SIZES = (256, 768)  # 図鑑グリッド / 詳細表示（長辺 px）
+THUMB_QUALITY = int(os.getenv("THUMB_QUALITY", "80"))
+THUMB_MAX_BYTES = int(os.getenv("THUMB_MAX_BYTES", str(10 * 1024 * 1024)))
+THUMB_MAX_PIXELS = 40_000_000  # 展開後の画素数上限（巨大画像での OOM 防止）
+
+_EXT_BY_TYPE = {
+    "image/webp": "webp",
+    "image/png": "png",
+    "image/jpeg": "jpg",
+    "image/gif": "gif",
+}
+
+
+def resize_available() -> bool:
+    return Image is not None
+
+
+def make_thumbnails(data: bytes) -> Dict[int, bytes]:
+    """
+    画像バイト列から THUMB_SIZES ごとの WebP を作って {size: bytes} を返す。
+    元画像より大きいサイズは作らない（最小サイズだけは必ず作る）。
+    """
+    if Image is None:
+        raise RuntimeError("Pillow is not installed")
+    with Image.open(io.BytesIO(data)) as src:
+        if src.width * src.height > THUMB_MAX_PIXELS:
+            raise ValueError(f"thumbnail too large ({src.width}x{src.height})")
+        src.load()
+        img = src.convert("RGBA" if "A" in src.getbands() or src.mode == "P" else "RGB")
+
+    out: Dict[int, bytes] = {}
+    for size in sorted(THUMB_SIZES):
+        if out and max(img.size) <= size // 2:
+            break
+        t = img.copy()
+        t.thumbnail((size, size), Image.LANCZOS)
+        buf = io.BytesIO()
+        t.save(buf, format="WEBP", quality=THUMB_QUALITY, method=4)
+        out[size] = buf.getvalue()
+    return out
+
+
+def passthrough(data: bytes, content_type: Optional[str]) -> Tuple[bytes, str, str]:
+    """リサイズできないときの (bytes, content_type, ext)。"""
+    ctype = (content_type or "").split(";")[0].strip().lower()
+    return data, ctype or "application/octet-stream", _EXT_BY_TYPE.get(ctype, "img")
@@ -0,0 +1,187 @@
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+# リクエスト単位の簡易トレース
+#   - 上流呼び出し（metrics.instrumented）や待ち処理を span として記録し、Server-Timing ヘッダで返す
+#   - サンプリングされたトレースは TRACE_EXPORT_PATH に JSON Lines で追記する
+#   - 無効時はコンテキスト変数を1回見るだけで何もしない
+# span はコンテキスト変数でつながる。fan_out は呼び出し元のコンテキストを引き継ぎ、
+# バックグラウンドジョブは同じ trace_id を持つ別トレースとして記録される
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "0") == "1"
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))  # ファイル出力する割合（Server-Timing は全件）
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "").strip()
+SERVER_TIMING_MAX_ENTRIES = 20  # ヘッダが膨らみすぎないよう、長い順にこの件数まで
+
+_trace: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar("trace", default=None)
+_parent: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("trace_parent", default=None)
+_export_lock = threading.Lock()
+
+
+class Trace:
+    def __init__(self, name: str, trace_id: Optional[str] = None):
+        self.name = name
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.sampled = bool(TRACE_EXPORT_PATH) and random.random() < TRACE_SAMPLE_RATE
+        self.started_at = time.time()
+        self.t0 = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []  # append は GIL 下で原子的なので fan_out 先から直接足す
+        self.attrs: Dict[str, Any] = {}
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.t0) * 1000.0
+
+    def server_timing(self) -> str:
+        """同名の span は合算して `name;dur=..;desc="xN"` の形にする。最後に total を付ける。"""
+        totals: Dict[str, List[float]] = {}
+        for s in self.spans:
+            t = totals.setdefault(s["name"], [0.0, 0])
+            t[0] += s["dur_ms"]
+            t[1] += 1
+        top = sorted(totals.items(), key=lambda kv: kv[1][0], reverse=True)[:SERVER_TIMING_MAX_ENTRIES]
+        parts = [
+            f'{name};dur={dur:.1f}' + (f';desc="x{n}"' if n > 1 else "")
+            for name, (dur, n) in top
+        ]
+        parts.append(f'total;dur={self.elapsed_ms():.1f};desc="{self.trace_id}"')
+        return ", ".join(parts)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": round(self.elapsed_ms(), 3),
+            "attrs": self.attrs,
+            "spans": list(self.spans),
+        }
+
+
+class _Span:
+    __slots__ = ("trace", "name", "attrs", "span_id", "parent_id", "t0", "_token")
+
+    def __init__(self, trace: Trace, name: str, attrs: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = _parent.get()
+        self._token = _parent.set(self.span_id)
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        t1 = time.perf_counter()
+        _parent.reset(self._token)
+        rec = {
+            "id": self.span_id,
+            "parent": self.parent_id,
+            "name": self.name,
+            "start_ms": round((self.t0 - self.trace.t0) * 1000.0, 3),
+            "dur_ms": round((t1 - self.t0) * 1000.0, 3),
+        }
+        if self.attrs:
+            rec["attrs"] = self.attrs
+        if exc_type is not None:
+            rec["error"] = exc_type.__name__
+        self.trace.spans.append(rec)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name: str, **attrs):
+    """with span("meshy.create"): ... 。トレース中でなければ何もしない。"""
+    trace = _trace.get()
+    if trace is None:
+        return _NOOP
+    return _Span(trace, name, attrs)
+
+
+def current_trace() -> Optional[Trace]:
+    return _trace.get()
+
+
+def start(name: str, trace_id: Optional[str] = None, sampled: Optional[bool] = None):
+    """
+    新しいトレースを現在のコンテキストに設定する。無効時は None。finish() に戻り値を渡す。
+    trace_id / sampled を渡すと呼び出し元（ジョブを投げたリクエスト）のトレースにそろえる。
+    """
+    if not TRACE_ENABLED:
+        return None
+    trace = Trace(name, trace_id)
+    if sampled is not None:
+        trace.sampled = sampled
+    return trace, _trace.set(trace), _parent.set(None)
+
+
+def finish(started, **attrs):
+    """start() したトレースを閉じ、サンプル対象なら書き出す。"""
+    if started is None:
+        return
+    trace, token, parent_token = started
+    try:
+        _parent.reset(parent_token)
+        _trace.reset(token)
+    except ValueError:
+        # ストリーミング応答などで別コンテキストから閉じられた場合
+        _parent.set(None)
+        _trace.set(None)
+    trace.attrs.update(attrs)
+    if trace.sampled:
+        export(trace)
+
+
+def export(trace: Trace):
+    try:
+        line = json.dumps(trace.to_dict(), ensure_ascii=False, default=str)
+        with _export_lock, open(TRACE_EXPORT_PATH, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+    except Exception as e:
+        print(f"[tracing] export failed: {e}")
+
+
+def init_tracing(app):
+    """リクエストごとにトレースを開始し、Server-Timing を付けて、終了時に書き出す。"""
+    if not TRACE_ENABLED:
+        return
+    from flask import g, request
+
+    @app.before_request
+    def _trace_start():
+        g._trace = start(f"{request.method} {request.path}")
+
+    @app.after_request
+    def _trace_header(resp):
+        trace = _trace.get()
+        if trace is not None:
+            trace.attrs["status"] = resp.status_code
+            resp.headers["Server-Timing"] = trace.server_timing()
+        return resp
+
+    @app.teardown_request
+    def _trace_end(exc):
+        started = g.pop("_trace", None)
+        if started is None:
+            return
+        rule = request.url_rule
+        finish(started, route=rule.rule if rule is not None else "unmatched",
+               error=exc.__class__.__name__ if exc is not None else None)
@@ -0,0 +1,103 @@
+import hmac
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from utils.task_cache import put_task_status
+from utils.task_events import publish
+
+# Meshy の Webhook 受信
+# Meshy ダッシュボードには https://<host>/api/webhooks/meshy?token=<SECRET> を登録する
+# Webhook はどれか1つのワーカーにしか届かないので、受けたプロセスは task_updates/<task_id> に書き、
+# 各プロセスは init_webhooks で task_updates を1本のリスナーで監視して自分の待機者（ジョブ・SSE）を起こす
+MESHY_WEBHOOK_SECRET = os.getenv("MESHY_WEBHOOK_SECRET", "").strip()
+WEBHOOKS_ENABLED = bool(MESHY_WEBHOOK_SECRET)
+UPDATES_COLLECTION = "task_updates"
+UPDATES_TTL_SEC = int(os.getenv("TASK_UPDATES_TTL_SEC", "3600"))  # expires_at（Firestore の TTL ポリシー用）
+
+_OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def _db():
+    # Firebase の初期化は実際に参照するときまで遅らせる
+    from utils.firebase_storage import db
+
+    return db
+
+
+def verify_token(token: Optional[str]) -> bool:
+    if not WEBHOOKS_ENABLED or not token:
+        return False
+    return hmac.compare_digest(token.encode(), MESHY_WEBHOOK_SECRET.encode())
+
+
+def _apply(task_id: str, data: Dict[str, Any]):
+    put_task_status(task_id, data)
+    publish(task_id, data)
+
+
+def _share(task_id: str, data: Dict[str, Any]):
+    # 書けなくても受けたプロセスの待機者は起きている（他のプロセスはポーリングで拾う）
+    try:
+        _db().collection(UPDATES_COLLECTION).document(task_id).set(
+            {
+                "task": data,
+                "origin": _OWNER,
+                "received_at": time.time(),
+                "expires_at": datetime.fromtimestamp(time.time() + UPDATES_TTL_SEC, timezone.utc),
+            }
+        )
+    except Exception as e:
+        print(f"[webhooks] could not share {task_id}: {e}")
+
+
+def ingest_task_update(payload: Dict[str, Any]) -> Optional[str]:
+    """
+    通知されたタスクオブジェクトをキャッシュへ反映し、待機中のジョブ/購読者を起こす。
+    他のワーカーにも task_updates 経由で伝える。task_id を返す（識別できなければ None）。
+    """
+    task_id = str(payload.get("id") or payload.get("task_id") or "").strip()
+    if not task_id or not payload.get("status"):
+        return None
+    data = dict(payload)
+    data.setdefault("id", task_id)
+    _apply(task_id, data)
+    _share(task_id, data)
+    return task_id
+
+
+def _on_snapshot(docs, changes, read_time):
+    for change in changes:
+        if change.type.name == "REMOVED":
+            continue
+        doc = change.document.to_dict() or {}
+        task = doc.get("task")
+        if doc.get("origin") == _OWNER or not isinstance(task, dict):
+            continue  # 自分が受けた分は ingest_task_update で反映済み
+        _apply(change.document.id, task)
+
+
+def init_webhooks(app):
+    """Webhook が有効なら、他のワーカーが受けた通知を task_updates の監視で受け取り始める。"""
+    global _listener
+    if not WEBHOOKS_ENABLED:
+        return
+    from firebase_admin import firestore
+
+    with _listener_lock:
+        if _listener is not None:
+            return
+        try:
+            # 起動以降に届いた分だけを見る（初回スナップショットで過去の通知を流し直さない）
+            query = _db().collection(UPDATES_COLLECTION).where(
+                filter=firestore.FieldFilter("received_at", ">=", time.time())
+            )
+            _listener = query.on_snapshot(_on_snapshot)
+        except Exception as e:
+            print(f"[webhooks] could not watch {UPDATES_COLLECTION}: {e}")